@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# pacifica-dispatcher-proxymod: benchmarks/database_benchmark.py
+#
+# Copyright (c) 2019, Battelle Memorial Institute
+# All rights reserved.
+#
+# See LICENSE and WARRANTY for details.
+"""
+Load test of the database of the receiver on a local SQLite file.
+
+Saves events in the receiver table from many processes, the way the
+receive task does, once with plain connections as before and once with
+pooled connections to a tuned SQLite file, reporting the events per
+second and checking the tuned database is faster.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+import typing
+import uuid
+
+from pacifica.dispatcher.receiver import create_peewee_model
+from pacifica.dispatcher_proxymod.batches import to_receive_task_row
+from pacifica.dispatcher_proxymod.databases import connect_database, connected_db_context
+
+MODES_ = ('plain', 'tuned', )
+
+
+def _connect(mode: str, url: str) -> typing.Any:
+    """Return the database of the mode."""
+    if mode == 'plain':
+        return connect_database(url, sqlite_journal_mode='', sqlite_synchronous='')
+    return connect_database(url, pool=True)
+
+
+def save_events(mode: str, url: str, events_count: int) -> None:
+    """Save the events and update their status three times, connecting for every query like the receive task."""
+    database = _connect(mode, url)
+    receive_task_model = create_peewee_model(database)
+    for index in range(events_count):
+        task_id = str(uuid.uuid4())
+        with connected_db_context(database):
+            receive_task_model.insert(to_receive_task_row(
+                {'eventID': str(index), 'data': []}, task_id, 'benchmark', 'receive')).execute()
+        for task_status in ['102 Processing', '200 OK']:
+            with connected_db_context(database):
+                receive_task_model.update(task_status=task_status).where(
+                    receive_task_model.task_id == task_id).execute()
+
+
+def run_benchmark(mode: str, processes_count: int, events_count: int) -> float:
+    """Save the events from the processes to a new SQLite file, returning the events per second."""
+    with tempfile.TemporaryDirectory() as tempdir_name:
+        url = 'sqlite:///{0}'.format(os.path.join(tempdir_name, 'db.sqlite3'))
+        database = _connect(mode, url)
+        with connected_db_context(database):
+            create_peewee_model(database).create_table(safe=True)
+        processes = [
+            multiprocessing.Process(target=save_events, args=(mode, url, events_count))
+            for _index in range(processes_count)
+        ]
+        start = time.perf_counter()
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+        seconds = time.perf_counter() - start
+        if any(process.exitcode for process in processes):
+            raise RuntimeError('a process failed to save its events')
+    return processes_count * events_count / seconds
+
+
+def main(argv: list = None) -> int:
+    """Run the load test, returning non-zero if the tuned database is not faster."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--processes', dest='processes_count', type=int, default=4,
+                        help='number of processes saving events at the same time')
+    parser.add_argument('--events', dest='events_count', type=int, default=200,
+                        help='number of events saved by every process')
+    parser.add_argument('--save', metavar='FILE', help='save the results as JSON to the file')
+    parser.add_argument('--min-speedup', type=float, default=1.0,
+                        help='smallest allowed ratio between the tuned and the plain events per second')
+    args = parser.parse_args(argv)
+
+    result = {
+        'parameters': {'processes': args.processes_count, 'events': args.events_count},
+        'modes': {}, 'time': time.time(),
+    }
+    for mode in MODES_:
+        result['modes'][mode] = run_benchmark(mode, args.processes_count, args.events_count)
+        print('{0:<8} {1:>10.1f} events/s'.format(mode, result['modes'][mode]))
+    speedup = result['modes']['tuned'] / result['modes']['plain']
+    print('speedup  {0:>10.2f}x'.format(speedup))
+
+    if args.save is not None:
+        with open(args.save, mode='w') as result_file:
+            json.dump(result, result_file, indent=2, sort_keys=True)
+
+    if speedup < args.min_speedup:
+        print('tuned database is slower than {0:.2f}x the plain database'.format(args.min_speedup))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# pacifica-dispatcher-proxymod: benchmarks/executor_benchmark.py
+#
+# Copyright (c) 2019, Battelle Memorial Institute
+# All rights reserved.
+#
+# See LICENSE and WARRANTY for details.
+"""
+Benchmark of the startup latency of the proxymod model runs.
+
+Runs a model importing heavy modules in a new process per run, once
+cold, in a spawned process importing the modules again, and once warm,
+in a process forked from a fork server that preloaded the modules,
+checking the warm runs are faster.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+import typing
+
+from pacifica.dispatcher_proxymod.model_runners import ForkServerModelRunner, ProcessPoolModelRunner
+from handler_benchmark import to_stats  # pylint: disable=wrong-import-order
+
+MODULE_NAMES_ = [
+    'proxymod', 'numpy', 'pandas', 'asyncio', 'decimal', 'email.mime.multipart', 'http.client', 'xml.dom.minidom',
+]
+
+MODEL_SOURCE_ = '''
+import importlib
+
+
+def model_one(*module_names):
+    for module_name in module_names:
+        try:
+            importlib.import_module(module_name)
+        except ImportError:
+            pass
+'''
+
+
+def time_runs(runs_count: int, create_model_runner: typing.Callable[[], ProcessPoolModelRunner],
+              model: typing.Tuple[str, str], module_names: typing.List[str],
+              log_dir_name: str) -> typing.List[float]:
+    """Return the wall-clock times of the model runs, each with a model runner from the factory."""
+    seconds = []
+    for _index in range(runs_count):
+        model_runner = create_model_runner()
+        try:
+            start = time.perf_counter()
+            model_runner.run(model, module_names, log_dir_name)
+            seconds.append(time.perf_counter() - start)
+        finally:
+            model_runner.close()
+    return seconds
+
+
+def main(argv: list = None) -> int:
+    """Run the benchmark, returning non-zero if the warm model runs are not faster."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--runs', type=int, default=10, help='number of model runs per mode')
+    parser.add_argument('--modules', default=','.join(MODULE_NAMES_),
+                        help='comma separated modules imported by the model and preloaded, missing ones are skipped')
+    parser.add_argument('--min-speedup', type=float, default=2.0,
+                        help='smallest allowed ratio between the median cold and warm startup times')
+    args = parser.parse_args(argv)
+
+    module_names = [module_name.strip() for module_name in args.modules.split(',') if module_name.strip()]
+    with tempfile.TemporaryDirectory() as tempdir_name:
+        file_name = os.path.join(tempdir_name, 'model_one.py')
+        with open(file_name, mode='w') as file:
+            file.write(MODEL_SOURCE_)
+        model = ('model_one', file_name)
+
+        # NOTE Every worker process imports this main module again, its imports are preloaded too.
+        warm_model_runner = ForkServerModelRunner(processes=1, preload_module_names=module_names + [
+            'handler_benchmark'])
+        warm_model_runner.warm()
+        # NOTE The first run waits for the fork server to import the modules, like the first event of a worker.
+        warm_model_runner.run(model, module_names, tempdir_name)
+
+        stats_by_mode = {
+            'cold': to_stats(time_runs(
+                args.runs, lambda: ProcessPoolModelRunner(processes=1, start_method='spawn'), model, module_names,
+                tempdir_name)),
+            'warm': to_stats(time_runs(args.runs, lambda: warm_model_runner, model, module_names, tempdir_name)),
+        }
+
+    for mode, stats in stats_by_mode.items():
+        print('{0:<5} median {1:>10.3f} ms min {2:>10.3f} ms max {3:>10.3f} ms'.format(
+            mode, stats['median'] * 1e3, stats['min'] * 1e3, stats['max'] * 1e3))
+    speedup = stats_by_mode['cold']['median'] / stats_by_mode['warm']['median']
+    print('speedup {0:.2f}x'.format(speedup))
+    if speedup < args.min_speedup:
+        print('the warm model runs are {0:.2f}x faster, not {1:.2f}x'.format(speedup, args.min_speedup))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
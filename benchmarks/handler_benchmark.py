@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# pacifica-dispatcher-proxymod: benchmarks/handler_benchmark.py
+#
+# Copyright (c) 2019, Battelle Memorial Institute
+# All rights reserved.
+#
+# See LICENSE and WARRANTY for details.
+"""
+Benchmark of the proxymod event handler.
+
+Handles synthetic events end to end with the local download and upload
+runners and reports the timings of every stage of the event handler.
+The results can be saved and compared against a saved baseline.
+"""
+import argparse
+import json
+import statistics
+import sys
+import tempfile
+import time
+import typing
+
+from cloudevents.model import Event
+
+from pacifica.dispatcher.downloader_runners import LocalDownloaderRunner
+from pacifica.dispatcher.uploader_runners import LocalUploaderRunner
+
+from pacifica.dispatcher_proxymod.event_handlers import ProxEventHandler
+from pacifica.dispatcher_proxymod.timers import RecordingStageTimer
+
+from synthetic_events import generate_event  # pylint: disable=wrong-import-order
+
+PARAMETER_NAMES_ = ['configs_count', 'key_values_count', 'input_files_count', 'input_rows', 'model_files_count']
+
+
+def to_stats(durations: typing.List[float]) -> typing.Dict[str, float]:
+    """Return the statistics of the durations in seconds."""
+    return {
+        'count': len(durations),
+        'mean': statistics.mean(durations),
+        'median': statistics.median(durations),
+        'min': min(durations),
+        'max': max(durations),
+    }
+
+
+def run_benchmark(events_count: int, parameters: typing.Dict[str, int]) -> typing.Dict[str, typing.Any]:
+    """Handle the synthetic events and return the statistics of the stage timings."""
+    stage_timer = RecordingStageTimer()
+    with tempfile.TemporaryDirectory() as basedir_name:
+        event_data = generate_event(basedir_name, **parameters)
+        event_handler = ProxEventHandler(
+            LocalDownloaderRunner('{0}/data'.format(basedir_name)), LocalUploaderRunner(), stage_timer=stage_timer)
+        for _index in range(events_count):
+            event_handler.handle(Event(event_data))
+    return {
+        'parameters': parameters,
+        'stages': {stage_name: to_stats(durations) for stage_name, durations in stage_timer.durations.items()},
+    }
+
+
+def compare(result: typing.Dict[str, typing.Any], baseline: typing.Dict[str, typing.Any],
+            max_slowdown: float) -> bool:
+    """Print the median of every stage relative to the baseline, returning false for any slowdown."""
+    if result['parameters'] != baseline['parameters']:
+        print('warning: the baseline was run with other parameters {0}'.format(baseline['parameters']))
+    okay = True
+    for stage_name, stats in sorted(result['stages'].items()):
+        baseline_stats = baseline['stages'].get(stage_name)
+        if baseline_stats is None:
+            continue
+        ratio = stats['median'] / baseline_stats['median'] if baseline_stats['median'] else 1.0
+        slower = ratio > max_slowdown
+        okay = okay and not slower
+        print('{0:>10} {1:>10.3f} ms {2:>10.3f} ms {3:>6.2f}x{4}'.format(
+            stage_name, baseline_stats['median'] * 1e3, stats['median'] * 1e3, ratio, ' SLOWER' if slower else ''))
+    return okay
+
+
+def main(argv: list = None) -> int:
+    """Run the benchmark, returning non-zero if it is slower than the baseline."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--events', dest='events_count', type=int, default=5, help='number of events to handle')
+    parser.add_argument('--configs', dest='configs_count', type=int, default=3,
+                        help='number of configuration files (at least 3)')
+    parser.add_argument('--key-values', dest='key_values_count', type=int, default=0,
+                        help='number of metadata key values')
+    parser.add_argument('--input-files', dest='input_files_count', type=int, default=2,
+                        help='number of input files (at least 2)')
+    parser.add_argument('--input-rows', dest='input_rows', type=int, default=19,
+                        help='number of rows of every input file')
+    parser.add_argument('--model-files', dest='model_files_count', type=int, default=3,
+                        help='number of model files')
+    parser.add_argument('--save', metavar='FILE', help='save the results as JSON to the file')
+    parser.add_argument('--baseline', metavar='FILE', help='compare the results against the saved results')
+    parser.add_argument('--max-slowdown', type=float, default=1.25,
+                        help='largest allowed ratio between the median stage timings and the baseline')
+    args = parser.parse_args(argv)
+
+    parameters = {parameter_name: getattr(args, parameter_name) for parameter_name in PARAMETER_NAMES_}
+    result = run_benchmark(args.events_count, parameters)
+    result['time'] = time.time()
+
+    print('{0:>10} {1:>10} {2:>10} {3:>10} {4:>10}'.format('stage', 'count', 'median ms', 'min ms', 'max ms'))
+    for stage_name, stats in sorted(result['stages'].items()):
+        print('{0:>10} {1:>10} {2:>10.3f} {3:>10.3f} {4:>10.3f}'.format(
+            stage_name, stats['count'], stats['median'] * 1e3, stats['min'] * 1e3, stats['max'] * 1e3))
+
+    if args.save is not None:
+        with open(args.save, mode='w') as result_file:
+            json.dump(result, result_file, indent=2, sort_keys=True)
+
+    if args.baseline is not None:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+        if not compare(result, baseline, args.max_slowdown):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
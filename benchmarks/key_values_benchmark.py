@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# pacifica-dispatcher-proxymod: benchmarks/key_values_benchmark.py
+#
+# Copyright (c) 2019, Battelle Memorial Institute
+# All rights reserved.
+#
+# See LICENSE and WARRANTY for details.
+"""
+Benchmark of the proxymod transaction key value indexing.
+
+Times the validation of the proxymod transaction key values of events
+with more and more metadata key values and checks that the time per key
+value stays about the same, i.e. that the validation scales linearly.
+"""
+import argparse
+import sys
+import timeit
+
+from pacifica.dispatcher.models import TransactionKeyValue
+
+from pacifica.dispatcher_proxymod.event_handlers import _assert_valid_proxevent
+
+CONFIG_KEY_VALUES_ = [
+    ('proxymod.configs_count', '1'),
+    ('proxymod.config_1.PROJECT.runtime', '1'),
+    ('proxymod.config_1.PROJECT.failure', '0'),
+    ('proxymod.config_1.INPUTS.in_dir', 'inputs/'),
+    ('proxymod.config_1.INPUTS.in_file_one', 'in_file_one.csv'),
+    ('proxymod.config_1.INPUTS.in_file_two', 'in_file_two.csv'),
+    ('proxymod.config_1.OUTPUTS.out_dir', 'outputs/'),
+]
+
+
+def to_transaction_key_values(metadata_count: int) -> list:
+    """Return the key values of an event with the proxymod configuration among the metadata."""
+    transaction_key_values = [
+        TransactionKeyValue(key='instrument.metadata_{0}'.format(index), value=str(index))
+        for index in range(metadata_count)
+    ]
+    for index, (key, value) in enumerate(CONFIG_KEY_VALUES_):
+        transaction_key_values.insert(
+            (index + 1) * metadata_count // (len(CONFIG_KEY_VALUES_) + 1), TransactionKeyValue(key=key, value=value))
+    return transaction_key_values
+
+
+def main(argv: list = None) -> int:
+    """Run the benchmark, returning non-zero if the validation does not scale linearly."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000],
+                        help='numbers of metadata key values of the events')
+    parser.add_argument('--repeat', type=int, default=5, help='number of timings per size, the best is kept')
+    parser.add_argument('--max-ratio', type=float, default=2.0,
+                        help='largest allowed ratio between the time per key value of two sizes')
+    args = parser.parse_args(argv)
+
+    times_per_key_value = []
+    for metadata_count in args.sizes:
+        transaction_key_values = to_transaction_key_values(metadata_count)
+        best_time = min(timeit.repeat(
+            lambda: _assert_valid_proxevent(transaction_key_values, None),  # pylint: disable=cell-var-from-loop
+            number=1, repeat=args.repeat))
+        times_per_key_value.append(best_time / len(transaction_key_values))
+        print('{0:>10} key values {1:>10.3f} ms {2:>8.1f} ns/key value'.format(
+            len(transaction_key_values), best_time * 1e3, times_per_key_value[-1] * 1e9))
+
+    ratio = max(times_per_key_value) / min(times_per_key_value)
+    print('time per key value ratio {0:.2f} (max {1:.2f})'.format(ratio, args.max_ratio))
+    return 0 if ratio <= args.max_ratio else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
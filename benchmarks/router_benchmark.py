@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# pacifica-dispatcher-proxymod: benchmarks/router_benchmark.py
+#
+# Copyright (c) 2019, Battelle Memorial Institute
+# All rights reserved.
+#
+# See LICENSE and WARRANTY for details.
+"""
+Micro-benchmark of routing large events through many routes.
+
+Times matching ingest events with many metadata key values, with and
+without the proxymod key values, against routers with many proxymod
+routes, once with the plain JSONPath and once with the prefiltered
+JSONPath, checking both match the same routes and the prefiltered
+router is faster for the events that are not proxymod events.
+"""
+import argparse
+import sys
+import tempfile
+import timeit
+import typing
+
+from jsonpath2.path import Path
+
+from pacifica.dispatcher.router import Router
+
+from pacifica.dispatcher_proxymod.router import PROXYMOD_PATH_FILE_NAME_, PrefilteredPath, may_match_proxymod
+from synthetic_events import generate_event  # pylint: disable=wrong-import-order
+
+
+def to_events_data(key_values_count: int) -> typing.Dict[str, typing.Dict[str, typing.Any]]:
+    """Return a proxymod event and the same event without its proxymod key values, by name."""
+    with tempfile.TemporaryDirectory() as basedir_name:
+        event_data = generate_event(basedir_name, key_values_count=key_values_count)
+    other_event_data = dict(event_data, data=[
+        item for item in event_data['data'] if not str(item.get('key', '')).startswith('proxymod.')
+    ])
+    return {'proxymod': event_data, 'other': other_event_data}
+
+
+def to_router(path: typing.Any, routes_count: int) -> Router:
+    """Return a router with the routes of the path."""
+    router = Router()
+    for _index in range(routes_count):
+        router.add_route(path, None)
+    return router
+
+
+def main(argv: list = None) -> int:
+    """Run the benchmark, returning non-zero if the prefiltered router is wrong or not faster."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--key-values', dest='key_values_count', type=int, default=1000,
+                        help='number of metadata key values of the events')
+    parser.add_argument('--routes', dest='routes_count', type=int, default=10, help='number of routes')
+    parser.add_argument('--repeat', type=int, default=5, help='number of timings per router, the best is kept')
+    parser.add_argument('--min-speedup', type=float, default=10.0,
+                        help='smallest allowed ratio between the plain and the prefiltered time of other events')
+    args = parser.parse_args(argv)
+
+    path = Path.parse_file(PROXYMOD_PATH_FILE_NAME_)
+    routers = {
+        'plain': to_router(path, args.routes_count),
+        'prefiltered': to_router(PrefilteredPath(path, may_match_proxymod), args.routes_count),
+    }
+    speedup = None
+    for event_name, event_data in to_events_data(args.key_values_count).items():
+        matches_by_router_name = {}
+        seconds_by_router_name = {}
+        for router_name, router in routers.items():
+            matches_by_router_name[router_name] = len(list(router.match(event_data)))
+            seconds_by_router_name[router_name] = min(timeit.repeat(
+                lambda router=router: list(router.match(event_data)), number=1, repeat=args.repeat))
+            print('{0:<8} {1:<11} {2:>3} routes {3:>12.3f} ms'.format(
+                event_name, router_name, matches_by_router_name[router_name],
+                seconds_by_router_name[router_name] * 1e3))
+        if matches_by_router_name['plain'] != matches_by_router_name['prefiltered']:
+            print('the prefiltered router matches {0} routes, not {1}'.format(
+                matches_by_router_name['prefiltered'], matches_by_router_name['plain']))
+            return 1
+        if event_name == 'other':
+            speedup = seconds_by_router_name['plain'] / seconds_by_router_name['prefiltered']
+
+    print('speedup of other events {0:.1f}x'.format(speedup))
+    if speedup < args.min_speedup:
+        print('the prefiltered router is slower than {0:.1f}x the plain router'.format(args.min_speedup))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
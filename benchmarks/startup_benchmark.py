@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# pacifica-dispatcher-proxymod: benchmarks/startup_benchmark.py
+#
+# Copyright (c) 2019, Battelle Memorial Institute
+# All rights reserved.
+#
+# See LICENSE and WARRANTY for details.
+"""
+Benchmark of the startup time of the proxymod dispatcher.
+
+Imports the modules loaded by the Celery workers and the web servers in
+fresh Python processes, reports the import times and the slowest
+imports from the ``-X importtime`` profile, and compares the import
+times against a saved baseline.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import typing
+
+from handler_benchmark import compare, to_stats  # pylint: disable=wrong-import-order
+
+MODULE_NAMES_ = [
+    'pacifica.dispatcher_proxymod.router',
+    'pacifica.dispatcher_proxymod.__main__',
+]
+
+
+def profile_import(module_name: str) -> typing.Tuple[float, typing.List[typing.Tuple[int, str]]]:
+    """Import the module in a new process, returning the wall-clock time and the cumulative import times."""
+    with tempfile.TemporaryDirectory() as tempdir_name:
+        env = dict(os.environ)
+        # NOTE Keep the database of the main module out of the working directory.
+        env.setdefault('DATABASE_URL', 'sqlite:///{0}'.format(os.path.join(tempdir_name, 'db.sqlite3')))
+        start = time.perf_counter()
+        process = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', 'import {0}'.format(module_name)],
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env, cwd=tempdir_name, check=True,
+            universal_newlines=True)
+        seconds = time.perf_counter() - start
+    imports = []
+    for line in process.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        (_self_us, cumulative_us, imported_name) = line[len('import time:'):].split('|')
+        imports.append((int(cumulative_us), imported_name.strip()))
+    return (seconds, imports)
+
+
+def main(argv: list = None) -> int:
+    """Run the benchmark, returning non-zero if it is slower than the baseline."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--repeat', type=int, default=5, help='number of imports per module')
+    parser.add_argument('--top', type=int, default=10, help='number of slowest imports to print per module')
+    parser.add_argument('--save', metavar='FILE', help='save the results as JSON to the file')
+    parser.add_argument('--baseline', metavar='FILE', help='compare the results against the saved results')
+    parser.add_argument('--max-slowdown', type=float, default=1.25,
+                        help='largest allowed ratio between the median import times and the baseline')
+    args = parser.parse_args(argv)
+
+    result = {'parameters': {'repeat': args.repeat}, 'stages': {}, 'time': time.time()}
+    for module_name in MODULE_NAMES_:
+        profiles = [profile_import(module_name) for _index in range(args.repeat)]
+        result['stages'][module_name] = to_stats([seconds for (seconds, _imports) in profiles])
+        print('{0} {1:.3f} ms'.format(module_name, result['stages'][module_name]['median'] * 1e3))
+        (_seconds, imports) = min(profiles)
+        for cumulative_us, imported_name in sorted(imports, reverse=True)[:args.top]:
+            print('  {0:>10.3f} ms {1}'.format(cumulative_us / 1e3, imported_name))
+
+    if args.save is not None:
+        with open(args.save, mode='w') as result_file:
+            json.dump(result, result_file, indent=2, sort_keys=True)
+
+    if args.baseline is not None:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+        if not compare(result, baseline, args.max_slowdown):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# pacifica-dispatcher-proxymod: benchmarks/synthetic_events.py
+#
+# Copyright (c) 2019, Battelle Memorial Institute
+# All rights reserved.
+#
+# See LICENSE and WARRANTY for details.
+"""
+Synthetic proxymod events for the benchmarks.
+
+The events and their files are generated from the test event in
+``tests/test_files/C234-1234-1234``, scaled by the number of
+configurations, metadata key values, input files, input rows and model
+files.
+"""
+import hashlib
+import json
+import os
+import typing
+
+TEMPLATE_DIR_NAME = os.path.abspath(os.path.join(
+    os.path.dirname(__file__), '..', 'tests', 'test_files', 'C234-1234-1234'))
+
+MODEL_NAMES_ = ['loose_coupling', 'tight_coupling', 'tight_coupling_twoway']
+
+MODEL_SIGNATURE_ = 'def {0}(config_1, config_2, config_3'
+
+
+def _key_value(key: str, value: str) -> typing.Dict[str, str]:
+    """Return a transaction key value of the event data."""
+    return {'destinationTable': 'TransactionKeyValue', 'key': key, 'value': value}
+
+
+# pylint: disable=too-many-arguments
+def _write_file(basedir_name: str, subdir: str, name: str, content: bytes, file_id: int,
+                mimetype: str) -> typing.Dict[str, typing.Any]:
+    """Write the file and return its file entry of the event data."""
+    os.makedirs(os.path.join(basedir_name, 'data', subdir), exist_ok=True)
+    with open(os.path.join(basedir_name, 'data', subdir, name), mode='wb') as file:
+        file.write(content)
+    return {
+        '_id': file_id,
+        'destinationTable': 'Files',
+        'hashsum': hashlib.sha1(content).hexdigest(),
+        'hashtype': 'sha1',
+        'mimetype': mimetype,
+        'name': name,
+        'size': len(content),
+        'subdir': subdir,
+    }
+# pylint: enable=too-many-arguments
+
+
+def _to_input_content(input_rows: int) -> bytes:
+    """Return the content of an input file with a value every five years."""
+    lines = ['year,value']
+    for index in range(input_rows):
+        lines.append('{0},{1}'.format(2010 + (5 * index), 0.5 + (0.25 * index)))
+    lines.append('')
+    return bytes('\n'.join(lines), 'utf-8')
+
+
+def _to_model_content(template_name: str, name: str) -> bytes:
+    """Return the content of the model file, renamed and taking any number of configuration files."""
+    with open(os.path.join(TEMPLATE_DIR_NAME, 'data', 'models', '{0}.py'.format(template_name))) as file:
+        source = file.read()
+    signature = MODEL_SIGNATURE_.format(template_name)
+    if signature not in source:
+        raise ValueError('model file {0} has no function {1}'.format(template_name, signature))
+    return bytes(source.replace(signature, MODEL_SIGNATURE_.format(name) + ', *_configs'), 'utf-8')
+
+
+# pylint: disable=too-many-arguments
+# pylint: disable=too-many-locals
+def generate_event(basedir_name: str, configs_count: int = 3, key_values_count: int = 0,
+                   input_files_count: int = 2, input_rows: int = 19,
+                   model_files_count: int = 3) -> typing.Dict[str, typing.Any]:
+    """
+    Write the files of a synthetic event to the directory and return the event data.
+
+    The files are written to the ``data`` subdirectory, for the local
+    download runner. Only the first two input files are configured as
+    model inputs, the others take part in validating the event only.
+    The model files are copies of the three test model files.
+    """
+    if configs_count < 3:
+        raise ValueError('the test model files need at least three configuration files')
+    if input_files_count < 2:
+        raise ValueError('the test model files need two input files')
+
+    with open(os.path.join(TEMPLATE_DIR_NAME, 'event.json')) as event_file:
+        event_data = json.load(event_file)
+
+    data = [item for item in event_data['data'] if item['destinationTable'].startswith('Transactions.')]
+    data.extend([
+        _key_value('proxymod.task', 'advance'),
+        _key_value('proxymod.version', 'v0.0.1'),
+        _key_value('proxymod.configs_count', str(configs_count)),
+    ])
+    for config_index in range(configs_count):
+        prefix = 'proxymod.config_{0}.'.format(config_index + 1)
+        data.extend([
+            _key_value(prefix + 'PROJECT.runtime', '2'),
+            _key_value(prefix + 'PROJECT.failure', '0'),
+            _key_value(prefix + 'OUTPUTS.out_dir', 'outputs/'),
+        ])
+        if config_index == 0:
+            data.extend([
+                _key_value(prefix + 'INPUTS.in_dir', 'inputs/'),
+                _key_value(prefix + 'INPUTS.in_file_one', 'in_file_one.csv'),
+                _key_value(prefix + 'INPUTS.in_file_two', 'in_file_two.csv'),
+            ])
+    for index in range(key_values_count):
+        data.append(_key_value('instrument.metadata_{0}'.format(index), str(index)))
+
+    input_content = _to_input_content(input_rows)
+    input_names = ['in_file_one.csv', 'in_file_two.csv'] + [
+        'in_file_{0}.csv'.format(index + 3) for index in range(input_files_count - 2)
+    ]
+    for name in input_names:
+        data.append(_write_file(basedir_name, 'inputs/', name, input_content, len(data), 'text/csv'))
+
+    for index in range(model_files_count):
+        template_name = MODEL_NAMES_[index % len(MODEL_NAMES_)]
+        name = template_name if index < len(MODEL_NAMES_) else '{0}_{1}'.format(template_name, index)
+        data.append(_write_file(
+            basedir_name, 'models/', '{0}.py'.format(name), _to_model_content(template_name, name), len(data),
+            'text/x-python'))
+
+    event_data['data'] = data
+    return event_data
+# pylint: enable=too-many-arguments
+# pylint: enable=too-many-locals
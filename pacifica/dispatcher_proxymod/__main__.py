@@ -10,30 +10,104 @@
 """Main method for starting proxymod handler."""
 import argparse
 import os
+import signal
 from time import sleep
-from threading import Thread
+from threading import Lock, Thread
 
+import celery.signals
 import cherrypy
-import playhouse.db_url
 
 from pacifica.dispatcher.receiver import create_peewee_model
 
-from .router import router
+from .batches import create_defer_event, create_receive_batch_task, create_receive_bulk_app
+from .databases import connect_database
+from .journals import ModelEventJournal, create_event_journal_model
+from .metrics import MetricStageTimer, create_metric_model
+from .router import LazyRouter
 
 # pylint: disable=invalid-name
-ReceiveTaskModel = create_peewee_model(playhouse.db_url.connect(os.getenv('DATABASE_URL', 'sqlite:///:memory:')))
+database = connect_database(
+    os.getenv('DATABASE_URL', 'sqlite:///:memory:'),
+    pool=os.getenv('DATABASE_POOL', 'false').lower() not in ['0', 'false', 'no', 'off'],
+    max_connections=int(os.getenv('DATABASE_MAX_CONNECTIONS', '20')),
+    stale_timeout=float(os.getenv('DATABASE_STALE_TIMEOUT', '300')),
+    sqlite_journal_mode=os.getenv('DATABASE_SQLITE_JOURNAL_MODE', 'wal'),
+    sqlite_synchronous=os.getenv('DATABASE_SQLITE_SYNCHRONOUS', 'normal')
+)
+
+ReceiveTaskModel = create_peewee_model(database)
+
+MetricModel = create_metric_model(database)
+
+EventJournalModel = create_event_journal_model(database)
 
-ReceiveTaskModel.create_table(safe=True)
+router = LazyRouter(MetricStageTimer(MetricModel), ModelEventJournal(EventJournalModel))
 
 celery_app = ReceiveTaskModel.create_celery_app(
     router, 'pacifica.dispatcher_proxymod.app', 'pacifica.dispatcher_proxymod.tasks.receive',
     backend=os.getenv('BACKEND_URL', 'rpc://'), broker=os.getenv('BROKER_URL', 'pyamqp://')
 )
 
+receive_batch_task = create_receive_batch_task(
+    ReceiveTaskModel, celery_app, router, 'pacifica.dispatcher_proxymod.tasks.receive_batch',
+    defer_seconds=float(os.getenv('ADMISSION_DEFER_SECONDS', '30')),
+    max_deferrals=int(os.getenv('ADMISSION_MAX_DEFERRALS', '20'))
+)
+
+router.defer_event = create_defer_event(receive_batch_task, float(os.getenv('ADMISSION_DEFER_SECONDS', '30')))
+
 application = ReceiveTaskModel.create_cherrypy_app(celery_app.tasks['pacifica.dispatcher_proxymod.tasks.receive'])
+
+application.root.metrics = MetricModel.create_cherrypy_app()
+
+application.root.receive_bulk = create_receive_bulk_app(ReceiveTaskModel, receive_batch_task, router.match_path)
+
+_create_tables_lock = Lock()
+
+_tables_created = []
 # pylint: enable=invalid-name
 
 
+def create_tables(**_kwargs) -> None:
+    """Connect to the database and create the tables, once, before the first task or request."""
+    if _tables_created:
+        return
+    with _create_tables_lock:
+        if not _tables_created:
+            database.create_tables([ReceiveTaskModel, MetricModel, EventJournalModel], safe=True)
+            _tables_created.append(True)
+
+
+celery.signals.task_prerun.connect(create_tables, weak=False)
+
+
+def warm_model_runner(**_kwargs) -> None:
+    """Create the event handler and start its fork server in a new Celery worker process, for warm model runs."""
+    if os.getenv('MODEL_RUNNER', 'local') == 'forkserver':
+        router.event_handler.model_runner.warm()
+
+
+celery.signals.worker_process_init.connect(warm_model_runner, weak=False)
+
+
+def cancel_on_terminate(signum, _frame) -> None:
+    """Cancel the running events of the worker process, or exit as by default if none are running."""
+    if router.loaded and router.event_handler.cancel('revoked with signal {0}'.format(signum)):
+        return
+    signal.signal(signum, signal.SIG_DFL)
+    os.kill(os.getpid(), signum)
+
+
+def install_cancel_on_terminate(**_kwargs) -> None:
+    """Cancel the events of a new Celery worker process revoked with ``terminate``, instead of killing it."""
+    signal.signal(signal.SIGTERM, cancel_on_terminate)
+
+
+celery.signals.worker_process_init.connect(install_cancel_on_terminate, weak=False)
+
+application.merge({'/': {'hooks.on_start_resource': create_tables}})
+
+
 def stop_later(doit=False):
     """Used for unit testing stop after 10 seconds."""
     if not doit:  # pragma: no cover
@@ -72,13 +146,18 @@ def main() -> None:
     if args.config is not None:  # pragma: no cover standard config update
         cherrypy.config.update(args.config)
 
+    create_tables()
+
     cherrypy.tree.mount(application)
 
     cherrypy.engine.start()
     cherrypy.engine.block()
 
 
-__all__ = ('ReceiveTaskModel', 'application', 'celery_app', 'main', )
+__all__ = (
+    'ReceiveTaskModel', 'MetricModel', 'EventJournalModel', 'application', 'celery_app', 'receive_batch_task',
+    'create_tables', 'warm_model_runner', 'cancel_on_terminate', 'install_cancel_on_terminate', 'main',
+)
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# pacifica-dispatcher-proxymod: pacifica/dispatcher_proxymod/admission.py
+#
+# Copyright (c) 2019, Battelle Memorial Institute
+# All rights reserved.
+#
+# See LICENSE and WARRANTY for details.
+"""
+Admission module.
+
+This module contains the admission controllers of the event handler,
+which estimate the footprint of an event from the sizes of the files in
+the event before it is handled. The first admits every event. The
+second defers the events that do not fit in the free space of the file
+systems the event writes to or in the available memory of the host.
+"""
+import collections
+import math
+import os
+import shutil
+import tempfile
+import threading
+import typing
+
+from cloudevents.model import Event
+
+from pacifica.dispatcher.models import File
+
+from .exceptions import AdmissionDeferredProxEventHandlerError
+from .scratch import MemoryScratch, Scratch
+
+PROC_MEMINFO_FILE_NAME_ = '/proc/meminfo'
+
+DISK_RESOURCE = 'disk'
+
+MEMORY_RESOURCE = 'memory'
+
+
+class Footprint(typing.NamedTuple):
+    """Estimated bytes downloaded for an event and written by its model runs."""
+
+    download_bytes: int = 0
+    output_bytes: int = 0
+
+
+def _to_size(file_inst: File) -> int:
+    """Return the size of the file in the event, zero if it is missing."""
+    try:
+        return int(file_inst.size or 0)
+    except (TypeError, ValueError):
+        return 0
+
+
+class AdmissionController:
+    """
+    Admission controller class.
+
+    The footprint of an event is the size of its model and input files,
+    downloaded before the models run, and the size of the results of
+    its model runs, estimated as the size of its input files times the
+    output multiplier of every model, ``output_multiplier`` unless the
+    model is in ``output_multiplier_by_model_name``, for every variant.
+
+    Every event is admitted; subclasses override the ``reserve`` and
+    ``release`` methods to defer the events that do not fit.
+    """
+
+    def __init__(self, output_multiplier: float = 1.0,
+                 output_multiplier_by_model_name: typing.Dict[str, float] = None) -> None:
+        """Save the output multipliers of the models."""
+        super(AdmissionController, self).__init__()
+
+        self.output_multiplier = output_multiplier
+        self.output_multiplier_by_model_name = dict(output_multiplier_by_model_name or {})
+
+    def estimate(self, model_names: typing.List[str], model_file_insts: typing.List[File],
+                 input_file_insts: typing.List[File], variants_count: int = 1) -> Footprint:
+        """Return the estimated footprint of an event."""
+        input_bytes = sum(_to_size(file_inst) for file_inst in input_file_insts)
+        return Footprint(
+            sum(_to_size(file_inst) for file_inst in model_file_insts) + input_bytes,
+            int(math.ceil(input_bytes * variants_count * sum(
+                self.output_multiplier_by_model_name.get(model_name, self.output_multiplier)
+                for model_name in model_names
+            )))
+        )
+
+    def reserve(self, event: Event, footprint: Footprint) -> typing.Dict[typing.Tuple[str, int], int]:
+        """Admit the event, reserving nothing."""
+        return {}
+
+    def release(self, reservation: typing.Dict[typing.Tuple[str, int], int]) -> None:
+        """Do nothing, nothing was reserved."""
+
+
+def _mem_available() -> typing.Optional[int]:
+    """Return the memory available to new processes in bytes, ``None`` if the platform does not say."""
+    try:
+        with open(PROC_MEMINFO_FILE_NAME_) as meminfo_file:
+            for line in meminfo_file:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+class HeadroomAdmissionController(AdmissionController):
+    """
+    Headroom admission controller class.
+
+    The files of an event are downloaded to ``download_dir_name``, the
+    temporary directory of the system by default, and the results of
+    its models are written to the ``scratch``, in memory if they fit in
+    the budget of the memory scratch, else on disk. An event is deferred if the
+    free space of one of these file systems, less ``min_free_disk``
+    bytes, or the available memory of the host, less
+    ``min_free_memory`` bytes, is smaller than the part of its footprint
+    written there.
+
+    The footprints of the events admitted by the process stay reserved
+    until they are released, so a burst of events taken at the same
+    time does not count the same free space twice.
+    """
+
+    # pylint: disable=too-many-arguments
+    def __init__(self, scratch: Scratch = None, download_dir_name: str = None, min_free_disk: int = 0,
+                 min_free_memory: int = 0, output_multiplier: float = 1.0,
+                 output_multiplier_by_model_name: typing.Dict[str, float] = None) -> None:
+        """Save the directories written by the events and the headroom kept free."""
+        super(HeadroomAdmissionController, self).__init__(output_multiplier, output_multiplier_by_model_name)
+
+        self.scratch = scratch if scratch is not None else Scratch()
+        self.download_dir_name = download_dir_name
+        self.min_free_disk = min_free_disk
+        self.min_free_memory = min_free_memory
+        self._reserved = collections.Counter()  # type: typing.Dict[typing.Tuple[str, int], int]
+        self._lock = threading.Lock()
+    # pylint: enable=too-many-arguments
+
+    def _is_output_in_memory(self, footprint: Footprint) -> bool:
+        """Return true if the results of the event fit in the budget of the scratch directories in memory."""
+        return isinstance(self.scratch, MemoryScratch) and self.scratch.fits(footprint.output_bytes)
+
+    def _to_needs(self, footprint: Footprint) -> typing.Dict[typing.Tuple[str, int], typing.Tuple[str, int]]:
+        """Return a directory and the bytes needed by the event, by resource and file system."""
+        needs = {}
+
+        def add_need(resource: str, dir_name: typing.Optional[str], size: int) -> None:
+            key = (resource, os.stat(dir_name).st_dev if dir_name is not None else 0)
+            needs[key] = (dir_name, needs.get(key, (dir_name, 0))[1] + size)
+
+        add_need(DISK_RESOURCE, self.download_dir_name or tempfile.gettempdir(), footprint.download_bytes)
+        if self._is_output_in_memory(footprint):
+            add_need(MEMORY_RESOURCE, self.scratch.memory_dir_name, footprint.output_bytes)
+        else:
+            add_need(DISK_RESOURCE, self.scratch.disk_dir_name or tempfile.gettempdir(), footprint.output_bytes)
+            add_need(MEMORY_RESOURCE, None, 0)
+        return needs
+
+    def _free_size(self, resource: str, dir_name: typing.Optional[str]) -> float:
+        """Return the free bytes of the resource, less the headroom kept free."""
+        if resource == DISK_RESOURCE:
+            return shutil.disk_usage(dir_name).free - self.min_free_disk
+        free_size = _mem_available()
+        if free_size is None:
+            free_size = math.inf
+        if dir_name is not None:
+            free_size = min(free_size, shutil.disk_usage(dir_name).free)
+        return free_size - self.min_free_memory
+
+    def reserve(self, event: Event, footprint: Footprint) -> typing.Dict[typing.Tuple[str, int], int]:
+        """Reserve the footprint of the event, raising ``AdmissionDeferredProxEventHandlerError`` if it does not fit."""
+        needs = self._to_needs(footprint)
+        with self._lock:
+            for (resource, dev), (dir_name, size) in needs.items():
+                free_size = self._free_size(resource, dir_name) - self._reserved[(resource, dev)]
+                if free_size < size:
+                    raise AdmissionDeferredProxEventHandlerError(
+                        event, resource, size, int(max(0, free_size)))
+            reservation = {key: size for key, (_dir_name, size) in needs.items()}
+            self._reserved.update(reservation)
+        return reservation
+
+    def release(self, reservation: typing.Dict[typing.Tuple[str, int], int]) -> None:
+        """Release the reserved footprint of an event."""
+        with self._lock:
+            self._reserved.subtract(reservation)
+
+
+__all__ = ('Footprint', 'AdmissionController', 'HeadroomAdmissionController', )
@@ -0,0 +1,316 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# pacifica-dispatcher-proxymod: pacifica/dispatcher_proxymod/batches.py
+#
+# Copyright (c) 2019, Battelle Memorial Institute
+# All rights reserved.
+#
+# See LICENSE and WARRANTY for details.
+"""
+Batch module.
+
+Contains a factory creating the Celery task receiving a batch of events
+in one message. The events are recorded in the table of the receiver,
+the same as the events of the receive task, and the events routed to
+the same event handler are handled together, if the event handler can
+handle many events, e.g. sharing the downloads of their files.
+
+The events deferred by the admission control of the event handler are
+sent to the batch task again later, with the same task identifiers, at
+most a number of times, after which they fail. Contains a factory
+creating the function sending an event deferred in the receive task to
+the batch task the same way.
+
+Contains a factory creating the CherryPy object receiving many events in
+one request, as a JSON array or as newline delimited JSON, saving their
+rows in one transaction and sending them to the batch task in one
+message.
+"""
+import collections
+import json
+import random
+import traceback
+import typing
+import uuid
+
+import celery
+import cherrypy
+import peewee
+from cloudevents.model import Event
+
+from pacifica.dispatcher.router import RouteNotFoundRouterError, Router
+
+from .databases import connected_db_context
+from .exceptions import AdmissionDeferredProxEventHandlerError, ProxEventHandlerError
+
+# NOTE Every row has 18 columns, keeping an insert below the 999 variables of older SQLite versions.
+INSERT_CHUNK_SIZE_ = 50
+
+DEFER_SECONDS_ = 30.0
+
+MAX_DEFERRALS_ = 20
+
+NDJSON_CONTENT_TYPES_ = ('application/x-ndjson', 'application/ndjson', 'application/jsonl', )
+
+
+def to_batch_task_ids(batch_task_id: str, events_count: int) -> typing.List[str]:
+    """Return the task identifiers of the events of the batch task, to look up their status."""
+    return [str(uuid.uuid5(uuid.UUID(batch_task_id), str(index))) for index in range(events_count)]
+
+
+def to_defer_countdown(defer_seconds: float) -> float:
+    """Return the seconds before a deferred event is handled again, between one and two times ``defer_seconds``."""
+    return defer_seconds * (1.0 + random.random())
+
+
+def to_receive_task_row(event_data: typing.Dict[str, typing.Any], task_id: str, task_application_name: str,
+                        task_name: str) -> typing.Dict[str, typing.Any]:
+    """Return the row of the receiver table for the event, the same as the receive task saves."""
+    return {
+        'event_type': event_data.get('eventType', None),
+        'event_type_version': event_data.get('eventTypeVersion', None),
+        'source': event_data.get('source', None),
+        'event_id': event_data.get('eventID', None),
+        'event_time': event_data.get('eventTime', None),
+        'schema_url': event_data.get('schemaURL', None),
+        'content_type': event_data.get('contentType', None),
+
+        'event_data': json.dumps(event_data),
+        'data': json.dumps(event_data.get('data', None)),
+
+        'task_id': task_id,
+        'task_application_name': task_application_name,
+        'task_name': task_name,
+        'task_status': '202 Accepted',
+
+        'exc_type': None,
+        'exc_value': None,
+        'exc_traceback': '',
+    }
+
+
+def insert_receive_task_rows(receive_task_model: typing.Any, rows: typing.List[typing.Dict[str, typing.Any]]) -> None:
+    """Insert the rows of the receiver table in one transaction, many rows per statement."""
+    database = receive_task_model._meta.database  # pylint: disable=protected-access
+    with connected_db_context(database), database.atomic():
+        for rows_chunk in peewee.chunked(rows, INSERT_CHUNK_SIZE_):
+            receive_task_model.insert_many(rows_chunk).execute()
+
+
+def parse_events_data(body: bytes, content_type: str = 'application/json') -> typing.List[typing.Dict[str, typing.Any]]:
+    """
+    Return the events of the request body.
+
+    The body is newline delimited JSON, one event per line, if the
+    content type says so, else a JSON array of events. Raises
+    ``ValueError`` if the body is not valid or an event is not an
+    object.
+    """
+    text = body.decode('utf-8')
+    if content_type.split(';', 1)[0].strip().lower() in NDJSON_CONTENT_TYPES_:
+        events_data = [json.loads(line) for line in text.splitlines() if line.strip()]
+    else:
+        events_data = json.loads(text)
+        if not isinstance(events_data, list):
+            raise ValueError('the body is not a JSON array')
+    for event_data in events_data:
+        if not isinstance(event_data, dict):
+            raise ValueError('the event is not a JSON object')
+    return events_data
+
+
+def _handle_route_events(route: typing.Any, events_data: typing.List[typing.Dict[str, typing.Any]]) -> typing.List[
+        typing.Optional[BaseException]]:
+    """Handle the events of the route together, if the event handler can, returning the exception of every event."""
+    handle_many = getattr(route.event_handler, 'handle_many', None)
+    if handle_many is not None:
+        return handle_many([Event(event_data) for event_data in events_data])
+    reasons = []
+    for event_data in events_data:
+        try:
+            route(event_data)
+        except (Exception, ProxEventHandlerError) as reason:  # pylint: disable=broad-except
+            reasons.append(reason)
+        else:
+            reasons.append(None)
+    return reasons
+
+
+# pylint: disable=too-many-arguments
+def create_receive_batch_task(receive_task_model: typing.Any, celery_app: celery.Celery, router: Router,
+                              receive_batch_task_name: str, defer_seconds: float = DEFER_SECONDS_,
+                              max_deferrals: int = MAX_DEFERRALS_) -> celery.Task:
+    """
+    Create the Celery task receiving a batch of events.
+
+    The task takes the list of events and, optionally, the task
+    identifiers of the events if their rows are saved already. Else the
+    rows are saved in one transaction with the identifiers returned by
+    ``to_batch_task_ids`` for the identifier of the task.
+
+    The events deferred by the admission control are accepted again and
+    sent to the task in one message, handled after the countdown
+    returned by ``to_defer_countdown``, unless they were deferred
+    ``max_deferrals`` times already.
+    """
+    database = receive_task_model._meta.database  # pylint: disable=protected-access
+
+    def update_status(status_by_task_id: typing.Dict[str, typing.Dict[str, typing.Any]]) -> None:
+        """Update the status of the events in one transaction."""
+        with connected_db_context(database), database.atomic():
+            for task_id, status in status_by_task_id.items():
+                receive_task_model.update(**status).where(receive_task_model.task_id == task_id).execute()
+
+    # pylint: disable=too-many-locals
+    @celery_app.task(bind=True, ignore_result=True, name=receive_batch_task_name)
+    def receive_batch_task(self, events_data: typing.List[typing.Dict[str, typing.Any]],
+                           task_ids: typing.List[str] = None, deferrals: int = 0) -> None:
+        """Celery task entrypoint for a batch of events."""
+        if task_ids is None:
+            task_ids = to_batch_task_ids(self.request.id, len(events_data))
+            insert_receive_task_rows(receive_task_model, [
+                to_receive_task_row(event_data, task_id, celery_app.main, receive_batch_task_name)
+                for event_data, task_id in zip(events_data, task_ids)
+            ])
+
+        status_by_task_id = collections.OrderedDict()
+        task_ids_by_route = collections.OrderedDict()
+        events_data_by_route = collections.OrderedDict()
+
+        for event_data, task_id in zip(events_data, task_ids):
+            try:
+                route = router.match_first_or_raise(event_data)
+            except RouteNotFoundRouterError as exc:
+                status_by_task_id[task_id] = {
+                    'task_status': '422 Unprocessable Entity',
+                    'exc_type': 'RouteNotFoundRouterError',
+                    'exc_value': str(exc),
+                }
+            else:
+                status_by_task_id[task_id] = {
+                    'task_status': '102 Processing', 'exc_type': None, 'exc_value': None, 'exc_traceback': '',
+                }
+                task_ids_by_route.setdefault(route, []).append(task_id)
+                events_data_by_route.setdefault(route, []).append(event_data)
+
+        update_status(status_by_task_id)
+
+        deferred_events_data = []
+        deferred_task_ids = []
+        for route, route_events_data in events_data_by_route.items():
+            status_by_task_id = collections.OrderedDict()
+            for event_data, task_id, reason in zip(
+                    route_events_data, task_ids_by_route[route], _handle_route_events(route, route_events_data)):
+                if reason is None:
+                    status_by_task_id[task_id] = {'task_status': '200 OK'}
+                elif isinstance(reason, AdmissionDeferredProxEventHandlerError) and (deferrals < max_deferrals):
+                    status_by_task_id[task_id] = {
+                        'task_status': '202 Accepted',
+                        'exc_type': type(reason).__name__,
+                        'exc_value': str(reason),
+                    }
+                    deferred_events_data.append(event_data)
+                    deferred_task_ids.append(task_id)
+                else:
+                    status_by_task_id[task_id] = {
+                        'task_status': '500 Internal Server Error',
+                        'exc_type': type(reason).__name__,
+                        'exc_value': str(reason),
+                        'exc_traceback': traceback.format_tb(reason.__traceback__),
+                    }
+            update_status(status_by_task_id)
+
+        if deferred_events_data:
+            self.apply_async(args=(deferred_events_data, deferred_task_ids), kwargs={'deferrals': deferrals + 1},
+                             countdown=to_defer_countdown(defer_seconds))
+    # pylint: enable=too-many-locals
+
+    return receive_batch_task
+# pylint: enable=too-many-arguments
+
+
+def create_defer_event(receive_batch_task: celery.Task, defer_seconds: float = DEFER_SECONDS_) -> typing.Callable[
+        [typing.Dict[str, typing.Any], AdmissionDeferredProxEventHandlerError], None]:
+    """
+    Create the function deferring an event of the receive task.
+
+    The event is sent to the batch task with the identifier of the
+    current receive task, handled after the countdown returned by
+    ``to_defer_countdown``. The reason is raised again outside of a
+    Celery task.
+    """
+    def defer_event(event_data: typing.Dict[str, typing.Any],
+                    reason: AdmissionDeferredProxEventHandlerError) -> None:
+        """Send the deferred event of the current receive task to the batch task."""
+        if not celery.current_task:
+            raise reason
+        receive_batch_task.apply_async(
+            args=([event_data], [celery.current_task.request.id]), kwargs={'deferrals': 1},
+            countdown=to_defer_countdown(defer_seconds))
+
+    return defer_event
+
+
+def create_receive_bulk_app(receive_task_model: typing.Any, receive_batch_task: celery.Task,
+                            match: typing.Callable[[typing.Dict[str, typing.Any]], bool]) -> object:
+    """
+    Create the CherryPy object receiving many events in one request.
+
+    The events not matched by ``match`` are saved as unprocessable
+    right away. The other events are saved as accepted and sent to the
+    batch task in one message. The response is the list of the task
+    identifiers of the events, in the order of the request, to look up
+    their status.
+    """
+    # pylint: disable=too-few-public-methods
+    class ReceiveBulk:
+        """Receive entrypoint for many cloud events."""
+
+        exposed = True
+
+        # pylint: disable=invalid-name
+        @staticmethod
+        @cherrypy.tools.json_out()
+        def POST() -> typing.List[str]:
+            """Bulk REST endpoint for receiving cloud events."""
+            try:
+                events_data = parse_events_data(
+                    cherrypy.request.body.read(), cherrypy.request.headers.get('Content-Type', 'application/json'))
+            except ValueError as exc:
+                raise cherrypy.HTTPError('400', 'Bad Request: {0}'.format(exc))
+
+            batch_task_id = str(uuid.uuid4())
+            task_ids = to_batch_task_ids(batch_task_id, len(events_data))
+            rows = []
+            matched_events_data = []
+            matched_task_ids = []
+            for event_data, task_id in zip(events_data, task_ids):
+                row = to_receive_task_row(event_data, task_id, receive_batch_task.app.main, receive_batch_task.name)
+                if match(event_data):
+                    matched_events_data.append(event_data)
+                    matched_task_ids.append(task_id)
+                else:
+                    row.update({
+                        'task_status': '422 Unprocessable Entity',
+                        'exc_type': 'RouteNotFoundRouterError',
+                        'exc_value': 'route not found',
+                    })
+                rows.append(row)
+
+            insert_receive_task_rows(receive_task_model, rows)
+
+            if matched_events_data:
+                receive_batch_task.apply_async(args=(matched_events_data, matched_task_ids), task_id=batch_task_id)
+
+            return task_ids
+        # pylint: enable=invalid-name
+    # pylint: enable=too-few-public-methods
+
+    return ReceiveBulk()
+
+
+__all__ = (
+    'create_defer_event', 'create_receive_batch_task', 'create_receive_bulk_app', 'insert_receive_task_rows',
+    'parse_events_data', 'to_batch_task_ids', 'to_defer_countdown', 'to_receive_task_row',
+)
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# pacifica-dispatcher-proxymod: pacifica/dispatcher_proxymod/cancellation.py
+#
+# Copyright (c) 2019, Battelle Memorial Institute
+# All rights reserved.
+#
+# See LICENSE and WARRANTY for details.
+"""
+Cancellation module.
+
+This module contains the cancel token of an event, with the deadline of
+the time budget of the event and whether it is cancelled, e.g. revoked
+by an operator. The model runners stop the model runs that are out of
+time or cancelled. A model function running many timesteps in the
+current process can also stop on its own, after a timestep::
+
+    cancel_token = current_cancel_token()
+    for target_yr in range(2010, 2105, 5):
+        if cancel_token.cancelled:
+            break
+        ...
+"""
+import contextlib
+import contextvars
+import ctypes
+import threading
+import time
+import typing
+
+_CURRENT_CANCEL_TOKEN_ = contextvars.ContextVar('proxymod_cancel_token', default=None)
+
+
+class ModelCancelledError(Exception):
+    """Model run cancelled exception."""
+
+
+class ModelTimeoutError(TimeoutError):
+    """Model run out of time exception."""
+
+
+class CancelToken:
+    """
+    Cancel token class.
+
+    The token is cancelled by the ``cancel`` method, with a reason, and
+    is out of time ``timeout`` seconds after ``start``, a time of the
+    monotonic clock, by default when it is created (zero means no time
+    budget).
+    """
+
+    def __init__(self, timeout: float = 0, start: float = None) -> None:
+        """Save the deadline of the time budget."""
+        super(CancelToken, self).__init__()
+
+        self.timeout = timeout
+        self.deadline = (start if start is not None else time.monotonic()) + timeout if timeout else None
+        self.reason = None  # type: typing.Optional[str]
+        self._event = threading.Event()
+
+    @property
+    def cancelled(self) -> bool:
+        """Return true if the token is cancelled."""
+        return self._event.is_set()
+
+    def cancel(self, reason: str) -> None:
+        """Cancel the token, keeping the first reason."""
+        if not self._event.is_set():
+            self.reason = reason
+            self._event.set()
+
+    def remaining(self) -> typing.Optional[float]:
+        """Return the seconds left in the time budget, ``None`` without a time budget."""
+        if self.deadline is None:
+            return None
+        return max(0.0, self.deadline - time.monotonic())
+
+
+def current_cancel_token() -> CancelToken:
+    """Return the cancel token of the current model run, a token never cancelled outside of one."""
+    cancel_token = _CURRENT_CANCEL_TOKEN_.get()
+    return cancel_token if cancel_token is not None else CancelToken()
+
+
+@contextlib.contextmanager
+def cancel_token_context(cancel_token: typing.Optional[CancelToken]) -> typing.Generator[None, None, None]:
+    """Make the cancel token the current cancel token in the context."""
+    token = _CURRENT_CANCEL_TOKEN_.set(cancel_token)
+    try:
+        yield
+    finally:
+        _CURRENT_CANCEL_TOKEN_.reset(token)
+
+
+def interrupt_thread(thread_id: int, exc_type: typing.Optional[type]) -> None:
+    """
+    Raise the exception in the thread, or clear it with ``None``.
+
+    The exception is raised when the thread next runs Python code, a
+    thread blocked in C code is only interrupted once it returns.
+    """
+    ctypes.pythonapi.PyThreadState_SetAsyncExc(
+        ctypes.c_ulong(thread_id), ctypes.py_object(exc_type) if exc_type is not None else None)
+
+
+__all__ = (
+    'ModelCancelledError', 'ModelTimeoutError', 'CancelToken', 'current_cancel_token', 'cancel_token_context',
+    'interrupt_thread',
+)
@@ -0,0 +1,268 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# pacifica-dispatcher-proxymod: pacifica/dispatcher_proxymod/checkpoints.py
+#
+# Copyright (c) 2019, Battelle Memorial Institute
+# All rights reserved.
+#
+# See LICENSE and WARRANTY for details.
+"""
+Checkpoint module.
+
+This module contains the checkpoint API of the model functions. A model
+function running many timesteps gets its checkpoint with
+``current_checkpoint``, skips the timesteps up to ``checkpoint.step``
+and calls ``checkpoint.save(step)`` after every finished timestep::
+
+    checkpoint = current_checkpoint()
+    for target_yr in range(2010, 2105, 5):
+        if (checkpoint.step is not None) and (target_yr <= checkpoint.step):
+            continue
+        ...
+        checkpoint.save(target_yr)
+
+The checkpoints of an event are kept across retries of the event, so a
+retry restores the outputs of the last finished timestep of every model
+before running the models again. The checkpoints of the events that
+failed for good or are never delivered again are removed once they are
+older than a maximum age.
+"""
+import contextlib
+import contextvars
+import hashlib
+import json
+import os
+import shutil
+import time
+import typing
+import uuid
+
+from .logs import LOG_FILE_SUFFIX_
+
+CHECKPOINT_FILES_DIR_NAME_ = 'files'
+
+CHECKPOINT_STEP_FILE_NAME_ = 'step.json'
+
+_CURRENT_CHECKPOINT_ = contextvars.ContextVar('proxymod_checkpoint', default=None)
+
+
+class Checkpoint:
+    """
+    Checkpoint class.
+
+    Nothing is saved, every run of the model function starts from its
+    first timestep; subclasses override ``step`` and ``save`` to keep
+    the checkpoints.
+    """
+
+    @property
+    def step(self) -> typing.Any:
+        """Return ``None``, no timestep is finished."""
+        return None
+
+    def save(self, step: typing.Any, file_names: typing.List[str] = None) -> None:
+        """Do nothing with the finished timestep."""
+
+
+def _is_checkpointed(file_name: str) -> bool:
+    """Return true if the result file is saved in the checkpoints, the logs and configurations are written again."""
+    return not (file_name.endswith(LOG_FILE_SUFFIX_) or file_name.endswith('{0}.gz'.format(LOG_FILE_SUFFIX_)) or (
+        os.path.dirname(file_name) == '' and file_name.endswith('.ini')))
+
+
+def _walk_checkpointed(basedir_name: str) -> typing.List[str]:
+    """Return the paths of the files of the directory saved in the checkpoints, relative to the directory."""
+    file_names = []
+    for walk_root, _walk_dirs, walk_names in os.walk(basedir_name):
+        for walk_name in walk_names:
+            file_name = os.path.relpath(os.path.join(walk_root, walk_name), basedir_name)
+            if _is_checkpointed(file_name):
+                file_names.append(file_name)
+    return sorted(file_names)
+
+
+def _is_same_file(file_name: str, other_file_name: str) -> bool:
+    """Return true if both files have the same size and modification time."""
+    try:
+        (file_st, other_file_st) = (os.stat(file_name), os.stat(other_file_name))
+    except FileNotFoundError:
+        return False
+    return (file_st.st_size, file_st.st_mtime_ns) == (other_file_st.st_size, other_file_st.st_mtime_ns)
+
+
+class DirectoryCheckpoint(Checkpoint):
+    """
+    Directory checkpoint class.
+
+    Every checkpoint of the model is a numbered directory in
+    ``dir_name``, with the step in ``step.json`` and a copy of the
+    result files in ``files``. A checkpoint directory is renamed into
+    place once complete and replaces the previous one, so a model failing
+    while saving keeps its previous checkpoint. Files unchanged since the
+    previous checkpoint are hard linked instead of copied.
+
+    By default every result file in ``basedir_name`` is saved, except
+    the logs and the configuration files; models running at the same
+    time as other models should pass the ``file_names`` they wrote.
+    """
+
+    def __init__(self, dir_name: str, basedir_name: str) -> None:
+        """Save the checkpoint directory and the directory of the results."""
+        super(DirectoryCheckpoint, self).__init__()
+
+        self.dir_name = dir_name
+        self.basedir_name = basedir_name
+
+    def latest_dir_name(self) -> typing.Optional[str]:
+        """Return the directory of the last checkpoint, if any."""
+        try:
+            numbers = [int(name) for name in os.listdir(self.dir_name) if name.isdigit()]
+        except FileNotFoundError:
+            return None
+        if not numbers:
+            return None
+        return os.path.join(self.dir_name, str(max(numbers)))
+
+    @property
+    def step(self) -> typing.Any:
+        """Return the step of the last checkpoint, ``None`` if there is none."""
+        latest_dir_name = self.latest_dir_name()
+        if latest_dir_name is None:
+            return None
+        with open(os.path.join(latest_dir_name, CHECKPOINT_STEP_FILE_NAME_)) as step_file:
+            return json.load(step_file)['step']
+
+    def save(self, step: typing.Any, file_names: typing.List[str] = None) -> None:
+        """Save the result files as the checkpoint of the finished step."""
+        if file_names is None:
+            file_names = _walk_checkpointed(self.basedir_name)
+        latest_dir_name = self.latest_dir_name()
+        number = 0 if latest_dir_name is None else int(os.path.basename(latest_dir_name)) + 1
+        temp_dir_name = os.path.join(self.dir_name, '{0}.{1}.tmp'.format(number, uuid.uuid4().hex))
+        for file_name in file_names:
+            file_name = os.path.relpath(os.path.join(self.basedir_name, file_name), self.basedir_name)
+            src_file_name = os.path.join(self.basedir_name, file_name)
+            dst_file_name = os.path.join(temp_dir_name, CHECKPOINT_FILES_DIR_NAME_, file_name)
+            os.makedirs(os.path.dirname(dst_file_name), exist_ok=True)
+            prev_file_name = None if latest_dir_name is None else os.path.join(
+                latest_dir_name, CHECKPOINT_FILES_DIR_NAME_, file_name)
+            if (prev_file_name is not None) and _is_same_file(src_file_name, prev_file_name):
+                try:
+                    os.link(prev_file_name, dst_file_name)
+                    continue
+                except OSError:
+                    pass
+            shutil.copy2(src_file_name, dst_file_name)
+        os.makedirs(temp_dir_name, exist_ok=True)
+        with open(os.path.join(temp_dir_name, CHECKPOINT_STEP_FILE_NAME_), 'w') as step_file:
+            json.dump({'step': step}, step_file)
+        os.rename(temp_dir_name, os.path.join(self.dir_name, str(number)))
+        if latest_dir_name is not None:
+            shutil.rmtree(latest_dir_name, ignore_errors=True)
+
+    def restore(self) -> typing.Any:
+        """Copy the result files of the last checkpoint to the directory of the results, returning its step."""
+        latest_dir_name = self.latest_dir_name()
+        if latest_dir_name is None:
+            return None
+        files_dir_name = os.path.join(latest_dir_name, CHECKPOINT_FILES_DIR_NAME_)
+        for walk_root, _walk_dirs, walk_names in os.walk(files_dir_name):
+            for walk_name in walk_names:
+                file_name = os.path.relpath(os.path.join(walk_root, walk_name), files_dir_name)
+                dst_file_name = os.path.join(self.basedir_name, file_name)
+                os.makedirs(os.path.dirname(dst_file_name), exist_ok=True)
+                # NOTE Copied, not linked, so a model changing a result file in place keeps the checkpoint intact.
+                shutil.copy2(os.path.join(walk_root, walk_name), dst_file_name)
+        return self.step
+
+
+class EventCheckpoints:
+    """
+    Event checkpoints class.
+
+    The checkpoints of the models of an event are kept in a directory of
+    ``dir_name`` named after the event key, one directory per model.
+    """
+
+    def __init__(self, dir_name: str, event_key: str, basedir_name: str) -> None:
+        """Save the directory of the checkpoints of the event and the directory of the results."""
+        super(EventCheckpoints, self).__init__()
+
+        self.dir_name = os.path.join(dir_name, hashlib.sha256(event_key.encode('utf-8')).hexdigest())
+        self.basedir_name = basedir_name
+
+    def checkpoint(self, model_name: str) -> DirectoryCheckpoint:
+        """Return the checkpoint of the model."""
+        return DirectoryCheckpoint(os.path.join(self.dir_name, model_name), self.basedir_name)
+
+    def restore(self) -> typing.Dict[str, typing.Any]:
+        """Restore the last checkpoint of every model, oldest first, returning their steps by model name."""
+        try:
+            model_names = os.listdir(self.dir_name)
+            # NOTE A retry keeps the checkpoints of the event from being pruned.
+            os.utime(self.dir_name)
+        except FileNotFoundError:
+            return {}
+        checkpoints = []
+        for model_name in model_names:
+            checkpoint = self.checkpoint(model_name)
+            latest_dir_name = checkpoint.latest_dir_name()
+            if latest_dir_name is not None:
+                checkpoints.append((os.stat(latest_dir_name).st_mtime_ns, model_name, checkpoint))
+        return {model_name: checkpoint.restore() for _mtime_ns, model_name, checkpoint in sorted(checkpoints)}
+
+    def remove(self) -> None:
+        """Remove the checkpoints of the event."""
+        shutil.rmtree(self.dir_name, ignore_errors=True)
+
+
+def _last_modified(dir_name: str) -> float:
+    """Return the last modification time of the directory or of the directories in it."""
+    mtime = os.stat(dir_name).st_mtime
+    for entry in os.scandir(dir_name):
+        with contextlib.suppress(FileNotFoundError):
+            mtime = max(mtime, entry.stat().st_mtime)
+    return mtime
+
+
+def prune_checkpoints(dir_name: str, max_age: float) -> typing.List[str]:
+    """Remove the checkpoints of the events not saved or restored for ``max_age`` seconds, returning their names."""
+    try:
+        names = os.listdir(dir_name)
+    except FileNotFoundError:
+        return []
+    min_mtime = time.time() - max_age
+    pruned_names = []
+    for name in sorted(names):
+        path = os.path.join(dir_name, name)
+        try:
+            if not os.path.isdir(path) or _last_modified(path) >= min_mtime:
+                continue
+        except FileNotFoundError:
+            continue
+        shutil.rmtree(path, ignore_errors=True)
+        pruned_names.append(name)
+    return pruned_names
+
+
+def current_checkpoint() -> Checkpoint:
+    """Return the checkpoint of the running model function, a checkpoint saving nothing if there is none."""
+    checkpoint = _CURRENT_CHECKPOINT_.get()
+    return checkpoint if checkpoint is not None else Checkpoint()
+
+
+@contextlib.contextmanager
+def checkpoint_context(checkpoint: typing.Optional[Checkpoint]) -> typing.Generator[None, None, None]:
+    """Make the checkpoint the current checkpoint of the model function running in the context."""
+    token = _CURRENT_CHECKPOINT_.set(checkpoint)
+    try:
+        yield
+    finally:
+        _CURRENT_CHECKPOINT_.reset(token)
+
+
+__all__ = (
+    'Checkpoint', 'DirectoryCheckpoint', 'EventCheckpoints', 'prune_checkpoints', 'current_checkpoint',
+    'checkpoint_context',
+)
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# pacifica-dispatcher-proxymod: pacifica/dispatcher_proxymod/databases.py
+#
+# Copyright (c) 2019, Battelle Memorial Institute
+# All rights reserved.
+#
+# See LICENSE and WARRANTY for details.
+"""
+Database module for the models sharing the database of the receiver.
+
+Contains a function connecting to the database of a connection URL,
+optionally with a pool of connections reused by the threads of the
+process, and tuning file-backed SQLite databases for many processes on
+one host.
+"""
+import contextlib
+import typing
+import urllib.parse
+
+import peewee
+import playhouse.db_url
+
+
+@contextlib.contextmanager
+def connected_db_context(database: peewee.Database) -> typing.Generator[peewee.Database, None, None]:
+    """Context to connect to the database, if not connected yet, closing only the connection it opened."""
+    opened = database.is_closed()
+    if opened:
+        database.connect()
+    try:
+        yield database
+    finally:
+        if opened:
+            database.close()
+
+
+def _is_sqlite_file(parsed_url: urllib.parse.ParseResult) -> bool:
+    """Return whether the URL is of a file-backed SQLite database."""
+    return 'sqlite' in parsed_url.scheme and parsed_url.path[1:] not in ['', ':memory:']
+
+
+# pylint: disable=too-many-arguments
+def connect_database(url: str, pool: bool = False, max_connections: int = 20, stale_timeout: float = 300,
+                     sqlite_journal_mode: str = 'wal', sqlite_synchronous: str = 'normal') -> peewee.Database:
+    """
+    Return the database of the connection URL.
+
+    With ``pool``, the scheme of the URL is replaced by its pooled
+    scheme, e.g. ``postgres+pool``, keeping at most ``max_connections``
+    connections and reconnecting the connections idle for more than
+    ``stale_timeout`` seconds. In-memory SQLite databases are never
+    pooled, every connection would have its own database. File-backed
+    SQLite databases are opened with the journal mode and synchronous
+    pragmas, unless they are empty.
+    """
+    parsed_url = urllib.parse.urlparse(url)
+    connect_kwargs = {}
+    if _is_sqlite_file(parsed_url):
+        connect_kwargs['pragmas'] = [
+            (name, value) for name, value in [
+                ('journal_mode', sqlite_journal_mode), ('synchronous', sqlite_synchronous),
+            ] if value
+        ]
+    pool_scheme = '{0}+pool'.format(parsed_url.scheme)
+    if pool and (pool_scheme in playhouse.db_url.schemes) and (
+            'sqlite' not in parsed_url.scheme or _is_sqlite_file(parsed_url)):
+        url = pool_scheme + url[len(parsed_url.scheme):]
+        connect_kwargs['max_connections'] = max_connections
+        connect_kwargs['stale_timeout'] = stale_timeout
+    return playhouse.db_url.connect(url, **connect_kwargs)
+# pylint: enable=too-many-arguments
+
+
+__all__ = ('connect_database', 'connected_db_context', )
@@ -0,0 +1,449 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# pacifica-dispatcher-proxymod: pacifica/dispatcher_proxymod/downloader_runners.py
+#
+# Copyright (c) 2019, Battelle Memorial Institute
+# All rights reserved.
+#
+# See LICENSE and WARRANTY for details.
+"""
+Download runner module.
+
+This module contains download runners complementing the download
+runners from ``pacifica.dispatcher``. The first wraps another download
+runner so that files shared between events are not downloaded again
+for every event. The second downloads files from a remote Pacifica
+Cartd service concurrently, over one pooled HTTP session. The third
+stages files from a locally mounted archive without copying them,
+downloading only the files it can not reach.
+"""
+import collections
+import concurrent.futures
+import contextlib
+import functools
+import hashlib
+import os
+import shutil
+import tarfile
+import tempfile
+import time
+import typing
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover no fcntl on windows
+    fcntl = None
+
+import requests
+
+from pacifica.dispatcher.downloader_runners import DownloaderRunner, _to_opener
+from pacifica.dispatcher.models import File
+from pacifica.downloader import Downloader
+
+from .locks import locked
+from .timers import StageTimer
+
+CACHE_LOCK_FILE_NAME_ = '.lock'
+
+CACHE_COPY_BUFFER_SIZE_ = 1024 * 1024
+
+# NOTE The FICLONE ioctl of Linux, sharing the blocks of a file copy-on-write (btrfs, XFS and others).
+FICLONE_ = 0x40049409
+
+STAGE_MODES_ = ('reflink', 'hardlink', 'symlink', 'copy', )
+
+STAGE_PATH_FIELD_NAMES_ = ('_id', 'hashsum', 'hashtype', 'name', 'subdir', )
+
+
+def _is_cacheable(file: File) -> bool:
+    """Return true if the file has a hash that can be used as a cache key."""
+    return bool(file.hashsum) and bool(file.hashtype) and (file.hashtype in hashlib.algorithms_available)
+
+
+def _place(src_name: str, dst_name: str) -> None:
+    """Move (or re-link) a downloaded file to its final location."""
+    os.makedirs(os.path.dirname(dst_name), exist_ok=True)
+    if os.path.islink(src_name):
+        os.symlink(os.path.realpath(src_name), dst_name)
+    else:
+        os.replace(src_name, dst_name)
+
+
+def _link_or_copy(src_name: str, dst_name: str) -> None:
+    """Hard link a file, copying it if hard links are not supported."""
+    os.makedirs(os.path.dirname(dst_name), exist_ok=True)
+    try:
+        os.link(src_name, dst_name)
+    except OSError:
+        shutil.copyfile(src_name, dst_name)
+
+
+def _reflink(src_name: str, dst_name: str) -> None:
+    """Clone a file copy-on-write, raising ``OSError`` if the file system can not."""
+    if fcntl is None:  # pragma: no cover no fcntl on windows
+        raise OSError('reflinks are not supported')
+    with open(src_name, 'rb') as src_file, open(dst_name, 'wb') as dst_file:
+        fcntl.ioctl(dst_file.fileno(), FICLONE_, src_file.fileno())
+
+
+def _is_read_only(src_name: str) -> bool:
+    """Return true if the file can not be written, through its mode or a read-only mount."""
+    return not (os.stat(src_name).st_mode & 0o222) or not os.access(src_name, os.W_OK)
+
+
+# pylint: disable=too-few-public-methods
+class CachingDownloaderRunner(DownloaderRunner):
+    """
+    Caching download runner class.
+
+    This class keeps a content-addressed copy of downloaded files in a
+    local cache directory, keyed by the hash type and hash sum of the
+    ``File``. Files found in the cache are linked into place and only
+    the remaining files are downloaded by the wrapped download runner.
+
+    The cache is bounded by ``max_size`` bytes (zero means unbounded)
+    and the least recently used files are evicted first. Changes to the
+    cache directory are serialized with a lock file so the cache can be
+    shared by several worker processes.
+
+    The hits and misses are counted on the instance and observed by the
+    stage timer, if any, as lookups in the ``download`` cache.
+    """
+
+    def __init__(self, downloader_runner: DownloaderRunner, cache_dir_name: str, max_size: int = 0,
+                 stage_timer: StageTimer = None) -> None:
+        """Save the wrapped download runner, the cache settings and the stage timer."""
+        super(CachingDownloaderRunner, self).__init__()
+
+        self.downloader_runner = downloader_runner
+        self.cache_dir_name = cache_dir_name
+        self.max_size = max_size
+        self.stage_timer = stage_timer if stage_timer is not None else StageTimer()
+        self.hits = 0
+        self.misses = 0
+
+        os.makedirs(cache_dir_name, exist_ok=True)
+
+    def _cache_path(self, file: File) -> str:
+        """Return the path of the cache entry for the file."""
+        return os.path.join(self.cache_dir_name, file.hashtype, file.hashsum[:2], file.hashsum)
+
+    def _store(self, file: File, src_name: str) -> bool:
+        """Copy the file into the cache if the hash sum matches."""
+        hashval = hashlib.new(file.hashtype)
+        cache_path = self._cache_path(file)
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        with tempfile.NamedTemporaryFile(dir=os.path.dirname(cache_path), delete=False) as cache_file:
+            with open(src_name, 'rb') as src_file:
+                for buf in iter(functools.partial(src_file.read, CACHE_COPY_BUFFER_SIZE_), b''):
+                    hashval.update(buf)
+                    cache_file.write(buf)
+        if hashval.hexdigest() != file.hashsum:
+            os.unlink(cache_file.name)
+            return False
+        os.chmod(cache_file.name, 0o444)
+        os.replace(cache_file.name, cache_path)
+        return True
+
+    def _evict(self) -> None:
+        """Remove the least recently used cache entries until the cache fits."""
+        if not self.max_size:
+            return
+        entries = []
+        total_size = 0
+        for walk_root, _walk_dirs, file_names in os.walk(self.cache_dir_name):
+            for file_name in file_names:
+                if file_name == CACHE_LOCK_FILE_NAME_:
+                    continue
+                path = os.path.join(walk_root, file_name)
+                path_st = os.stat(path)
+                entries.append((path_st.st_mtime, path_st.st_size, path))
+                total_size += path_st.st_size
+        for _mtime, size, path in sorted(entries):
+            if total_size <= self.max_size:
+                break
+            os.unlink(path)
+            total_size -= size
+
+    # pylint: disable=line-too-long
+    def download(self, basedir_name: str,
+                 files: typing.List[File] = None,
+                 timeout: int = 180) -> typing.List[typing.Callable[[typing.Dict[str, typing.Any]], typing.TextIO]]:  # NOQA: E501
+        """
+        Download the files through the cache.
+
+        Cached files are linked into the download base directory. The
+        other files are downloaded by the wrapped download runner into
+        a staging directory, added to the cache when their hash sum
+        verifies and then moved into the download base directory.
+
+        Either case return a list of methods used to open the files.
+        """
+        if not files:
+            raise ValueError('Files should contain something.')
+
+        missed_files = []
+
+        with locked(os.path.join(self.cache_dir_name, CACHE_LOCK_FILE_NAME_)):
+            for file in files:
+                cache_path = self._cache_path(file) if _is_cacheable(file) else None
+                if (cache_path is not None) and os.path.isfile(cache_path):
+                    _link_or_copy(cache_path, os.path.join(basedir_name, file.path))
+                    # NOTE Touch the cache entry so that it is the most recently used.
+                    os.utime(cache_path)
+                    self.hits += 1
+                    self.stage_timer.observe_cache('download', True)
+                else:
+                    missed_files.append(file)
+                    self.misses += 1
+                    self.stage_timer.observe_cache('download', False)
+
+        if missed_files:
+            staging_dir_name = tempfile.mkdtemp(prefix='.cache-', dir=basedir_name)
+            try:
+                staging_openers = self.downloader_runner.download(staging_dir_name, missed_files, timeout)
+                with locked(os.path.join(self.cache_dir_name, CACHE_LOCK_FILE_NAME_)):
+                    for file, staging_opener in zip(missed_files, staging_openers):
+                        with staging_opener() as staging_file:
+                            staging_file_name = staging_file.name
+                        if _is_cacheable(file):
+                            self._store(file, staging_file_name)
+                        _place(staging_file_name, os.path.join(basedir_name, file.path))
+                    self._evict()
+            finally:
+                shutil.rmtree(staging_dir_name)
+
+        openers = list(map(functools.partial(_to_opener, basedir_name), files))
+
+        return openers
+    # pylint: enable=line-too-long
+
+
+class StagingDownloaderRunner(DownloaderRunner):
+    """
+    Staging download runner class.
+
+    This class stages the files from an archive reachable on a local or
+    shared file system, at ``path_format`` in ``archive_dir_name``,
+    formatted with the ``path`` and the other fields of the ``File``.
+    Every file is staged with the first of the ``modes`` that works: a
+    ``reflink`` shares the blocks of the archive file copy-on-write, a
+    ``hardlink`` or a ``symlink`` share the archive file itself, so they
+    are only used for archive files that can not be written, and a
+    ``copy`` copies the file.
+
+    The hash sum of an archive file is checked the first time the file
+    is staged and remembered until the file changes, so the files shared
+    between events are read once. Files missing from the archive, of
+    another size or with another hash sum are downloaded by the wrapped
+    download runner instead.
+    """
+
+    def __init__(self, downloader_runner: DownloaderRunner, archive_dir_name: str, path_format: str = '{path}',
+                 modes: typing.Iterable[str] = STAGE_MODES_) -> None:
+        """Save the wrapped download runner and the archive settings."""
+        super(StagingDownloaderRunner, self).__init__()
+
+        self.downloader_runner = downloader_runner
+        self.archive_dir_name = archive_dir_name
+        self.path_format = path_format
+        self.modes = list(modes)
+        self.counts = collections.Counter()  # type: typing.Dict[str, int]
+        self._verified = set()  # type: typing.Set[typing.Tuple]
+
+        for mode in self.modes:
+            if mode not in STAGE_MODES_:
+                raise ValueError('unknown staging mode {0}'.format(mode))
+
+    def _archive_path(self, file: File) -> str:
+        """Return the path of the file in the archive."""
+        return os.path.join(self.archive_dir_name, self.path_format.format(path=file.path, **{
+            field_name: getattr(file, field_name) for field_name in STAGE_PATH_FIELD_NAMES_
+        }))
+
+    def _is_reachable(self, file: File, archive_path: str) -> bool:
+        """Return true if the archive file exists and matches the size and the hash sum of the file."""
+        try:
+            archive_path_st = os.stat(archive_path)
+        except OSError:
+            return False
+        if (file.size is not None) and (int(file.size) != archive_path_st.st_size):
+            return False
+        if not _is_cacheable(file):
+            return True
+        key = (archive_path, archive_path_st.st_dev, archive_path_st.st_ino, archive_path_st.st_size,
+               archive_path_st.st_mtime_ns, file.hashtype, file.hashsum)
+        if key in self._verified:
+            return True
+        hashval = hashlib.new(file.hashtype)
+        with open(archive_path, 'rb') as archive_file:
+            for buf in iter(functools.partial(archive_file.read, CACHE_COPY_BUFFER_SIZE_), b''):
+                hashval.update(buf)
+        if hashval.hexdigest() != file.hashsum:
+            return False
+        self._verified.add(key)
+        return True
+
+    def _stage(self, archive_path: str, dst_name: str) -> str:
+        """Stage the archive file with the first mode that works, returning the mode."""
+        os.makedirs(os.path.dirname(dst_name), exist_ok=True)
+        read_only = _is_read_only(archive_path)
+        for mode in self.modes:
+            if (mode in ('hardlink', 'symlink')) and not read_only:
+                continue
+            try:
+                if mode == 'reflink':
+                    _reflink(archive_path, dst_name)
+                elif mode == 'hardlink':
+                    os.link(archive_path, dst_name)
+                elif mode == 'symlink':
+                    os.symlink(os.path.abspath(archive_path), dst_name)
+                else:
+                    shutil.copyfile(archive_path, dst_name)
+                return mode
+            except OSError:
+                with contextlib.suppress(FileNotFoundError):
+                    os.unlink(dst_name)
+        raise OSError('can not stage {0} with the modes {1}'.format(archive_path, self.modes))
+
+    # pylint: disable=line-too-long
+    def download(self, basedir_name: str,
+                 files: typing.List[File] = None,
+                 timeout: int = 180) -> typing.List[typing.Callable[[typing.Dict[str, typing.Any]], typing.TextIO]]:  # NOQA: E501
+        """
+        Stage the files from the archive.
+
+        The files reachable in the archive are staged into the download
+        base directory. The other files are downloaded by the wrapped
+        download runner into a staging directory and then moved into
+        the download base directory.
+
+        Either case return a list of methods used to open the files.
+        """
+        if not files:
+            raise ValueError('Files should contain something.')
+
+        missed_files = []
+
+        for file in files:
+            archive_path = self._archive_path(file)
+            if self._is_reachable(file, archive_path):
+                self.counts[self._stage(archive_path, os.path.join(basedir_name, file.path))] += 1
+            else:
+                missed_files.append(file)
+                self.counts['download'] += 1
+
+        if missed_files:
+            staging_dir_name = tempfile.mkdtemp(prefix='.stage-', dir=basedir_name)
+            try:
+                staging_openers = self.downloader_runner.download(staging_dir_name, missed_files, timeout)
+                for file, staging_opener in zip(missed_files, staging_openers):
+                    with staging_opener() as staging_file:
+                        staging_file_name = staging_file.name
+                    _place(staging_file_name, os.path.join(basedir_name, file.path))
+            finally:
+                shutil.rmtree(staging_dir_name)
+
+        openers = list(map(functools.partial(_to_opener, basedir_name), files))
+
+        return openers
+    # pylint: enable=line-too-long
+
+
+class ConcurrentDownloaderRunner(DownloaderRunner):
+    """
+    Concurrent download runner class.
+
+    This class downloads data from a Pacifica Cartd service to a local
+    directory, like ``RemoteDownloaderRunner``, but sets up one cart per
+    file and downloads up to ``concurrency`` carts at the same time.
+    All requests share one HTTP session with a connection pool sized for
+    the concurrency. A file that fails to download is tried again up to
+    ``retries`` times, sleeping ``backoff_factor * 2 ** attempt`` seconds
+    between attempts.
+    """
+
+    def __init__(self, cart_api_url: str, auth: typing.Dict[str, typing.Any] = None,
+                 concurrency: int = 4, retries: int = 3, backoff_factor: float = 1.0) -> None:
+        """Create the pooled HTTP session and the downloader using it."""
+        super(ConcurrentDownloaderRunner, self).__init__()
+
+        self.concurrency = max(concurrency, 1)
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=self.concurrency, pool_maxsize=self.concurrency)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+        self.downloader = Downloader(cart_api_url=cart_api_url, auth=auth if auth is not None else {},
+                                     session=self.session)
+
+    def _download_file(self, basedir_name: str, file: File, timeout: int) -> None:
+        """Set up a cart for one file, wait for it and extract it to the base directory."""
+        def yield_files():
+            """Yield the file for setup cart."""
+            # pylint: disable=protected-access
+            yield {
+                'id': file._id,
+                'hashsum': file.hashsum,
+                'hashtype': file.hashtype,
+                'path': file.path,
+            }
+            # pylint: enable=protected-access
+
+        cart_api = self.downloader.cart_api
+        cart_url = cart_api.wait_for_cart(cart_api.setup_cart(yield_files), timeout)
+        with self.session.get('{}?filename={}'.format(cart_url, 'data'), stream=True, **cart_api.auth) as resp:
+            resp.raise_for_status()
+            with tarfile.open(name=None, mode='r|', fileobj=resp.raw) as cart_tar:
+                cart_tar.extractall(basedir_name)
+
+    def _download_file_with_retries(self, basedir_name: str, file: File, timeout: int) -> None:
+        """Download one file, trying again with an exponential backoff."""
+        attempt = 0
+        while True:
+            try:
+                return self._download_file(basedir_name, file, timeout)
+            except (AssertionError, requests.RequestException, tarfile.TarError):
+                if attempt >= self.retries:
+                    raise
+                time.sleep(self.backoff_factor * (2 ** attempt))
+                attempt += 1
+
+    # pylint: disable=line-too-long
+    def download(self, basedir_name: str,
+                 files: typing.List[File] = None,
+                 timeout: int = 180) -> typing.List[typing.Callable[[typing.Dict[str, typing.Any]], typing.TextIO]]:  # NOQA: E501
+        """
+        Download the files concurrently.
+
+        Every file is downloaded in its own cart by a pool of threads.
+        The first download error is raised once all downloads are done.
+
+        Once complete a list of methods is returned for opening files.
+        """
+        if not files:
+            raise ValueError('Files should contain something.')
+
+        # NOTE Create the directories first so concurrent extractions do not race to create them.
+        for file in files:
+            os.makedirs(os.path.join(basedir_name, 'data', file.subdir or ''), exist_ok=True)
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=min(self.concurrency, len(files))) as executor:
+            futures = [
+                executor.submit(self._download_file_with_retries, basedir_name, file, timeout) for file in files
+            ]
+        for future in futures:
+            future.result()
+
+        openers = list(map(functools.partial(_to_opener, os.path.join(basedir_name, 'data')), files))
+
+        return openers
+    # pylint: enable=line-too-long
+# pylint: enable=too-few-public-methods
+
+
+__all__ = ('CachingDownloaderRunner', 'StagingDownloaderRunner', 'ConcurrentDownloaderRunner', )
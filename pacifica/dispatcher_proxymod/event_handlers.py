@@ -8,12 +8,19 @@
 #
 # See LICENSE and WARRANTY for details.
 """Proxymod Event Handler Module."""
-import contextlib
+import collections
+import concurrent.futures
 import copy
-import importlib
+import functools
+import hashlib
+import itertools
+import logging
 import os
 import re
+import shutil
 import tempfile
+import threading
+import time
 import typing
 
 from cloudevents.model import Event
@@ -23,8 +30,31 @@ from pacifica.dispatcher.event_handlers import EventHandler
 from pacifica.dispatcher.models import File, Transaction, TransactionKeyValue
 from pacifica.dispatcher.uploader_runners import UploaderRunner
 
+from .admission import AdmissionController, Footprint
+from .cancellation import CancelToken, ModelCancelledError, ModelTimeoutError, cancel_token_context
+from .checkpoints import EventCheckpoints, prune_checkpoints
+from .exceptions import AdmissionDeferredProxEventHandlerError, CancelledProxEventHandlerError
 from .exceptions import ConfigNotFoundProxEventHandlerError, InvalidConfigProxEventHandlerError
-from .exceptions import InvalidModelProxEventHandlerError
+from .exceptions import InvalidKeyValueProxEventHandlerError, InvalidModelProxEventHandlerError
+from .exceptions import ProxEventHandlerError, TimeoutProxEventHandlerError
+from .journals import EXECUTED_STAGE, UPLOADED_STAGE, EventJournal, JournalEntry
+from .logs import bind_log_context, compress_logs, redirect_stdout_stderr
+from .model_runners import LocalModelRunner, ModelRunner
+from .result_cache import ResultCache, walk_file_names
+from .schedulers import CycleError, run_graph, topological_order
+from .scratch import Scratch
+from .timers import StageTimer
+from .usage import ModelUsage, to_model_usage, usage_context
+
+LOGGER = logging.getLogger(__name__)
+
+PROXYMOD_TRANSACTION_KEY_VALUE_PREFIX_ = 'proxymod.'
+
+PROXYMOD_CONFIG_SCHEMA_ = {
+    'PROJECT': frozenset(['runtime', 'failure']),
+    'INPUTS': frozenset(['in_dir', 'in_file_one', 'in_file_two']),
+    'OUTPUTS': frozenset(['out_dir']),
+}
 
 RE_PATTERN_PROXYMOD_TRANSACTION_KEY_VALUE_QUAD_ = re.compile(r'^' + re.escape('.').join([
     re.escape('proxymod'),
@@ -39,6 +69,36 @@ RE_GROUP_PROXYMOD_TRANSACTION_KEY_VALUE_QUAD_HEADER_NAME_ = 2
 
 RE_GROUP_PROXYMOD_TRANSACTION_KEY_VALUE_QUAD_SUBHEADER_NAME_ = 3
 
+RE_PATTERN_PROXYMOD_TRANSACTION_KEY_VALUE_DEPENDS_ON_ = re.compile(r'^' + re.escape('.').join([
+    re.escape('proxymod'),
+    re.escape('depends_on'),
+    r'([^' + re.escape('.') + r']+)(?:' + re.escape('.py') + r')?',  # 1. model_name
+]) + r'$')
+
+RE_GROUP_PROXYMOD_TRANSACTION_KEY_VALUE_DEPENDS_ON_MODEL_NAME_ = 1
+
+RE_PATTERN_PROXYMOD_MODEL_NAME_SEPARATOR_ = re.compile(r'[\s,]+')
+
+RE_PATTERN_PROXYMOD_TRANSACTION_KEY_VALUE_SWEEP_ = re.compile(r'^' + re.escape('.').join([
+    re.escape('proxymod'),
+    re.escape('sweep'),
+    r'([^' + re.escape('.') + r']+)',  # 1. config_id
+    r'([^' + re.escape('.') + r']+)',  # 2. header_name
+    r'([^' + re.escape('.') + r']+)',  # 3. subheader_name
+]) + r'$')
+
+RE_PATTERN_PROXYMOD_SWEEP_VALUE_SEPARATOR_ = re.compile(r'\s*,\s*')
+
+PROXYMOD_VARIANT_NAME_FORMAT_ = 'variant_{0}'
+
+RE_PATTERN_PROXYMOD_TRANSACTION_KEY_VALUE_TIMEOUT_ = re.compile(r'^' + re.escape('.').join([
+    re.escape('proxymod'),
+    re.escape('timeout'),
+    r'([^' + re.escape('.') + r']+)(?:' + re.escape('.py') + r')?',  # 1. model_name
+]) + r'$')
+
+RE_GROUP_PROXYMOD_TRANSACTION_KEY_VALUE_TIMEOUT_MODEL_NAME_ = 1
+
 
 def _format_proxymod_config(config: typing.Dict[str, typing.Dict[str, typing.Any]]) -> str:
     lines = []
@@ -55,81 +115,103 @@ def _format_proxymod_config(config: typing.Dict[str, typing.Dict[str, typing.Any
 
 
 def _is_valid_proxymod_config(config: typing.Dict[str, typing.Dict[str, typing.Any]]) -> bool:
-    valid_config_meta = {
-        'PROJECT': ['runtime', 'failure'],
-        'INPUTS': ['in_dir', 'in_file_one', 'in_file_two'],
-        'OUTPUTS': ['out_dir']
-    }
     for header_name, header_values in config.items():
-        subheader_names = header_values.keys()
-        if header_name not in valid_config_meta.keys():
+        subheader_names = PROXYMOD_CONFIG_SCHEMA_.get(header_name)
+        if (subheader_names is None) or (subheader_names != header_values.keys()):
             return False
-        for subheader_name in valid_config_meta.get(header_name):
-            if subheader_name not in subheader_names:
-                return False
-        for subheader_name in subheader_names:
-            if subheader_name not in valid_config_meta.get(header_name):
-                return False
     return True
 
 
-def _to_proxymod_config_by_config_id(
+class _ProxymodKeyValueIndex(typing.NamedTuple):
+    """Index of the proxymod transaction key values of an event."""
+
+    config_by_config_id: typing.Dict[str, typing.Dict[str, typing.Dict[str, typing.Any]]]
+    configs_count: int
+    valid_by_config_id: typing.Dict[str, bool]
+    transaction_key_values: typing.List[TransactionKeyValue]
+
+
+def _index_proxymod_transaction_key_values(
         transaction_key_values: typing.List[TransactionKeyValue]
-        ) -> typing.Dict[str, typing.Dict[str, typing.Dict[str, typing.Any]]]:
+        ) -> _ProxymodKeyValueIndex:
+    """
+    Index the proxymod transaction key values in a single pass.
+
+    The configurations are built and checked against the configuration
+    schema as their key values are found, and the other proxymod key
+    values are kept, so that they are not searched for among all of the
+    key values of the event again.
+    """
     config_by_config_id = {}
+    configs_count = 0
+    invalid_config_ids = set()
+    proxymod_transaction_key_values = []
 
     for transaction_key_value in transaction_key_values:
-        match = RE_PATTERN_PROXYMOD_TRANSACTION_KEY_VALUE_QUAD_.match(transaction_key_value.key)
+        key = transaction_key_value.key
 
-        if match is not None:
-            config_id = match.group(RE_GROUP_PROXYMOD_TRANSACTION_KEY_VALUE_QUAD_CONFIG_ID_)
-            header_name = match.group(RE_GROUP_PROXYMOD_TRANSACTION_KEY_VALUE_QUAD_HEADER_NAME_)
-            subheader_name = match.group(RE_GROUP_PROXYMOD_TRANSACTION_KEY_VALUE_QUAD_SUBHEADER_NAME_)
+        if not key.startswith(PROXYMOD_TRANSACTION_KEY_VALUE_PREFIX_):
+            continue
 
-            if config_id not in config_by_config_id:
-                config_by_config_id[config_id] = {}
+        match = RE_PATTERN_PROXYMOD_TRANSACTION_KEY_VALUE_QUAD_.match(key)
 
-            if header_name not in config_by_config_id[config_id]:
-                config_by_config_id[config_id][header_name] = {}
+        # NOTE The key values of a model file name, e.g. `proxymod.depends_on.model.py`, have four parts too.
+        if (match is None) or RE_PATTERN_PROXYMOD_TRANSACTION_KEY_VALUE_DEPENDS_ON_.match(key) or \
+                RE_PATTERN_PROXYMOD_TRANSACTION_KEY_VALUE_TIMEOUT_.match(key):
+            if key == 'proxymod.configs_count':
+                configs_count = int(transaction_key_value.value)
+            else:
+                proxymod_transaction_key_values.append(transaction_key_value)
 
-            if subheader_name not in config_by_config_id[config_id][header_name]:
-                config_by_config_id[config_id][header_name][subheader_name] = transaction_key_value.value
+            continue
 
-    return config_by_config_id
+        (config_id, header_name, subheader_name) = match.groups()
 
+        header_values = config_by_config_id.setdefault(config_id, {}).setdefault(header_name, {})
 
-@contextlib.contextmanager
-def _redirect_stdout_stderr(tempdir_name, prefix='', mode='w'):
-    with open(os.path.join(tempdir_name, '{}stdout.log'.format(prefix)), mode) as stdout_file:
-        with open(os.path.join(tempdir_name, '{}stderr.log'.format(prefix)), mode) as stderr_file:
-            with contextlib.redirect_stdout(stdout_file):
-                with contextlib.redirect_stderr(stderr_file):
-                    yield (stdout_file, stderr_file)
+        if subheader_name not in header_values:
+            header_values[subheader_name] = transaction_key_value.value
 
+            if subheader_name not in PROXYMOD_CONFIG_SCHEMA_.get(header_name, ()):
+                invalid_config_ids.add(config_id)
 
-def _assert_valid_proxevent(transaction_key_value_insts, event):
-    config_by_config_id = _to_proxymod_config_by_config_id(transaction_key_values=transaction_key_value_insts)
+    # NOTE Only complete headers are left to check, every key value of the configurations is in the schema.
+    valid_by_config_id = {
+        config_id: (config_id not in invalid_config_ids) and all(
+            len(header_values) == len(PROXYMOD_CONFIG_SCHEMA_[header_name])
+            for header_name, header_values in config.items()
+        )
+        for config_id, config in config_by_config_id.items()
+    }
 
-    configs_count = 0
+    return _ProxymodKeyValueIndex(
+        config_by_config_id, configs_count, valid_by_config_id, proxymod_transaction_key_values)
 
-    for transaction_key_value in transaction_key_value_insts:
-        if transaction_key_value.key == 'proxymod.configs_count':
-            configs_count = int(transaction_key_value.value)
 
-    if configs_count <= 0:
+def _to_proxymod_config_by_config_id(
+        transaction_key_values: typing.List[TransactionKeyValue]
+        ) -> typing.Dict[str, typing.Dict[str, typing.Dict[str, typing.Any]]]:
+    return _index_proxymod_transaction_key_values(transaction_key_values).config_by_config_id
+
+
+def _assert_valid_proxindex(proxymod_key_value_index, event):
+    if proxymod_key_value_index.configs_count <= 0:
         raise ConfigNotFoundProxEventHandlerError(event, 'config_1')
 
-    for config_index in range(0, configs_count):
+    for config_index in range(0, proxymod_key_value_index.configs_count):
         config_id = 'config_{0}'.format(config_index + 1)
 
-        if config_id not in config_by_config_id:
+        if config_id not in proxymod_key_value_index.config_by_config_id:
             raise ConfigNotFoundProxEventHandlerError(event, config_id)
 
-        config = config_by_config_id[config_id]
+        if not proxymod_key_value_index.valid_by_config_id[config_id]:
+            raise InvalidConfigProxEventHandlerError(
+                event, config_id, proxymod_key_value_index.config_by_config_id[config_id])
+    return proxymod_key_value_index.config_by_config_id
 
-        if not _is_valid_proxymod_config(config):
-            raise InvalidConfigProxEventHandlerError(event, config_id, config)
-    return config_by_config_id
+
+def _assert_valid_proxevent(transaction_key_value_insts, event):
+    return _assert_valid_proxindex(_index_proxymod_transaction_key_values(transaction_key_value_insts), event)
 
 
 def _assert_valid_proxinputs(config_by_config_id, file_insts):
@@ -155,123 +237,854 @@ def _assert_valid_proxmodels(file_insts):
     return model_file_insts
 
 
+def _to_proxymod_model_name(name: str) -> str:
+    return os.path.splitext(name)[0]
+
+
+def _to_proxymod_dependencies_by_model_name(
+        transaction_key_values: typing.List[TransactionKeyValue]
+        ) -> typing.Dict[str, typing.Set[str]]:
+    dependencies_by_model_name = {}
+
+    for transaction_key_value in transaction_key_values:
+        match = RE_PATTERN_PROXYMOD_TRANSACTION_KEY_VALUE_DEPENDS_ON_.match(transaction_key_value.key)
+
+        if match is not None:
+            model_name = match.group(RE_GROUP_PROXYMOD_TRANSACTION_KEY_VALUE_DEPENDS_ON_MODEL_NAME_)
+
+            dependencies_by_model_name[model_name] = set(
+                _to_proxymod_model_name(dependency_name)
+                for dependency_name in RE_PATTERN_PROXYMOD_MODEL_NAME_SEPARATOR_.split(
+                    str(transaction_key_value.value or ''))
+                if dependency_name
+            )
+
+    return dependencies_by_model_name
+
+
+def _assert_valid_proxdependencies(transaction_key_value_insts, model_file_insts, event):
+    """
+    Return the model file indexes each model file depends on.
+
+    Without ``proxymod.depends_on.<model_name>`` transaction key values
+    every model file depends on the model file before it, otherwise
+    model files without the key value do not depend on any other.
+    """
+    model_names = [_to_proxymod_model_name(model_file_inst.name) for model_file_inst in model_file_insts]
+    dependencies_by_model_name = _to_proxymod_dependencies_by_model_name(transaction_key_value_insts)
+
+    if not dependencies_by_model_name:
+        return {index: set([index - 1]) if index > 0 else set() for index in range(len(model_file_insts))}
+
+    dependencies_by_index = {}
+    for index, model_name in enumerate(model_names):
+        dependencies_by_index[index] = set()
+        for dependency_name in dependencies_by_model_name.get(model_name, set()):
+            if dependency_name not in model_names:
+                raise InvalidModelProxEventHandlerError(
+                    event, model_file_insts[index], KeyError('unknown dependency {0}'.format(dependency_name)))
+            dependencies_by_index[index].add(model_names.index(dependency_name))
+
+    try:
+        topological_order(list(range(len(model_file_insts))), dependencies_by_index)
+    except CycleError as reason:
+        raise InvalidModelProxEventHandlerError(event, model_file_insts[reason.nodes[0]], reason)
+
+    return dependencies_by_index
+
+
+def _assert_valid_proxsweep(transaction_key_value_insts, config_by_config_id, event):
+    """
+    Return the configurations of every variant of the event, by variant name.
+
+    Every ``proxymod.sweep.<config_id>.<header_name>.<subheader_name>``
+    transaction key value is a comma separated list of values of the
+    configuration value, and the variants are every combination of the
+    values. Without sweep key values the only variant is the event, with
+    an empty name.
+    """
+    axes = []
+
+    for transaction_key_value in transaction_key_value_insts:
+        match = RE_PATTERN_PROXYMOD_TRANSACTION_KEY_VALUE_SWEEP_.match(transaction_key_value.key)
+
+        if match is not None:
+            (config_id, header_name, subheader_name) = match.groups()
+
+            if config_id not in config_by_config_id:
+                raise ConfigNotFoundProxEventHandlerError(event, config_id)
+
+            if subheader_name not in config_by_config_id[config_id].get(header_name, {}):
+                raise InvalidConfigProxEventHandlerError(event, config_id, config_by_config_id[config_id])
+
+            values = [
+                value for value in RE_PATTERN_PROXYMOD_SWEEP_VALUE_SEPARATOR_.split(
+                    str(transaction_key_value.value or '').strip())
+                if value
+            ]
+
+            if not values:
+                raise InvalidConfigProxEventHandlerError(event, config_id, config_by_config_id[config_id])
+
+            axes.append(((config_id, header_name, subheader_name), values))
+
+    if not axes:
+        return collections.OrderedDict([('', config_by_config_id)])
+
+    config_by_config_id_by_variant = collections.OrderedDict()
+
+    for variant_index, values in enumerate(itertools.product(*[axis_values for _axis, axis_values in axes])):
+        variant_config_by_config_id = copy.deepcopy(config_by_config_id)
+
+        for ((config_id, header_name, subheader_name), _axis_values), value in zip(axes, values):
+            variant_config_by_config_id[config_id][header_name][subheader_name] = value
+
+        config_by_config_id_by_variant[PROXYMOD_VARIANT_NAME_FORMAT_.format(variant_index + 1)] = \
+            variant_config_by_config_id
+
+    return config_by_config_id_by_variant
+
+
+def _to_proxymod_timeout(value: typing.Any) -> float:
+    """Return the time budget in seconds, raising ``ValueError`` unless it is a positive number."""
+    timeout = float(value)
+    if not timeout > 0:
+        raise ValueError('timeout must be a positive number of seconds, not {0}'.format(value))
+    return timeout
+
+
+def _clamp_proxymod_timeout(timeout: float, max_timeout: float) -> float:
+    """Return the time budget within the maximum, the maximum without a time budget (zero means no limit)."""
+    if not max_timeout:
+        return timeout
+    return min(timeout, max_timeout) if timeout else max_timeout
+
+
+def _assert_valid_proxtimeouts(transaction_key_value_insts, model_file_insts, event):
+    """
+    Return the time budget of the event and the time budgets by model name, in seconds.
+
+    The ``proxymod.timeout`` transaction key value is the time budget of
+    the event and every ``proxymod.timeout.<model_name>`` transaction key
+    value the time budget of every run of the model. Without them the
+    time budget is zero, no limit.
+    """
+    model_names = set(_to_proxymod_model_name(model_file_inst.name) for model_file_inst in model_file_insts)
+    timeout = 0
+    timeout_by_model_name = {}
+
+    for transaction_key_value in transaction_key_value_insts:
+        match = RE_PATTERN_PROXYMOD_TRANSACTION_KEY_VALUE_TIMEOUT_.match(transaction_key_value.key)
+        model_name = None
+
+        if match is not None:
+            model_name = match.group(RE_GROUP_PROXYMOD_TRANSACTION_KEY_VALUE_TIMEOUT_MODEL_NAME_)
+
+            if model_name not in model_names:
+                continue
+        elif transaction_key_value.key != 'proxymod.timeout':
+            continue
+
+        try:
+            value = _to_proxymod_timeout(transaction_key_value.value)
+        except (TypeError, ValueError) as reason:
+            raise InvalidKeyValueProxEventHandlerError(
+                event, transaction_key_value.key, transaction_key_value.value, reason)
+
+        if model_name is None:
+            timeout = value
+        else:
+            timeout_by_model_name[model_name] = value
+
+    return (timeout, timeout_by_model_name)
+
+
+def _is_proxymod_memoized(transaction_key_values: typing.List[TransactionKeyValue]) -> bool:
+    for transaction_key_value in transaction_key_values:
+        if transaction_key_value.key == 'proxymod.memoize':
+            return str(transaction_key_value.value).lower() not in ['0', 'false', 'no', 'off']
+    return True
+
+
+def _to_proxymod_result_key(model_file_inst_openers, input_file_inst_openers, config_by_config_id_by_variant,
+                            dependencies_by_index) -> str:
+    """Return the digest of the model files, input files, configurations of the variants and model dependencies."""
+    hashval = hashlib.sha256()
+
+    for label, file_inst_openers in [('model', model_file_inst_openers), ('input', input_file_inst_openers)]:
+        for file_inst, opener in file_inst_openers:
+            with opener() as file:
+                file_name = file.name
+            file_hashval = hashlib.sha256()
+            with open(file_name, mode='rb') as file:
+                for buf in iter(functools.partial(file.read, 1024 * 1024), b''):
+                    file_hashval.update(buf)
+            hashval.update(bytes('{0} {1} {2}\n'.format(label, file_inst.path, file_hashval.hexdigest()), 'utf-8'))
+
+    for variant_name, config_by_config_id in config_by_config_id_by_variant.items():
+        if variant_name:
+            hashval.update(bytes('variant {0}\n'.format(variant_name), 'utf-8'))
+
+        for config_id in sorted(config_by_config_id.keys()):
+            hashval.update(bytes('config {0}\n'.format(config_id), 'utf-8'))
+            hashval.update(bytes(_format_proxymod_config(config_by_config_id[config_id]), 'utf-8'))
+
+    for index in sorted(dependencies_by_index.keys()):
+        hashval.update(bytes('depends {0} {1}\n'.format(index, sorted(dependencies_by_index[index])), 'utf-8'))
+
+    return hashval.hexdigest()
+
+
+def _to_proxymod_usage_transaction_key_values(
+        model_usage_by_node: typing.Dict[typing.Tuple[str, str], ModelUsage]) -> typing.List[TransactionKeyValue]:
+    """Return the transaction key-values of the resources used by the model runs of every variant."""
+    transaction_key_values = []
+
+    for (variant_name, model_name), model_usage in model_usage_by_node.items():
+        for field_name, value in model_usage._asdict().items():
+            if value is not None:
+                transaction_key_values.append(TransactionKeyValue(
+                    key='.'.join(filter(None, ['proxymod.usage', variant_name, model_name, field_name])),
+                    # NOTE As text, the metadata of the upload is invalid with a value of zero.
+                    value=str(round(value, 6) if isinstance(value, float) else value)
+                ))
+
+    return transaction_key_values
+
+
+def _to_proxymod_file_key(file_inst: File) -> typing.Tuple:
+    """Return the key of the file, equal for the same file of different events."""
+    # pylint: disable=protected-access
+    return (file_inst.path, file_inst.hashtype, file_inst.hashsum, file_inst._id)
+    # pylint: enable=protected-access
+
+
+def _to_proxymod_download_slots(file_insts_by_event: typing.List[typing.List[File]]) -> typing.List[typing.List[File]]:
+    """
+    Return the distinct files of the events split up so that no two files of a list have the same path.
+
+    The files of every list are downloaded to their own directory, so
+    that distinct files with the same path do not overwrite each other.
+    All of the files of an event are in the same list, so that its
+    input files are in the same directory.
+    """
+    slots = []
+    file_key_by_path_by_slot = []
+
+    for file_insts in file_insts_by_event:
+        file_key_by_path = {file_inst.path: _to_proxymod_file_key(file_inst) for file_inst in file_insts}
+
+        for slot, slot_file_key_by_path in zip(slots, file_key_by_path_by_slot):
+            if all(slot_file_key_by_path.get(path, file_key) == file_key
+                   for path, file_key in file_key_by_path.items()):
+                break
+        else:
+            slot = []
+            slot_file_key_by_path = {}
+            slots.append(slot)
+            file_key_by_path_by_slot.append(slot_file_key_by_path)
+
+        for file_inst in file_insts:
+            if file_inst.path not in slot_file_key_by_path:
+                slot_file_key_by_path[file_inst.path] = _to_proxymod_file_key(file_inst)
+                slot.append(file_inst)
+
+    return slots
+
+
+def _to_proxymod_event_key(event: Event, transaction_inst: Transaction) -> str:
+    """Return the key of the event in the event journal, the same for every delivery of the event."""
+    if event.event_id:
+        return 'event:{0}'.format(event.event_id)
+    # pylint: disable=protected-access
+    return 'transaction:{0}'.format(transaction_inst._id)
+    # pylint: enable=protected-access
+
+
+class _ProxEvent(typing.NamedTuple):
+    """Validated proxymod event."""
+
+    event_key: str
+    transaction_inst: Transaction
+    transaction_key_value_insts: typing.List[TransactionKeyValue]
+    config_by_config_id: typing.Dict[str, typing.Dict[str, typing.Dict[str, typing.Any]]]
+    input_file_insts: typing.List[File]
+    model_file_insts: typing.List[File]
+    dependencies_by_index: typing.Dict[int, typing.Set[int]]
+    config_by_config_id_by_variant: typing.Dict[str, typing.Dict[str, typing.Dict[str, typing.Dict[str, typing.Any]]]]
+    timeout: float
+    timeout_by_model_name: typing.Dict[str, float]
+
+
 # pylint: disable=too-few-public-methods
 class ProxEventHandler(EventHandler):
     """
     Proxymod Event Handler Class.
 
     Handle a proxymod event and run proxymod.
+
+    Handling an event (the ``event`` stage) and its stages
+    (``validate``, ``download``, ``memoize``, ``restore``, ``import``,
+    ``config``, ``run`` and ``upload``) are timed by the stage timer, which also
+    observes the outcome of the event.
+
+    The last finished stage of every event is saved to the event
+    journal. An event delivered again after its upload is not handled
+    again, and an event delivered again after its models ran has their
+    results restored from the result cache, if they are in it.
+
+    The logs of the downloads and uploads keep at most ``log_max_size``
+    bytes each (zero means no limit) and, with ``log_compress``, the log
+    files are compressed with gzip before the upload.
+
+    With a ``checkpoint_dir_name``, the model functions save checkpoints
+    of their timesteps in a directory of the event kept across retries.
+    The last checkpoint of every model is restored before the models run
+    again, and the checkpoints are removed once the event is uploaded.
+    The checkpoints of the events not saved or restored for
+    ``checkpoint_max_age`` seconds (zero means no limit), like the events
+    that failed for good, are removed before an event runs its models.
+
+    The results of the models and the configuration files of the model
+    runs are written to directories of the ``scratch``, by default in
+    the temporary directory of the system. The results directory of an
+    event expects the output bytes of the estimated footprint of the
+    event, and the scratch is charged for its files after every model
+    run; a model run over the budget of the scratch raises
+    ``InvalidModelProxEventHandlerError``.
+
+    Before the files of an event are downloaded, the footprint of the
+    event is reserved with the ``admission_controller``, which raises
+    ``AdmissionDeferredProxEventHandlerError`` if the worker does not
+    have the headroom to handle it now, and the admission decision is
+    observed by the stage timer. By default every event is admitted.
+
+    The models of an event run within the time budget of the event,
+    which counts from the time its download starts, and every run of a
+    model within the time budget of the model, both
+    capped by ``max_event_timeout`` and ``max_model_timeout`` seconds
+    (zero means no limit). A model out of time raises
+    ``TimeoutProxEventHandlerError`` and the events cancelled by the
+    ``cancel`` method raise ``CancelledProxEventHandlerError``; the logs
+    of the event are then uploaded with the ``proxymod.cancelled``
+    transaction key value before the error is raised again.
     """
 
-    def __init__(self, downloader_runner: DownloaderRunner, uploader_runner: UploaderRunner) -> None:
-        """Save the download and upload runner classes for later use."""
+    # pylint: disable=too-many-arguments
+    def __init__(self, downloader_runner: DownloaderRunner, uploader_runner: UploaderRunner,
+                 model_runner: ModelRunner = None, result_cache: ResultCache = None,
+                 stage_timer: StageTimer = None, event_journal: EventJournal = None,
+                 log_max_size: int = 0, log_compress: bool = False, checkpoint_dir_name: str = None,
+                 scratch: Scratch = None, admission_controller: AdmissionController = None,
+                 max_event_timeout: float = 0, max_model_timeout: float = 0, checkpoint_max_age: float = 0) -> None:
+        """Save the download, upload and model runner classes, the result cache, stage timer and event journal."""
         super(ProxEventHandler, self).__init__()
         self.downloader_runner = downloader_runner
         self.uploader_runner = uploader_runner
-
+        self.model_runner = model_runner if model_runner is not None else LocalModelRunner()
+        self.result_cache = result_cache
+        self.stage_timer = stage_timer if stage_timer is not None else StageTimer()
+        self.event_journal = event_journal if event_journal is not None else EventJournal()
+        self.log_max_size = log_max_size
+        self.log_compress = log_compress
+        self.checkpoint_dir_name = checkpoint_dir_name
+        self.checkpoint_max_age = checkpoint_max_age
+        self.scratch = scratch if scratch is not None else Scratch()
+        self.admission_controller = admission_controller if admission_controller is not None else \
+            AdmissionController()
+        self.max_event_timeout = max_event_timeout
+        self.max_model_timeout = max_model_timeout
+        self._cancel_tokens = set()  # type: typing.Set[CancelToken]
+        # NOTE Reentrant, the events are cancelled by signal handlers that run in the thread handling the events.
+        self._lock = threading.RLock()
+    # pylint: enable=too-many-arguments
+
+    def _download_files(self, downloader_tempdir_name: str,
+                        file_insts: typing.List[File]) -> typing.List[typing.Callable]:
+        """Download the files in a worker thread, saving what the stage timer observed in the thread."""
+        try:
+            return self.downloader_runner.download(downloader_tempdir_name, file_insts)
+        finally:
+            # NOTE The observations are kept per thread, the worker thread is gone by the end of the event.
+            self.stage_timer.flush()
+
+    def _download(self, downloader_tempdir_name: str, model_file_insts: typing.List[File],
+                  input_file_insts: typing.List[File]) -> typing.Tuple[typing.List[typing.Callable],
+                                                                       typing.List[typing.Callable]]:
+        """Download the model files and the input files at the same time."""
+        with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+            model_file_openers_future = executor.submit(
+                bind_log_context(self._download_files), downloader_tempdir_name, model_file_insts)
+            input_file_openers_future = executor.submit(
+                bind_log_context(self._download_files), downloader_tempdir_name, input_file_insts)
+        return (model_file_openers_future.result(), input_file_openers_future.result())
+
+    @staticmethod
+    def _write_configs(input_file_openers: typing.List[typing.Callable],
+                       config_by_config_id: typing.Dict[str, typing.Dict[str, typing.Dict[str, typing.Any]]],
+                       uploader_tempdir_name: str, config_dir_name: str = None) -> typing.List[typing.IO]:
+        """Write the configuration files to upload and the temporary configuration files to run the models."""
+        abspath_config_by_config_id = copy.deepcopy(config_by_config_id)
+
+        for config_id, config in abspath_config_by_config_id.items():
+            if 'INPUTS' in config:
+                if 'in_dir' in config['INPUTS']:
+                    for opener in input_file_openers:
+                        with opener() as file:
+                            config['INPUTS']['in_dir'] = os.path.abspath(os.path.dirname(file.name))
+
+                            break
+
+            if 'OUTPUTS' in config:
+                if 'out_dir' in config['OUTPUTS']:
+                    config['OUTPUTS']['out_dir'] = os.path.abspath(
+                        os.path.join(uploader_tempdir_name, config['OUTPUTS']['out_dir']))
+
+        for config_id, config in config_by_config_id.items():
+            with open(os.path.join(uploader_tempdir_name, '{0}.ini'.format(config_id)), 'w') as config_file:
+                config_file.write(_format_proxymod_config(config))
+
+        config_files = []
+
+        for config_id, abspath_config in abspath_config_by_config_id.items():
+            config_file = tempfile.NamedTemporaryFile(suffix='.ini', dir=config_dir_name, delete=False)
+            config_file.write(bytes(_format_proxymod_config(abspath_config), 'utf-8'))
+            config_file.close()
+
+            config_files.append(config_file)
+
+        return config_files
+
+    # pylint: disable=too-many-arguments
     # pylint: disable=too-many-locals
-    # pylint: disable=too-many-branches
-    # pylint: disable=too-many-statements
-    def handle(self, event: Event) -> None:
-        """Handle the proxymod event."""
-        transaction_inst = Transaction.from_cloudevents_model(event)
-        transaction_key_value_insts = TransactionKeyValue.from_cloudevents_model(event)
-        file_insts = File.from_cloudevents_model(event)
-        config_by_config_id = _assert_valid_proxevent(transaction_key_value_insts, event)
-        input_file_insts = _assert_valid_proxinputs(config_by_config_id, file_insts)
-        model_file_insts = _assert_valid_proxmodels(file_insts)
+    def _execute(self, event: Event, model_file_insts: typing.List[File],
+                 model_file_openers: typing.List[typing.Callable], input_file_openers: typing.List[typing.Callable],
+                 config_by_config_id_by_variant: typing.Dict[str, typing.Dict[str, typing.Dict[
+                     str, typing.Dict[str, typing.Any]]]],
+                 dependencies_by_index: typing.Dict[int, typing.Set[int]], uploader_tempdir_name: str,
+                 event_checkpoints_by_variant: typing.Dict[str, EventCheckpoints] = None,
+                 cancel_token: CancelToken = None, timeout_by_model_name: typing.Dict[str, float] = None
+                 ) -> typing.Dict[typing.Tuple[str, str], ModelUsage]:
+        """
+        Load the models once, write the configuration files and run the models of every variant.
+
+        The models of a variant write their results to the directory of
+        the variant and every variant runs on its own; the models of all
+        of the variants share the concurrency of the model runner. The
+        resources used by every model run are returned by variant name
+        and model name, in the order the runs finished. The bytes written
+        by a model run are measured only if the models of a variant run
+        one at a time, they share the output directories of the variant.
+
+        Every model run is limited to the time budget of the model, if
+        any, and to the time left to the cancel token of the event.
+        """
+        cancel_token = cancel_token if cancel_token is not None else CancelToken()
+        timeout_by_model_name = timeout_by_model_name if timeout_by_model_name is not None else {}
+        model_file_models = []
+        model_usage_by_node = collections.OrderedDict()
+
+        with self.stage_timer.stage('import'):
+            for model_file_inst, model_file_opener in zip(model_file_insts, model_file_openers):
+                with model_file_opener() as file:
+                    try:
+                        name = _to_proxymod_model_name(model_file_inst.name)
+
+                        model_file_models.append(self.model_runner.load(name, file.name))
+                    except Exception as reason:  # pragma: no cover trying happy path first
+                        raise InvalidModelProxEventHandlerError(event, model_file_inst, reason)
+
+        variant_names = list(config_by_config_id_by_variant.keys())
+        config_files_by_variant = {}
+        measure_written = (self.model_runner.concurrency == 1) or (len(model_file_insts) == 1)
+
+        # NOTE The temporary configuration files are removed with their scratch directory, whatever happens.
+        with self.scratch.directory('configs-') as config_dir_name:
+            with self.stage_timer.stage('config'):
+                for variant_name, config_by_config_id in config_by_config_id_by_variant.items():
+                    variant_dir_name = os.path.join(uploader_tempdir_name, variant_name)
+                    os.makedirs(variant_dir_name, exist_ok=True)
+                    config_files_by_variant[variant_name] = self._write_configs(
+                        input_file_openers, config_by_config_id, variant_dir_name, config_dir_name)
+
+            def run_model(node: typing.Tuple[int, int]) -> None:
+                """Run the model file with the index, for the variant with the index."""
+                (variant_index, index) = node
+                variant_name = variant_names[variant_index]
+                model_name = _to_proxymod_model_name(model_file_insts[index].name)
+                if cancel_token.cancelled:
+                    raise CancelledProxEventHandlerError(event, cancel_token.reason)
+                timeout = _clamp_proxymod_timeout(timeout_by_model_name.get(model_name, 0), self.max_model_timeout)
+                remaining = cancel_token.remaining()
+                if remaining is not None:
+                    if remaining <= 0:
+                        raise TimeoutProxEventHandlerError(event, None, cancel_token.timeout)
+                    timeout = min(timeout, remaining) if timeout else remaining
+                kwargs = {}
+                if timeout:
+                    kwargs['timeout'] = timeout
+                if event_checkpoints_by_variant is not None:
+                    kwargs['checkpoint'] = event_checkpoints_by_variant[variant_name].checkpoint(
+                        _to_proxymod_model_name(model_file_insts[index].name))
+                out_dir_names = [
+                    os.path.join(uploader_tempdir_name, variant_name, config['OUTPUTS']['out_dir'])
+                    for config in config_by_config_id_by_variant[variant_name].values()
+                    if 'out_dir' in config.get('OUTPUTS', {})
+                ]
+                try:
+                    with usage_context(out_dir_names if measure_written else None) as usage, \
+                            cancel_token_context(cancel_token):
+                        self.model_runner.run(
+                            model_file_models[index],
+                            list(map(lambda config_file: config_file.name, config_files_by_variant[variant_name])),
+                            os.path.join(uploader_tempdir_name, variant_name), **kwargs
+                        )
+                    self.scratch.charge(uploader_tempdir_name)
+                except ModelTimeoutError:
+                    raise TimeoutProxEventHandlerError(event, model_file_insts[index], round(timeout, 3))
+                except Exception as reason:  # pragma: no cover happy path testing
+                    if cancel_token.cancelled:
+                        raise CancelledProxEventHandlerError(event, cancel_token.reason)
+                    if isinstance(reason, ModelCancelledError):
+                        raise CancelledProxEventHandlerError(event, str(reason))
+                    raise InvalidModelProxEventHandlerError(
+                        event, model_file_insts[index], reason)
+                model_usage_by_node[(variant_name, model_name)] = to_model_usage(usage)
+
+            nodes = [
+                (variant_index, index)
+                for variant_index in range(len(variant_names)) for index in range(len(model_file_insts))
+            ]
+
+            with self.stage_timer.stage('run'):
+                run_graph(nodes, {
+                    node: set((node[0], dependency) for dependency in dependencies_by_index[node[1]]) for node in nodes
+                }, run_model, self.model_runner.concurrency, self.model_runner.cancel)
+
+        return model_usage_by_node
+    # pylint: enable=too-many-arguments
+    # pylint: enable=too-many-locals
 
-        with tempfile.TemporaryDirectory() as downloader_tempdir_name:
-            with tempfile.TemporaryDirectory() as uploader_tempdir_name:
-                # model_file_openers = self.downloader_runner.download(downloader_tempdir_name, model_file_insts)
-                with _redirect_stdout_stderr(uploader_tempdir_name, 'download-'):
-                    model_file_openers = self.downloader_runner.download(
-                        downloader_tempdir_name, model_file_insts)
-
-                model_file_funcs = []
-
-                for model_file_inst, model_file_opener in zip(model_file_insts, model_file_openers):
-                    with model_file_opener() as file:
-                        try:
-                            name = os.path.splitext(model_file_inst.name)[0]
-
-                            spec = importlib.util.spec_from_file_location(name, file.name)
-                            module = importlib.util.module_from_spec(spec)
-                            spec.loader.exec_module(module)
-
-                            # NOTE Deliberately raise `AttributeError` if `name` does not exist.
-                            func = getattr(module, name)
-
-                            if callable(func):
-                                model_file_funcs.append(func)
-                            else:  # pragma: no cover should do this later.
-                                # NOTE Deliberately raise `TypeError` by calling an uncallable.
-                                func()
-                        except Exception as reason:  # pragma: no cover trying happy path first
-                            raise InvalidModelProxEventHandlerError(event, model_file_inst, reason)
-
-                # input_file_openers = self.downloader_runner.download(downloader_tempdir_name, input_file_insts)
-
-                with _redirect_stdout_stderr(uploader_tempdir_name, 'download-', 'a'):
-                    input_file_openers = self.downloader_runner.download(
-                        downloader_tempdir_name, input_file_insts)
-
-                abspath_config_by_config_id = copy.deepcopy(config_by_config_id)
-
-                for config_id, config in abspath_config_by_config_id.items():
-                    if 'INPUTS' in config:
-                        if 'in_dir' in config['INPUTS']:
-                            for opener in input_file_openers:
-                                with opener() as file:
-                                    config['INPUTS']['in_dir'] = os.path.abspath(os.path.dirname(file.name))
-
-                                    break
-
-                    if 'OUTPUTS' in config:
-                        if 'out_dir' in config['OUTPUTS']:
-                            config['OUTPUTS']['out_dir'] = os.path.abspath(
-                                os.path.join(uploader_tempdir_name, config['OUTPUTS']['out_dir']))
-
-                for config_id, config in config_by_config_id.items():
-                    with open(os.path.join(uploader_tempdir_name, '{0}.ini'.format(config_id)), 'w') as config_file:
-                        config_file.write(_format_proxymod_config(config))
-
-                config_files = []
-
-                for config_id, abspath_config in abspath_config_by_config_id.items():
-                    config_file = tempfile.NamedTemporaryFile(suffix='.ini', delete=False)
-                    config_file.write(bytes(_format_proxymod_config(abspath_config), 'utf-8'))
-                    config_file.close()
-
-                    config_files.append(config_file)
-
-                with _redirect_stdout_stderr(uploader_tempdir_name):
-                    inst_func_zip = zip(model_file_insts, model_file_funcs)
-                    for model_file_inst, model_file_func in inst_func_zip:
-                        try:
-                            model_file_func(*list(map(lambda config_file: config_file.name, config_files)))
-                        except Exception as reason:  # pragma: no cover happy path testing
-                            raise InvalidModelProxEventHandlerError(
-                                event, model_file_inst, reason)
-
-                for config_file in config_files:
-                    os.unlink(config_file.name)
-
-                with _redirect_stdout_stderr(uploader_tempdir_name, 'upload-'):
+    def _validate(self, event: Event) -> _ProxEvent:
+        """Validate the proxymod event."""
+        with self.stage_timer.stage('validate'):
+            transaction_inst = Transaction.from_cloudevents_model(event)
+            transaction_key_value_insts = TransactionKeyValue.from_cloudevents_model(event)
+            file_insts = File.from_cloudevents_model(event)
+            proxymod_key_value_index = _index_proxymod_transaction_key_values(transaction_key_value_insts)
+            config_by_config_id = _assert_valid_proxindex(proxymod_key_value_index, event)
+            config_by_config_id_by_variant = _assert_valid_proxsweep(
+                proxymod_key_value_index.transaction_key_values, config_by_config_id, event)
+            input_file_insts = []
+            for variant_config_by_config_id in config_by_config_id_by_variant.values():
+                for input_file_inst in _assert_valid_proxinputs(variant_config_by_config_id, file_insts):
+                    if input_file_inst not in input_file_insts:
+                        input_file_insts.append(input_file_inst)
+            model_file_insts = _assert_valid_proxmodels(file_insts)
+            dependencies_by_index = _assert_valid_proxdependencies(
+                proxymod_key_value_index.transaction_key_values, model_file_insts, event)
+            (timeout, timeout_by_model_name) = _assert_valid_proxtimeouts(
+                proxymod_key_value_index.transaction_key_values, model_file_insts, event)
+
+        return _ProxEvent(_to_proxymod_event_key(event, transaction_inst), transaction_inst,
+                          proxymod_key_value_index.transaction_key_values, config_by_config_id,
+                          input_file_insts, model_file_insts, dependencies_by_index, config_by_config_id_by_variant,
+                          _clamp_proxymod_timeout(timeout, self.max_event_timeout), timeout_by_model_name)
+
+    def _estimate(self, proxevent: _ProxEvent) -> Footprint:
+        """Return the estimated footprint of the event."""
+        return self.admission_controller.estimate(
+            [_to_proxymod_model_name(model_file_inst.name) for model_file_inst in proxevent.model_file_insts],
+            proxevent.model_file_insts, proxevent.input_file_insts, len(proxevent.config_by_config_id_by_variant))
+
+    def _admit(self, event: Event, footprint: Footprint) -> typing.Dict[typing.Tuple[str, int], int]:
+        """Reserve the estimated footprint of the event, returning the reservation to release."""
+        try:
+            reservation = self.admission_controller.reserve(event, footprint)
+        except AdmissionDeferredProxEventHandlerError as reason:
+            self.stage_timer.observe_admission(reason.resource)
+            raise
+        self.stage_timer.observe_admission(None)
+        return reservation
+
+    def _upload_cancelled(self, proxevent: _ProxEvent, uploader_tempdir_name: str,
+                          reason: CancelledProxEventHandlerError) -> None:
+        """Upload the logs of the cancelled event with the reason, logging the upload errors instead of raising them."""
+        with self.scratch.directory('cancelled-') as logs_dir_name:
+            for file_name in walk_file_names(uploader_tempdir_name):
+                if file_name.endswith('.log'):
+                    os.makedirs(os.path.join(logs_dir_name, os.path.dirname(file_name)), exist_ok=True)
+                    shutil.copyfile(os.path.join(uploader_tempdir_name, file_name),
+                                    os.path.join(logs_dir_name, file_name))
+
+            if self.log_compress:
+                compress_logs(logs_dir_name)
+
+            try:
+                with self.stage_timer.stage('upload'), redirect_stdout_stderr(
+                        logs_dir_name, 'upload-', max_size=self.log_max_size):
                     # pylint: disable=protected-access
-                    (_bundle, _job_id, _state) = self.uploader_runner.upload(
-                        uploader_tempdir_name, transaction=Transaction(
-                            submitter=transaction_inst.submitter,
-                            instrument=transaction_inst.instrument,
-                            project=transaction_inst.project
+                    self.uploader_runner.upload(
+                        logs_dir_name, transaction=Transaction(
+                            submitter=proxevent.transaction_inst.submitter,
+                            instrument=proxevent.transaction_inst.instrument,
+                            project=proxevent.transaction_inst.project
                         ), transaction_key_values=[
-                            TransactionKeyValue(key='Transactions._id', value=transaction_inst._id)
+                            TransactionKeyValue(key='Transactions._id', value=proxevent.transaction_inst._id),
+                            TransactionKeyValue(key='proxymod.cancelled', value=str(reason)),
                         ]
                     )
                     # pylint: enable=protected-access
+            except Exception:  # pylint: disable=broad-except
+                LOGGER.exception('failed to upload the logs of the cancelled event')
+
+    # pylint: disable=too-many-arguments
+    def _process(self, event: Event, proxevent: _ProxEvent, model_file_openers: typing.List[typing.Callable],
+                 input_file_openers: typing.List[typing.Callable], uploader_tempdir_name: str,
+                 journal_entry: JournalEntry, start: float = None) -> None:
+        """
+        Run the models of the proxymod event within its time budget, uploading the logs if it is cancelled.
+
+        The time budget of the event counts from ``start``, when its
+        download started, a time of the monotonic clock.
+        """
+        cancel_token = CancelToken(proxevent.timeout, start)
+        with self._lock:
+            self._cancel_tokens.add(cancel_token)
+        try:
+            self._process_cancellable(event, proxevent, model_file_openers, input_file_openers,
+                                      uploader_tempdir_name, journal_entry, cancel_token)
+        except CancelledProxEventHandlerError as reason:
+            self._upload_cancelled(proxevent, uploader_tempdir_name, reason)
+            raise
+        finally:
+            with self._lock:
+                self._cancel_tokens.discard(cancel_token)
+
+    def _process_cancellable(self, event: Event, proxevent: _ProxEvent,
+                             model_file_openers: typing.List[typing.Callable],
+                             input_file_openers: typing.List[typing.Callable], uploader_tempdir_name: str,
+                             journal_entry: JournalEntry, cancel_token: CancelToken) -> None:
+        """Run the models of the proxymod event, or restore their results, then upload the results."""
+        event_checkpoints_by_variant = None
+        if self.checkpoint_dir_name is not None:
+            if self.checkpoint_max_age:
+                prune_checkpoints(self.checkpoint_dir_name, self.checkpoint_max_age)
+            event_checkpoints_by_variant = {
+                variant_name: EventCheckpoints(
+                    self.checkpoint_dir_name, '/'.join(filter(None, [proxevent.event_key, variant_name])),
+                    os.path.join(uploader_tempdir_name, variant_name))
+                for variant_name in proxevent.config_by_config_id_by_variant
+            }
+
+        result_key = None
+        if (self.result_cache is not None) and (journal_entry.stage == EXECUTED_STAGE) and (
+                journal_entry.result_key is not None):
+            result_key = journal_entry.result_key
+        elif (self.result_cache is not None) and _is_proxymod_memoized(proxevent.transaction_key_value_insts):
+            with self.stage_timer.stage('memoize'):
+                result_key = _to_proxymod_result_key(
+                    zip(proxevent.model_file_insts, model_file_openers),
+                    zip(proxevent.input_file_insts, input_file_openers),
+                    proxevent.config_by_config_id_by_variant, proxevent.dependencies_by_index)
+
+        model_usage_by_node = {}
+        if (result_key is None) or not self.result_cache.restore(result_key, uploader_tempdir_name):
+            before_file_names = set(walk_file_names(uploader_tempdir_name))
+
+            if event_checkpoints_by_variant is not None:
+                with self.stage_timer.stage('restore'):
+                    for event_checkpoints in event_checkpoints_by_variant.values():
+                        event_checkpoints.restore()
+
+            model_usage_by_node = self._execute(event, proxevent.model_file_insts, model_file_openers,
+                                                input_file_openers, proxevent.config_by_config_id_by_variant,
+                                                proxevent.dependencies_by_index, uploader_tempdir_name,
+                                                event_checkpoints_by_variant, cancel_token,
+                                                proxevent.timeout_by_model_name)
+
+            for (_variant_name, model_name), model_usage in model_usage_by_node.items():
+                self.stage_timer.observe_usage(model_name, model_usage)
+
+            if result_key is not None:
+                self.result_cache.store(result_key, uploader_tempdir_name, [
+                    file_name for file_name in walk_file_names(uploader_tempdir_name)
+                    if file_name not in before_file_names
+                ])
+
+        self.event_journal.save(proxevent.event_key, JournalEntry(EXECUTED_STAGE, result_key))
+
+        if cancel_token.cancelled:
+            raise CancelledProxEventHandlerError(event, cancel_token.reason)
+
+        if self.log_compress:
+            compress_logs(uploader_tempdir_name)
+
+        with self.stage_timer.stage('upload'), redirect_stdout_stderr(
+                uploader_tempdir_name, 'upload-', max_size=self.log_max_size):
+            # pylint: disable=protected-access
+            (_bundle, _job_id, _state) = self.uploader_runner.upload(
+                uploader_tempdir_name, transaction=Transaction(
+                    submitter=proxevent.transaction_inst.submitter,
+                    instrument=proxevent.transaction_inst.instrument,
+                    project=proxevent.transaction_inst.project
+                ), transaction_key_values=[
+                    TransactionKeyValue(key='Transactions._id', value=proxevent.transaction_inst._id)
+                ] + _to_proxymod_usage_transaction_key_values(model_usage_by_node)
+            )
+            # pylint: enable=protected-access
+
+        self.event_journal.save(proxevent.event_key, JournalEntry(UPLOADED_STAGE, result_key))
+
+        if event_checkpoints_by_variant is not None:
+            for event_checkpoints in event_checkpoints_by_variant.values():
+                event_checkpoints.remove()
+    # pylint: enable=too-many-arguments
+
+    def cancel(self, reason: str) -> int:
+        """Cancel the events running their models, returning how many are cancelled."""
+        with self._lock:
+            cancel_tokens = [cancel_token for cancel_token in self._cancel_tokens if not cancel_token.cancelled]
+        for cancel_token in cancel_tokens:
+            cancel_token.cancel(reason)
+        if cancel_tokens:
+            self.model_runner.cancel()
+        return len(cancel_tokens)
+
+    def handle(self, event: Event) -> None:
+        """Handle the proxymod event, unless it is uploaded already."""
+        with self.stage_timer.event():
+            proxevent = self._validate(event)
+
+            journal_entry = self.event_journal.load(proxevent.event_key)
+            if journal_entry.stage == UPLOADED_STAGE:
+                return
+
+            footprint = self._estimate(proxevent)
+            reservation = self._admit(event, footprint)
+            try:
+                start = time.monotonic()
+                with tempfile.TemporaryDirectory() as downloader_tempdir_name:
+                    with self.scratch.directory(size=footprint.output_bytes) as uploader_tempdir_name:
+                        with self.stage_timer.stage('download'), \
+                                redirect_stdout_stderr(uploader_tempdir_name, 'download-', max_size=self.log_max_size):
+                            (model_file_openers, input_file_openers) = self._download(
+                                downloader_tempdir_name, proxevent.model_file_insts, proxevent.input_file_insts)
+
+                        self._process(event, proxevent, model_file_openers, input_file_openers,
+                                      uploader_tempdir_name, journal_entry, start)
+            finally:
+                self.admission_controller.release(reservation)
+
+    def _download_many(self, downloader_tempdir_name: str,
+                       file_insts_by_event: typing.List[typing.List[File]]) -> typing.Dict[typing.Tuple,
+                                                                                           typing.Callable]:
+        """Download the distinct files of the events once, returning the openers by file key."""
+        slots = _to_proxymod_download_slots(file_insts_by_event)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(slots)) as executor:
+            openers_futures = [
+                executor.submit(bind_log_context(self._download_files),
+                                os.path.join(downloader_tempdir_name, str(slot_index)), slot_file_insts)
+                for slot_index, slot_file_insts in enumerate(slots)
+            ]
+        opener_by_file_key = {}
+        for slot_file_insts, openers_future in zip(slots, openers_futures):
+            for file_inst, opener in zip(slot_file_insts, openers_future.result()):
+                opener_by_file_key[_to_proxymod_file_key(file_inst)] = opener
+        return opener_by_file_key
+
+    def _handle_or_reason(self, event: Event) -> typing.Optional[BaseException]:
+        """Handle the proxymod event, returning its exception instead of raising it."""
+        try:
+            self.handle(event)
+        except (Exception, ProxEventHandlerError) as reason:  # pylint: disable=broad-except
+            return reason
+        return None
+
+    # pylint: disable=too-many-locals
+    def handle_many(self, events: typing.List[Event]) -> typing.List[typing.Optional[BaseException]]:
+        """
+        Handle the proxymod events, returning the exception of every event or ``None``.
+
+        The events are validated and admitted one by one and the distinct
+        model and input files of the admitted events, not uploaded
+        already, are downloaded once. Then the
+        models of every event run, with the log of the shared download,
+        and the results of every event are uploaded on their own. If
+        the files can not be downloaded together, the events are handled
+        one by one instead, so that every event gets its own download
+        error. The time budget of every event counts the shared download,
+        not the model runs of the events before it.
+        """
+        reasons = [None] * len(events)  # type: typing.List[typing.Optional[BaseException]]
+        proxevent_by_index = collections.OrderedDict()
+        journal_entry_by_index = {}
+
+        for index, event in enumerate(events):
+            try:
+                proxevent = self._validate(event)
+            except (Exception, ProxEventHandlerError) as reason:  # pylint: disable=broad-except
+                reasons[index] = reason
+                self.stage_timer.observe_event(reason)
+                continue
+            journal_entry_by_index[index] = self.event_journal.load(proxevent.event_key)
+            if journal_entry_by_index[index].stage == UPLOADED_STAGE:
+                self.stage_timer.observe_event(None)
+            else:
+                proxevent_by_index[index] = proxevent
+
+        footprint_by_index = {index: self._estimate(proxevent) for index, proxevent in proxevent_by_index.items()}
+        reservation_by_index = {}
+        for index in list(proxevent_by_index.keys()):
+            try:
+                reservation_by_index[index] = self._admit(events[index], footprint_by_index[index])
+            except AdmissionDeferredProxEventHandlerError as reason:
+                reasons[index] = reason
+                self.stage_timer.observe_event(reason)
+                del proxevent_by_index[index]
+
+        if not proxevent_by_index:
+            return reasons
+
+        with tempfile.TemporaryDirectory() as downloader_tempdir_name:
+            download_start = time.monotonic()
+            try:
+                with self.stage_timer.stage('download'), \
+                        redirect_stdout_stderr(downloader_tempdir_name, 'download-', max_size=self.log_max_size):
+                    opener_by_file_key = self._download_many(downloader_tempdir_name, [
+                        proxevent.model_file_insts + proxevent.input_file_insts
+                        for proxevent in proxevent_by_index.values()
+                    ])
+            except (Exception, ProxEventHandlerError):  # pylint: disable=broad-except
+                self.stage_timer.flush()
+                for index in proxevent_by_index:
+                    self.admission_controller.release(reservation_by_index.pop(index))
+                    reasons[index] = self._handle_or_reason(events[index])
+                return reasons
+            self.stage_timer.flush()
+            download_seconds = time.monotonic() - download_start
+
+            for index, proxevent in proxevent_by_index.items():
+                try:
+                    with self.stage_timer.event(), self.scratch.directory(
+                            size=footprint_by_index[index].output_bytes) as uploader_tempdir_name:
+                        for log_name in ['download-stdout.log', 'download-stderr.log']:
+                            shutil.copyfile(os.path.join(downloader_tempdir_name, log_name),
+                                            os.path.join(uploader_tempdir_name, log_name))
+                        self._process(
+                            events[index], proxevent,
+                            [opener_by_file_key[_to_proxymod_file_key(inst)] for inst in proxevent.model_file_insts],
+                            [opener_by_file_key[_to_proxymod_file_key(inst)] for inst in proxevent.input_file_insts],
+                            uploader_tempdir_name, journal_entry_by_index[index],
+                            # NOTE Every event is charged for the shared download, not for the events before it.
+                            time.monotonic() - download_seconds)
+                except (Exception, ProxEventHandlerError) as reason:  # pylint: disable=broad-except
+                    reasons[index] = reason
+                finally:
+                    self.admission_controller.release(reservation_by_index.pop(index))
+
+        return reasons
     # pylint: enable=too-many-locals
-    # pylint: enable=too-many-branches
-    # pylint: enable=too-many-statements
 # pylint: enable=too-few-public-methods
 
 
@@ -67,5 +67,87 @@ class InvalidModelProxEventHandlerError(ProxEventHandlerError):
         )
 
 
+class InvalidKeyValueProxEventHandlerError(ProxEventHandlerError):
+    """Invalid proxymod transaction key value exception."""
+
+    def __init__(self, event: Event, key: str, value: typing.Any, reason: Exception) -> None:
+        """Save the event, the key and value of the transaction key value and a reason exception."""
+        super(InvalidKeyValueProxEventHandlerError, self).__init__(event)
+        self.key = key
+        self.value = value
+        self.reason = reason
+
+    def __str__(self) -> str:
+        """Have a nice output, printing the key, the value and the exception."""
+        return 'proxymod transaction key value \'{0}\' = \'{1}\' is invalid: {2}'.format(
+            self.key.replace('\'', '\\\''), str(self.value).replace('\'', '\\\''), str(self.reason)
+        )
+
+
+class AdmissionDeferredProxEventHandlerError(ProxEventHandlerError):
+    """Event deferred by the admission control exception."""
+
+    def __init__(self, event: Event, resource: str, required_size: int, free_size: int) -> None:
+        """Save the event, the resource without enough headroom and the bytes required and free."""
+        super(AdmissionDeferredProxEventHandlerError, self).__init__(event)
+        self.resource = resource
+        self.required_size = required_size
+        self.free_size = free_size
+
+    def __str__(self) -> str:
+        """Have a nice output, printing the resource and the bytes required and free."""
+        return 'proxymod event needs {0} bytes of {1}, {2} bytes are free'.format(
+            self.required_size, self.resource, self.free_size
+        )
+
+
+class CancelledProxEventHandlerError(ProxEventHandlerError):
+    """Event cancelled before its models finished exception."""
+
+    def __init__(self, event: Event, reason: str) -> None:
+        """Save the event and the reason it is cancelled."""
+        super(CancelledProxEventHandlerError, self).__init__(event)
+        self.reason = reason
+
+    def __str__(self) -> str:
+        """Have a nice output, printing the reason."""
+        return 'proxymod event cancelled: {0}'.format(self.reason)
+
+
+class TimeoutProxEventHandlerError(CancelledProxEventHandlerError):
+    """Model out of time exception."""
+
+    def __init__(self, event: Event, file: typing.Optional[File], timeout: float) -> None:
+        """Save the event, the file containing the model, if any, and the time budget in seconds."""
+        super(TimeoutProxEventHandlerError, self).__init__(
+            event, 'out of time after {0} seconds'.format(timeout))
+        self.file = file
+        self.timeout = timeout
+
+    def __str__(self) -> str:
+        """Have a nice output, printing the file path, if any, and the time budget."""
+        if self.file is None:
+            return 'proxymod event did not finish within {0} seconds'.format(self.timeout)
+        return 'proxymod model for file \'{0}\' did not finish within {1} seconds'.format(
+            self.file.path.replace('\'', '\\\''), self.timeout
+        )
+
+
+class DeferredEventError(Exception):
+    """Event deferred to be handled again later exception."""
+
+    def __init__(self, reason: AdmissionDeferredProxEventHandlerError) -> None:
+        """Save the reason the event is deferred."""
+        super(DeferredEventError, self).__init__()
+        self.reason = reason
+
+    def __str__(self) -> str:
+        """Have a nice output, printing the reason."""
+        return 'proxymod event deferred: {0}'.format(str(self.reason))
+
+
 __all__ = ('ProxEventHandlerError', 'ConfigNotFoundProxEventHandlerError',
-           'InvalidConfigProxEventHandlerError', 'InvalidModelProxEventHandlerError', )
+           'InvalidConfigProxEventHandlerError', 'InvalidModelProxEventHandlerError',
+           'InvalidKeyValueProxEventHandlerError',
+           'AdmissionDeferredProxEventHandlerError', 'CancelledProxEventHandlerError',
+           'TimeoutProxEventHandlerError', 'DeferredEventError', )
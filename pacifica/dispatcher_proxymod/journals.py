@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# pacifica-dispatcher-proxymod: pacifica/dispatcher_proxymod/journals.py
+#
+# Copyright (c) 2019, Battelle Memorial Institute
+# All rights reserved.
+#
+# See LICENSE and WARRANTY for details.
+"""
+Journal module.
+
+This module contains the event journals of the proxymod event handler,
+which record the last finished stage of every event (``executed`` or
+``uploaded``), so that an event delivered again is not uploaded twice
+and has the results of its models restored from the result cache, if
+any, instead of running them again.
+"""
+import datetime
+import logging
+import typing
+
+import peewee
+
+from .databases import connected_db_context
+
+LOGGER = logging.getLogger(__name__)
+
+EXECUTED_STAGE = 'executed'
+
+UPLOADED_STAGE = 'uploaded'
+
+
+class JournalEntry(typing.NamedTuple):
+    """Last finished stage of an event and the key of its results in the result cache, if any."""
+
+    stage: typing.Optional[str] = None
+    result_key: typing.Optional[str] = None
+
+
+class EventJournal:
+    """
+    Event journal class.
+
+    Nothing is recorded, every event is handled as if it is delivered
+    for the first time; subclasses override ``load`` and ``save`` to
+    keep the entries.
+    """
+
+    def load(self, event_key: str) -> JournalEntry:
+        """Return the empty entry, no stage of the event is finished."""
+        return JournalEntry()
+
+    def save(self, event_key: str, entry: JournalEntry) -> None:
+        """Do nothing with the entry of the event."""
+
+
+def create_event_journal_model(passed_db: peewee.Database) -> object:
+    """Factory creating an event journal class."""
+    class EventJournalModel(peewee.Model):
+        """
+        Event journal model class.
+
+        Every row is the entry of an event, keyed by the event
+        identifier or the transaction identifier of the event.
+        """
+
+        event_key = peewee.CharField(unique=True)
+        stage = peewee.CharField()
+        result_key = peewee.CharField(null=True)
+        updated = peewee.DateTimeField(default=datetime.datetime.now)
+
+        # pylint: disable=too-few-public-methods
+        class Meta:
+            """Meta class connecting the database."""
+
+            database = passed_db
+        # pylint: enable=too-few-public-methods
+
+        @classmethod
+        def load(cls, event_key: str) -> JournalEntry:
+            """Return the entry of the event, empty if there is none."""
+            with connected_db_context(passed_db):
+                inst = cls.get_or_none(cls.event_key == event_key)
+            if inst is None:
+                return JournalEntry()
+            return JournalEntry(inst.stage, inst.result_key)
+
+        @classmethod
+        def save_entry(cls, event_key: str, entry: JournalEntry) -> None:
+            """Create or replace the entry of the event."""
+            with connected_db_context(passed_db):
+                for attempt in range(2):
+                    try:
+                        with passed_db.atomic():
+                            updated = cls.update(
+                                stage=entry.stage, result_key=entry.result_key, updated=datetime.datetime.now()
+                            ).where(cls.event_key == event_key).execute()
+                            if not updated:
+                                cls.create(event_key=event_key, stage=entry.stage, result_key=entry.result_key)
+                    except peewee.IntegrityError:  # pragma: no cover another process created the entry
+                        if attempt:
+                            raise
+                        continue
+                    break
+
+    return EventJournalModel
+
+
+class ModelEventJournal(EventJournal):
+    """
+    Model event journal class.
+
+    The entries are kept in the event journal model, in the database
+    shared by the Celery workers. An entry that can not be loaded or
+    saved is logged and the event is handled as if it is delivered for
+    the first time.
+    """
+
+    def __init__(self, event_journal_model: typing.Any) -> None:
+        """Save the event journal model."""
+        super(ModelEventJournal, self).__init__()
+
+        self.event_journal_model = event_journal_model
+
+    def load(self, event_key: str) -> JournalEntry:
+        """Return the entry of the event from the event journal model."""
+        try:
+            return self.event_journal_model.load(event_key)
+        except peewee.PeeweeException:
+            # NOTE Losing the journal of an event must not fail the event.
+            LOGGER.exception('failed to load the journal of the event')
+            return JournalEntry()
+
+    def save(self, event_key: str, entry: JournalEntry) -> None:
+        """Save the entry of the event to the event journal model."""
+        try:
+            self.event_journal_model.save_entry(event_key, entry)
+        except peewee.PeeweeException:
+            LOGGER.exception('failed to save the journal of the event')
+
+
+__all__ = (
+    'EXECUTED_STAGE', 'UPLOADED_STAGE', 'JournalEntry', 'EventJournal',
+    'create_event_journal_model', 'ModelEventJournal',
+)
@@ -0,0 +1,38 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# pacifica-dispatcher-proxymod: pacifica/dispatcher_proxymod/locks.py
+#
+# Copyright (c) 2019, Battelle Memorial Institute
+# All rights reserved.
+#
+# See LICENSE and WARRANTY for details.
+"""Lock module for directories shared by several worker processes."""
+import contextlib
+import typing
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover no fcntl on windows
+    fcntl = None
+
+
+@contextlib.contextmanager
+def locked(lock_file_name: str) -> typing.Generator[None, None, None]:
+    """
+    Hold an exclusive lock on the lock file for the duration of the context.
+
+    The lock is shared between processes and between threads. Where
+    ``fcntl`` is not available the context does not lock anything.
+    """
+    with open(lock_file_name, 'a') as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+__all__ = ('locked', )
@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# pacifica-dispatcher-proxymod: pacifica/dispatcher_proxymod/logs.py
+#
+# Copyright (c) 2019, Battelle Memorial Institute
+# All rights reserved.
+#
+# See LICENSE and WARRANTY for details.
+"""
+Log capture module for the output of the downloads, models and uploads.
+
+The standard output and error of the Python code of a thread are
+captured through proxies of ``sys.stdout`` and ``sys.stderr``, that
+write to the log files of the current context, so threads handling
+different events do not mix up their logs. Processes running one model
+at a time capture the output at the file descriptor level instead, to
+keep the output of C extensions and subprocesses as well. Every log
+file keeps at most ``max_size`` bytes, the head and the tail of the
+output, and the log files are optionally compressed before the upload.
+"""
+import contextlib
+import contextvars
+import functools
+import gzip
+import os
+import shutil
+import sys
+import threading
+import typing
+
+LOG_TRUNCATED_FORMAT_ = '\n[... {0} bytes truncated ...]\n'
+
+LOG_FILE_SUFFIX_ = '.log'
+
+FD_DRAIN_TIMEOUT_ = 5.0
+
+_CAPTURE_BY_STREAM_NAME_ = {
+    'stdout': contextvars.ContextVar('proxymod_stdout_capture', default=None),
+    'stderr': contextvars.ContextVar('proxymod_stderr_capture', default=None),
+}
+
+_INSTALL_LOCK_ = threading.Lock()
+
+
+class CappedLogWriter:
+    """
+    Capped log writer class.
+
+    The first half of ``max_size`` bytes is written to the log file
+    right away and the last half is kept in a ring buffer, written
+    after a line counting the bytes left out when the writer is closed.
+    A ``max_size`` of zero keeps all of the output. Writes from many
+    threads are serialized.
+    """
+
+    def __init__(self, file_name: str, mode: str = 'w', max_size: int = 0) -> None:
+        """Open the log file and create the empty ring buffer."""
+        super(CappedLogWriter, self).__init__()
+
+        self.max_size = max_size
+        self._file = open(file_name, '{0}b'.format(mode[0]))
+        self._head_size = max_size - max_size // 2
+        self._tail_size = max_size // 2
+        self._head_written = 0
+        self._tail = bytearray()
+        self._truncated = 0
+        self._lock = threading.Lock()
+
+    def write(self, text: str) -> int:
+        """Write the text, encoded in UTF-8."""
+        self.write_bytes(text.encode('utf-8', 'replace'))
+        return len(text)
+
+    def write_bytes(self, data: bytes) -> None:
+        """Write the bytes to the head of the log file, then to the ring buffer."""
+        with self._lock:
+            if self._file.closed:
+                return
+            if not self.max_size:
+                self._file.write(data)
+                return
+            head_data = data[:self._head_size - self._head_written]
+            self._file.write(head_data)
+            self._head_written += len(head_data)
+            self._tail += data[len(head_data):]
+            if len(self._tail) > self._tail_size:
+                self._truncated += len(self._tail) - self._tail_size
+                del self._tail[:len(self._tail) - self._tail_size]
+
+    def flush(self) -> None:
+        """Flush the log file."""
+        with self._lock:
+            if not self._file.closed:
+                self._file.flush()
+
+    def close(self) -> None:
+        """Write the ring buffer and close the log file."""
+        with self._lock:
+            if self._file.closed:
+                return
+            if self._truncated:
+                self._file.write(LOG_TRUNCATED_FORMAT_.format(self._truncated).encode('utf-8'))
+            self._file.write(bytes(self._tail))
+            self._file.close()
+
+
+class _CapturingStream:
+    """Proxy of a standard stream writing to the log writer of the current context, if any."""
+
+    def __init__(self, stream: typing.TextIO, capture: contextvars.ContextVar) -> None:
+        """Save the standard stream and the context variable of the log writer."""
+        super(_CapturingStream, self).__init__()
+
+        self._stream = stream
+        self._capture = capture
+
+    def write(self, text: str) -> int:
+        """Write the text to the log writer of the current context, else to the standard stream."""
+        writer = self._capture.get()
+        if writer is None:
+            return self._stream.write(text)
+        return writer.write(text)
+
+    def flush(self) -> None:
+        """Flush the log writer of the current context, else the standard stream."""
+        writer = self._capture.get()
+        if writer is None:
+            self._stream.flush()
+        else:
+            writer.flush()
+
+    def __getattr__(self, name: str) -> typing.Any:
+        """Return the attribute of the standard stream."""
+        return getattr(self._stream, name)
+
+
+class _FdWriter:
+    """Writer of the standard stream of the process, to keep the Python output in order with the other output."""
+
+    def __init__(self, fd: int) -> None:
+        """Save the file descriptor."""
+        super(_FdWriter, self).__init__()
+
+        self.fd = fd
+
+    def write(self, text: str) -> int:
+        """Write the text, encoded in UTF-8, to the file descriptor."""
+        data = memoryview(text.encode('utf-8', 'replace'))
+        while data:
+            data = data[os.write(self.fd, data):]
+        return len(text)
+
+    def flush(self) -> None:
+        """Do nothing, the writes are not buffered."""
+
+
+def _install_capturing_streams() -> None:
+    """Replace ``sys.stdout`` and ``sys.stderr`` by capturing proxies, unless they are already."""
+    with _INSTALL_LOCK_:
+        for stream_name, capture in _CAPTURE_BY_STREAM_NAME_.items():
+            if not isinstance(getattr(sys, stream_name), _CapturingStream):
+                setattr(sys, stream_name, _CapturingStream(getattr(sys, stream_name), capture))
+
+
+def _drain_fd(read_fd: int, writer: CappedLogWriter) -> None:
+    """Copy the output of the pipe to the log writer until the pipe is closed."""
+    with os.fdopen(read_fd, 'rb', buffering=0) as read_file:
+        for data in iter(functools.partial(read_file.read, 65536), b''):
+            writer.write_bytes(data)
+
+
+@contextlib.contextmanager
+def _capture_fd(fd: int, writer: CappedLogWriter) -> typing.Generator[None, None, None]:
+    """Point the file descriptor to a pipe drained to the log writer, then restore it."""
+    saved_fd = os.dup(fd)
+    (read_fd, write_fd) = os.pipe()
+    drain_thread = threading.Thread(target=_drain_fd, args=(read_fd, writer), daemon=True)
+    drain_thread.start()
+    os.dup2(write_fd, fd)
+    os.close(write_fd)
+    try:
+        yield
+    finally:
+        os.dup2(saved_fd, fd)
+        os.close(saved_fd)
+        # NOTE A subprocess left running keeps the pipe open, its output after the timeout is lost.
+        drain_thread.join(FD_DRAIN_TIMEOUT_)
+
+
+@contextlib.contextmanager
+def redirect_stdout_stderr(tempdir_name: str, prefix: str = '', mode: str = 'w', max_size: int = 0,
+                           fd_level: bool = False) -> typing.Generator[typing.Tuple[CappedLogWriter,
+                                                                                    CappedLogWriter], None, None]:
+    """
+    Redirect standard output and error to log files in the directory.
+
+    Only the output of the current context is redirected, unless
+    ``fd_level`` is set; then the standard file descriptors of the
+    process are redirected as well, which is only safe in a process
+    running one model at a time.
+    """
+    writers = []
+    try:
+        for stream_name in ['stdout', 'stderr']:
+            writers.append(CappedLogWriter(
+                os.path.join(tempdir_name, '{0}{1}{2}'.format(prefix, stream_name, LOG_FILE_SUFFIX_)), mode, max_size))
+        _install_capturing_streams()
+        with contextlib.ExitStack() as stack:
+            if fd_level:
+                sys.stdout.flush()
+                sys.stderr.flush()
+                stack.enter_context(_capture_fd(1, writers[0]))
+                stack.enter_context(_capture_fd(2, writers[1]))
+                capture_writers = [_FdWriter(1), _FdWriter(2)]
+            else:
+                capture_writers = writers
+            tokens = [
+                _CAPTURE_BY_STREAM_NAME_[stream_name].set(capture_writer)
+                for stream_name, capture_writer in zip(['stdout', 'stderr'], capture_writers)
+            ]
+            try:
+                yield tuple(writers)
+            finally:
+                for stream_name, token in zip(['stdout', 'stderr'], tokens):
+                    _CAPTURE_BY_STREAM_NAME_[stream_name].reset(token)
+    finally:
+        for writer in writers:
+            writer.close()
+
+
+def bind_log_context(func: typing.Callable) -> typing.Callable:
+    """Return the function running in a copy of the current context, to capture its output in another thread."""
+    return functools.partial(contextvars.copy_context().run, func)
+
+
+def compress_logs(dir_name: str) -> typing.List[str]:
+    """
+    Compress the log files in the directory and its subdirectories with gzip.
+
+    The paths of the compressed files are returned relative to the
+    directory, e.g. the logs of the variants of a parameter sweep.
+    """
+    file_names = []
+    for walk_root, walk_dirs, walk_names in os.walk(dir_name):
+        walk_dirs.sort()
+        for walk_name in sorted(walk_names):
+            path = os.path.join(walk_root, walk_name)
+            if not walk_name.endswith(LOG_FILE_SUFFIX_) or not os.path.isfile(path):
+                continue
+            with open(path, 'rb') as log_file, gzip.open('{0}.gz'.format(path), 'wb') as gzip_file:
+                shutil.copyfileobj(log_file, gzip_file)
+            os.unlink(path)
+            file_names.append(os.path.relpath('{0}.gz'.format(path), dir_name))
+    return file_names
+
+
+__all__ = ('CappedLogWriter', 'redirect_stdout_stderr', 'bind_log_context', 'compress_logs', )
@@ -0,0 +1,268 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# pacifica-dispatcher-proxymod: pacifica/dispatcher_proxymod/metrics.py
+#
+# Copyright (c) 2019, Battelle Memorial Institute
+# All rights reserved.
+#
+# See LICENSE and WARRANTY for details.
+"""
+Metrics module.
+
+Contains a factory returning a metric class that keeps the stage
+timings and event outcomes of the proxymod event handler in the
+database shared by the Celery workers and the CherryPy application,
+and serves them in the Prometheus text format.
+"""
+import collections
+import logging
+import math
+import threading
+import typing
+
+import cherrypy
+import peewee
+
+from .databases import connected_db_context
+from .exceptions import AdmissionDeferredProxEventHandlerError
+from .timers import StageTimer
+from .usage import ModelUsage
+
+LOGGER = logging.getLogger(__name__)
+
+STAGE_DURATION_METRIC_NAME = 'proxymod_stage_duration_seconds'
+
+EVENTS_METRIC_NAME = 'proxymod_events_total'
+
+MODEL_RUNS_METRIC_NAME = 'proxymod_model_runs_total'
+
+ADMISSIONS_METRIC_NAME = 'proxymod_admissions_total'
+
+CACHE_LOOKUPS_METRIC_NAME = 'proxymod_cache_lookups_total'
+
+MODEL_USAGE_METRIC_NAME_BY_FIELD_NAME_ = collections.OrderedDict([
+    ('wall_seconds', 'proxymod_model_wall_seconds_total'),
+    ('cpu_seconds', 'proxymod_model_cpu_seconds_total'),
+    ('peak_rss_bytes', 'proxymod_model_peak_rss_bytes_total'),
+    ('written_bytes', 'proxymod_model_written_bytes_total'),
+])
+
+METRIC_TYPES_ = collections.OrderedDict([
+    (STAGE_DURATION_METRIC_NAME, ('histogram', 'Duration of the stages of handling proxymod events.')),
+    (EVENTS_METRIC_NAME, ('counter', 'Handled proxymod events by outcome and exception class.')),
+    (ADMISSIONS_METRIC_NAME, ('counter', 'Admission decisions of proxymod events by resource deferring them.')),
+    (CACHE_LOOKUPS_METRIC_NAME, ('counter', 'Lookups in the proxymod caches by cache and result.')),
+    (MODEL_RUNS_METRIC_NAME, ('counter', 'Finished proxymod model runs by model.')),
+    ('proxymod_model_wall_seconds_total', ('counter', 'Wall time of the proxymod model runs by model.')),
+    ('proxymod_model_cpu_seconds_total', ('counter', 'CPU time of the proxymod model runs by model.')),
+    ('proxymod_model_peak_rss_bytes_total', (
+        'counter', 'Sum of the peak resident set sizes of the proxymod model runs by model.')),
+    ('proxymod_model_written_bytes_total', (
+        'counter', 'Bytes of the files written by the proxymod model runs by model.')),
+])
+
+STAGE_DURATION_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0, 3600.0, math.inf,
+)
+
+
+def _format_le(bucket: float) -> str:
+    """Return the Prometheus ``le`` label value of the histogram bucket."""
+    return '+Inf' if math.isinf(bucket) else repr(bucket)
+
+
+def _format_labels(labels: str, le: str = '') -> str:
+    """Return the labels of a sample, adding the ``le`` label if there is one."""
+    if le:
+        labels = '{0},le="{1}"'.format(labels, le) if labels else 'le="{0}"'.format(le)
+    return '{{{0}}}'.format(labels) if labels else ''
+
+
+def _format_value(value: float) -> str:
+    """Return the value of a sample, without a fraction for whole numbers."""
+    return str(int(value)) if value.is_integer() else repr(value)
+
+
+def create_metric_model(passed_db: peewee.Database) -> object:
+    """Factory creating a metric class."""
+    class MetricModel(peewee.Model):
+        """
+        Metric model class.
+
+        Every row is a sample of a metric, the sum of the increments
+        from all processes. Histogram buckets are kept as they are
+        counted and only made cumulative when the samples are served.
+        """
+
+        name = peewee.CharField()
+        labels = peewee.CharField(default='')
+        le = peewee.CharField(default='')
+        value = peewee.DoubleField(default=0)
+
+        # pylint: disable=too-few-public-methods
+        class Meta:
+            """Meta class connecting the database."""
+
+            database = passed_db
+            indexes = (
+                (('name', 'labels', 'le'), True),
+            )
+        # pylint: enable=too-few-public-methods
+
+        @classmethod
+        def increment(cls, increments: typing.Dict[typing.Tuple[str, str, str], float]) -> None:
+            """Add the increments to the samples, keyed by name, labels and ``le`` label, in one transaction."""
+            with connected_db_context(passed_db):
+                for attempt in range(2):
+                    try:
+                        with passed_db.atomic():
+                            for (name, labels, le), value in sorted(increments.items()):
+                                updated = cls.update(value=cls.value + value).where(
+                                    (cls.name == name) & (cls.labels == labels) & (cls.le == le)).execute()
+                                if not updated:
+                                    cls.create(name=name, labels=labels, le=le, value=value)
+                    except peewee.IntegrityError:  # pragma: no cover another process created the sample
+                        if attempt:
+                            raise
+                        continue
+                    break
+
+        @classmethod
+        def render(cls) -> str:
+            """Return the samples in the Prometheus text format."""
+            with connected_db_context(passed_db):
+                samples = list(cls.select().order_by(cls.name, cls.labels))
+            lines = []
+            for metric_name, (metric_type, metric_help) in METRIC_TYPES_.items():
+                lines.append('# HELP {0} {1}'.format(metric_name, metric_help))
+                lines.append('# TYPE {0} {1}'.format(metric_name, metric_type))
+                if metric_type == 'histogram':
+                    lines.extend(cls._render_histogram(metric_name, samples))
+                else:
+                    lines.extend(
+                        '{0}{1} {2}'.format(sample.name, _format_labels(sample.labels), _format_value(sample.value))
+                        for sample in samples if sample.name == metric_name
+                    )
+            lines.append('')
+            return '\n'.join(lines)
+
+        @staticmethod
+        def _render_histogram(metric_name: str, samples: typing.List['MetricModel']) -> typing.List[str]:
+            """Return the lines of the histogram with cumulative buckets."""
+            buckets_by_labels = collections.defaultdict(dict)
+            lines_by_labels = collections.defaultdict(list)
+            for sample in samples:
+                if sample.name == '{0}_bucket'.format(metric_name):
+                    buckets_by_labels[sample.labels][sample.le] = sample.value
+                elif sample.name in ['{0}_sum'.format(metric_name), '{0}_count'.format(metric_name)]:
+                    lines_by_labels[sample.labels].append('{0}{1} {2}'.format(
+                        sample.name, _format_labels(sample.labels), _format_value(sample.value)))
+            lines = []
+            for labels in sorted(lines_by_labels.keys()):
+                cumulative_value = 0.0
+                for bucket in STAGE_DURATION_BUCKETS:
+                    cumulative_value += buckets_by_labels[labels].get(_format_le(bucket), 0.0)
+                    lines.append('{0}_bucket{1} {2}'.format(
+                        metric_name, _format_labels(labels, _format_le(bucket)), _format_value(cumulative_value)))
+                lines.extend(sorted(lines_by_labels[labels], reverse=True))
+            return lines
+
+        @classmethod
+        def create_cherrypy_app(cls) -> object:
+            """Create the CherryPy object serving the metrics."""
+            # pylint: disable=too-few-public-methods
+            class Metrics:
+                """Metrics of the proxymod event handler."""
+
+                exposed = True
+
+                # pylint: disable=invalid-name
+                @staticmethod
+                def GET() -> bytes:
+                    """Get REST method entrypoint."""
+                    cherrypy.response.headers['Content-Type'] = 'text/plain; version=0.0.4; charset=utf-8'
+                    return bytes(cls.render(), 'utf-8')
+                # pylint: enable=invalid-name
+            # pylint: enable=too-few-public-methods
+
+            return Metrics()
+
+    return MetricModel
+
+
+class MetricStageTimer(StageTimer):
+    """
+    Metric stage timer class.
+
+    The stage durations, model usages and cache lookups of an event are
+    kept per thread and added to the metric model together with the outcome of
+    the event, in one transaction per event. The metrics of an event
+    are dropped if they can not be saved.
+    """
+
+    def __init__(self, metric_model: typing.Any) -> None:
+        """Save the metric model."""
+        super(MetricStageTimer, self).__init__()
+
+        self.metric_model = metric_model
+        self._local = threading.local()
+
+    def _increments(self) -> typing.Dict[typing.Tuple[str, str, str], float]:
+        """Return the increments of the current thread."""
+        if not hasattr(self._local, 'increments'):
+            self._local.increments = collections.defaultdict(float)
+        return self._local.increments
+
+    def observe(self, stage_name: str, seconds: float) -> None:
+        """Add the duration of the stage to the histogram."""
+        labels = 'stage="{0}"'.format(stage_name)
+        bucket = next(bucket for bucket in STAGE_DURATION_BUCKETS if seconds <= bucket)
+        increments = self._increments()
+        increments[('{0}_bucket'.format(STAGE_DURATION_METRIC_NAME), labels, _format_le(bucket))] += 1
+        increments[('{0}_sum'.format(STAGE_DURATION_METRIC_NAME), labels, '')] += seconds
+        increments[('{0}_count'.format(STAGE_DURATION_METRIC_NAME), labels, '')] += 1
+
+    def observe_event(self, reason: typing.Optional[BaseException]) -> None:
+        """Count the outcome of the event and add the increments of the event to the metric model."""
+        outcome = 'failure' if reason is not None else 'success'
+        if isinstance(reason, AdmissionDeferredProxEventHandlerError):
+            outcome = 'deferred'
+        labels = 'outcome="{0}",exception="{1}"'.format(outcome, type(reason).__name__ if reason is not None else '')
+        self._increments()[(EVENTS_METRIC_NAME, labels, '')] += 1
+        self.flush()
+
+    def observe_usage(self, model_name: str, usage: ModelUsage) -> None:
+        """Add the usage of the model run to the counters of the model."""
+        labels = 'model="{0}"'.format(model_name)
+        increments = self._increments()
+        increments[(MODEL_RUNS_METRIC_NAME, labels, '')] += 1
+        for field_name, metric_name in MODEL_USAGE_METRIC_NAME_BY_FIELD_NAME_.items():
+            if getattr(usage, field_name) is not None:
+                increments[(metric_name, labels, '')] += getattr(usage, field_name)
+
+    def observe_admission(self, resource: typing.Optional[str]) -> None:
+        """Count the admission decision of the event."""
+        labels = 'decision="{0}",resource="{1}"'.format(
+            'deferred' if resource is not None else 'admitted', resource if resource is not None else '')
+        self._increments()[(ADMISSIONS_METRIC_NAME, labels, '')] += 1
+
+    def observe_cache(self, cache_name: str, hit: bool) -> None:
+        """Count the lookup in the cache."""
+        labels = 'cache="{0}",result="{1}"'.format(cache_name, 'hit' if hit else 'miss')
+        self._increments()[(CACHE_LOOKUPS_METRIC_NAME, labels, '')] += 1
+
+    def flush(self) -> None:
+        """Add the increments of the current thread to the metric model."""
+        increments = self._increments()
+        if not increments:
+            return
+        self._local.increments = collections.defaultdict(float)
+        try:
+            self.metric_model.increment(increments)
+        except peewee.PeeweeException:
+            # NOTE Losing the metrics of an event must not fail the event.
+            LOGGER.exception('failed to save the metrics')
+
+
+__all__ = ('create_metric_model', 'MetricStageTimer', )
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# pacifica-dispatcher-proxymod: pacifica/dispatcher_proxymod/model_cache.py
+#
+# Copyright (c) 2019, Battelle Memorial Institute
+# All rights reserved.
+#
+# See LICENSE and WARRANTY for details.
+"""
+Model cache module.
+
+This module contains a cache of loaded proxymod model functions so
+that model files that do not change between events are not parsed,
+compiled and executed again for every event.
+"""
+import collections
+import hashlib
+import importlib.util
+import threading
+import typing
+
+from .timers import StageTimer
+
+
+class ModelFuncCache:
+    """
+    Model function cache class.
+
+    Loaded model functions are keyed by the model name and the SHA-256
+    digest of the model file content, so a model file with new content
+    is always loaded again. The cache holds at most ``max_size`` model
+    functions (zero disables the cache) and evicts the least recently
+    used model function first.
+
+    Model functions are kept across events, so the module of a cached
+    model function keeps the ``__file__`` of the first download.
+
+    The hits and misses are counted on the instance and observed by the
+    stage timer, if any, as lookups in the ``model`` cache.
+    """
+
+    def __init__(self, max_size: int = 32, stage_timer: StageTimer = None) -> None:
+        """Save the cache size and the stage timer and create the empty cache."""
+        super(ModelFuncCache, self).__init__()
+
+        self.max_size = max_size
+        self.stage_timer = stage_timer if stage_timer is not None else StageTimer()
+        self.hits = 0
+        self.misses = 0
+        self._funcs = collections.OrderedDict()  # type: typing.Dict[typing.Tuple[str, str], typing.Callable]
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        """Return the number of cached model functions."""
+        return len(self._funcs)
+
+    def clear(self) -> None:
+        """Remove all cached model functions."""
+        with self._lock:
+            self._funcs.clear()
+
+    def load(self, name: str, file_name: str) -> typing.Callable:
+        """
+        Load the model function ``name`` from the model file.
+
+        The function is taken from the cache when the model file
+        content has been loaded before, otherwise the model file is
+        compiled and executed as the module ``name``.
+        """
+        with open(file_name, mode='rb') as file:
+            source = file.read()
+
+        key = (name, hashlib.sha256(source).hexdigest())
+
+        with self._lock:
+            func = self._funcs.get(key, None)
+            if func is not None:
+                self._funcs.move_to_end(key)
+                self.hits += 1
+                self.stage_timer.observe_cache('model', True)
+                return func
+            self.misses += 1
+            self.stage_timer.observe_cache('model', False)
+
+        spec = importlib.util.spec_from_file_location(name, file_name)
+        module = importlib.util.module_from_spec(spec)
+        # pylint: disable=exec-used
+        exec(compile(source, file_name, 'exec'), module.__dict__)
+        # pylint: enable=exec-used
+
+        # NOTE Deliberately raise `AttributeError` if `name` does not exist.
+        func = getattr(module, name)
+
+        if not callable(func):
+            # NOTE Deliberately raise `TypeError` by calling an uncallable.
+            func()
+
+        if self.max_size > 0:
+            with self._lock:
+                self._funcs[key] = func
+                self._funcs.move_to_end(key)
+                while len(self._funcs) > self.max_size:
+                    self._funcs.popitem(last=False)
+
+        return func
+
+
+__all__ = ('ModelFuncCache', )
@@ -0,0 +1,466 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# pacifica-dispatcher-proxymod: pacifica/dispatcher_proxymod/model_runners.py
+#
+# Copyright (c) 2019, Battelle Memorial Institute
+# All rights reserved.
+#
+# See LICENSE and WARRANTY for details.
+"""
+Model runner module.
+
+This module contains three model runners. The first loads and runs the
+proxymod model functions in the current process. The second loads and
+runs them in a pool of reusable worker processes, so that a model can
+not block or take down the process handling the event. The third runs
+every model in a new worker process, forked from a fork server process
+that imported the heavy modules of the models once.
+
+Every model runner stops a model run that is out of time, raising
+``ModelTimeoutError``, and the model runs cancelled by its ``cancel``
+method, raising ``ModelCancelledError``.
+"""
+import abc
+import atexit
+import contextlib
+import multiprocessing
+import multiprocessing.connection
+import multiprocessing.context
+import os
+import threading
+import typing
+
+try:
+    import resource
+except ImportError:  # pragma: no cover no resource on windows
+    resource = None
+
+from .cancellation import ModelCancelledError, ModelTimeoutError, interrupt_thread
+from .checkpoints import Checkpoint, checkpoint_context
+from .logs import redirect_stdout_stderr
+from .model_cache import ModelFuncCache
+from .usage import measure_process_usage, record_usage
+
+PRELOAD_MODULE_NAMES_ = ('proxymod', 'numpy', 'pandas', )
+
+
+@contextlib.contextmanager
+def _memory_limit(limit: int) -> typing.Generator[None, None, None]:
+    """Limit the address space of the current process to ``limit`` bytes."""
+    if (not limit) or (resource is None):
+        yield
+        return
+    (soft, hard) = resource.getrlimit(resource.RLIMIT_AS)
+    resource.setrlimit(resource.RLIMIT_AS, (limit if hard == resource.RLIM_INFINITY else min(limit, hard), hard))
+    try:
+        yield
+    finally:
+        resource.setrlimit(resource.RLIMIT_AS, (soft, hard))
+
+
+# pylint: disable=too-many-arguments
+def _run_model(model_func_cache: ModelFuncCache, name: str, file_name: str, args: typing.List[str],
+               log_dir_name: str, log_max_size: int = 0, checkpoint: Checkpoint = None) -> typing.Any:
+    """Load the model function then call it with the arguments, capturing the output of the process."""
+    func = model_func_cache.load(name, file_name)
+    if args is None:
+        return None
+    with redirect_stdout_stderr(log_dir_name, mode='a', max_size=log_max_size, fd_level=True), \
+            checkpoint_context(checkpoint):
+        return func(*args)
+# pylint: enable=too-many-arguments
+
+
+def _worker_main(conn: multiprocessing.connection.Connection, model_cache_max_size: int) -> None:  # pragma: no cover
+    """Worker process loop receiving model jobs and sending back their results."""
+    model_func_cache = ModelFuncCache(model_cache_max_size)
+    while True:
+        try:
+            job = conn.recv()
+        except EOFError:
+            break
+        if job is None:
+            break
+        (memory_limit, job_args) = job
+        usage = {}
+        try:
+            with _memory_limit(memory_limit), measure_process_usage() as usage:
+                value = _run_model(model_func_cache, *job_args)
+        # pylint: disable=broad-except
+        except BaseException as reason:
+            if not isinstance(reason, Exception):
+                # NOTE Re-raised in the parent process, e.g. `SystemExit` would stop the Celery worker instead.
+                reason = ChildProcessError('model raised {0!r}'.format(reason))
+            try:
+                conn.send((False, reason, usage))
+            except Exception:
+                conn.send((False, RuntimeError(repr(reason)), usage))
+        # pylint: enable=broad-except
+        else:
+            try:
+                conn.send((True, value, usage))
+            except Exception:  # pylint: disable=broad-except
+                conn.send((True, None, usage))
+
+
+class ModelRunner(abc.ABC):
+    """Abstract model runner class for loading and running model functions."""
+
+    @property
+    def concurrency(self) -> int:
+        """Return the number of models that can run at the same time."""
+        return 1
+
+    @abc.abstractmethod
+    def load(self, name: str, file_name: str) -> typing.Any:
+        """
+        Abstract load method to define the interface for loading a model.
+
+        The model function ``name`` is loaded from the model file and
+        a model is returned to be passed to the ``run`` method later.
+        """
+        raise NotImplementedError()  # pragma: no cover
+
+    # pylint: disable=too-many-arguments
+    @abc.abstractmethod
+    def run(self, model: typing.Any, args: typing.List[str], log_dir_name: str,
+            checkpoint: Checkpoint = None, timeout: float = 0) -> typing.Any:
+        """
+        Abstract run method to define the interface for running a model.
+
+        The model function is called with the arguments while its
+        standard output and error are appended to log files in the log
+        directory, within the log size cap of the model runner. The
+        checkpoint, if any, is the current checkpoint of the model
+        function while it runs. The CPU time and peak memory of the run
+        are recorded to the usage of the current context, if any. The
+        run is stopped with ``ModelTimeoutError`` after ``timeout``
+        seconds (zero means no limit).
+        """
+        raise NotImplementedError()  # pragma: no cover
+    # pylint: enable=too-many-arguments
+
+    @abc.abstractmethod
+    def cancel(self) -> None:
+        """
+        Abstract cancel method to define the interface for stopping the running models.
+
+        Every model run of the model runner that is running is stopped
+        with ``ModelCancelledError``.
+        """
+        raise NotImplementedError()  # pragma: no cover
+
+    def warm(self) -> None:
+        """Prepare the model runner before the first model run, doing nothing by default."""
+
+
+class LocalModelRunner(ModelRunner):
+    """
+    Local model runner class.
+
+    This class loads and runs the model functions in the current
+    process, one after another. Only the output of the Python code of
+    the model is captured, output of C extensions and subprocesses goes
+    to the output of the process.
+
+    A model run out of time or cancelled is interrupted with an
+    exception raised in its thread, once the model function runs Python
+    code again; a model function blocked in C code is not interrupted.
+
+    The CPU time of a model run is the time of its thread, the peak
+    memory is the peak of the process, so it is recorded only for model
+    runs that did not run at the same time as another model run in the
+    process, e.g. in another thread of the Celery worker.
+    """
+
+    def __init__(self, model_func_cache: ModelFuncCache = None, log_max_size: int = 0) -> None:
+        """Save the model function cache and the log size cap to the instance of the class."""
+        super(LocalModelRunner, self).__init__()
+
+        self.model_func_cache = model_func_cache if model_func_cache is not None else ModelFuncCache()
+        self.log_max_size = log_max_size
+        self._thread_ids = set()  # type: typing.Set[int]
+        self._shared_thread_ids = set()  # type: typing.Set[int]
+        # NOTE Reentrant, the model runs are cancelled by signal handlers that run in the thread running the model.
+        self._lock = threading.RLock()
+
+    def load(self, name: str, file_name: str) -> typing.Callable:
+        """Load the model function through the model function cache."""
+        return self.model_func_cache.load(name, file_name)
+
+    def _interrupt(self, thread_id: int, exc_type: type) -> None:
+        """Raise the exception in the thread, if it is running a model."""
+        with self._lock:
+            if thread_id in self._thread_ids:
+                interrupt_thread(thread_id, exc_type)
+
+    @contextlib.contextmanager
+    def _interruptible(self, timeout: float) -> typing.Generator[None, None, None]:
+        """Let the model run in the current thread be interrupted by the timeout or by ``cancel``."""
+        thread_id = threading.get_ident()
+        timer = None
+        if timeout:
+            timer = threading.Timer(timeout, self._interrupt, (thread_id, ModelTimeoutError))
+            timer.daemon = True
+        with self._lock:
+            if self._thread_ids:
+                self._shared_thread_ids.update(self._thread_ids)
+                self._shared_thread_ids.add(thread_id)
+            self._thread_ids.add(thread_id)
+        try:
+            if timer is not None:
+                timer.start()
+            yield
+        finally:
+            # NOTE An interrupt that did not fire yet is cleared, once the model returned it is too late.
+            with self._lock:
+                self._thread_ids.discard(thread_id)
+                interrupt_thread(thread_id, None)
+            if timer is not None:
+                timer.cancel()
+
+    # pylint: disable=too-many-arguments
+    def run(self, model: typing.Callable, args: typing.List[str], log_dir_name: str,
+            checkpoint: Checkpoint = None, timeout: float = 0) -> typing.Any:
+        """Call the model function in the current process."""
+        with redirect_stdout_stderr(log_dir_name, mode='a', max_size=self.log_max_size), \
+                checkpoint_context(checkpoint):
+            thread_id = threading.get_ident()
+            usage = {}
+            try:
+                with measure_process_usage(per_thread=True) as usage, self._interruptible(timeout):
+                    return model(*args)
+            finally:
+                with self._lock:
+                    if thread_id in self._shared_thread_ids:
+                        self._shared_thread_ids.discard(thread_id)
+                        usage.pop('peak_rss_bytes', None)
+                record_usage(usage)
+    # pylint: enable=too-many-arguments
+
+    def cancel(self) -> None:
+        """Interrupt the threads running models."""
+        with self._lock:
+            for thread_id in self._thread_ids:
+                interrupt_thread(thread_id, ModelCancelledError)
+
+
+class _ModelProcess:
+    """Worker process of the process pool model runner."""
+
+    def __init__(self, mp_context: multiprocessing.context.BaseContext, model_cache_max_size: int) -> None:
+        """Start the worker process connected through a pipe."""
+        super(_ModelProcess, self).__init__()
+
+        self.cancelled = False
+        (self.conn, child_conn) = mp_context.Pipe()
+        self.process = mp_context.Process(target=_worker_main, args=(child_conn, model_cache_max_size), daemon=True)
+        self.process.start()
+        child_conn.close()
+
+    def close(self) -> None:
+        """Ask the worker process to exit, terminating it if it does not."""
+        with contextlib.suppress(OSError):
+            self.conn.send(None)
+        self.process.join(1)
+        self.kill()
+
+    def kill(self) -> None:
+        """Terminate the worker process."""
+        if self.process.is_alive():
+            self.process.terminate()
+        self.process.join()
+        self.conn.close()
+
+
+# pylint: disable=too-many-instance-attributes
+class ProcessPoolModelRunner(ModelRunner):
+    """
+    Process pool model runner class.
+
+    This class loads and runs the model functions in a pool of at most
+    ``processes`` reusable worker processes, started with the
+    ``multiprocessing`` start method ``start_method``. Each worker
+    process keeps its own model function cache.
+
+    A model run is limited to ``timeout`` seconds of wall-clock time,
+    or the timeout of the run if it is shorter, and ``memory_limit``
+    bytes of address space (zero means no limit). The worker process of
+    a model run that is out of time or cancelled is terminated and
+    replaced. Exceptions raised by a model function are
+    raised again in the current process.
+
+    The output of the worker process is captured at the file
+    descriptor level, including the output of C extensions and
+    subprocesses, keeping at most ``log_max_size`` bytes per run.
+    """
+
+    # pylint: disable=too-many-arguments
+    def __init__(self, processes: int = 0, timeout: float = 0, memory_limit: int = 0,
+                 start_method: str = None, model_cache_max_size: int = 32, log_max_size: int = 0) -> None:
+        """Save the pool settings; worker processes are started on first use."""
+        super(ProcessPoolModelRunner, self).__init__()
+
+        self.processes = processes or os.cpu_count() or 1
+        self.timeout = timeout
+        self.memory_limit = memory_limit
+        self.model_cache_max_size = model_cache_max_size
+        self.log_max_size = log_max_size
+        self._mp_context = multiprocessing.get_context(start_method)
+        self._idle_processes = []  # type: typing.List[_ModelProcess]
+        self._running_processes = set()  # type: typing.Set[_ModelProcess]
+        self._processes_count = 0
+        self._condition = threading.Condition()
+
+        atexit.register(self.close)
+    # pylint: enable=too-many-arguments
+
+    def _acquire(self) -> _ModelProcess:
+        """Take an idle worker process, starting one if the pool is not full."""
+        with self._condition:
+            while (not self._idle_processes) and (self._processes_count >= self.processes):
+                self._condition.wait()
+            if self._idle_processes:
+                return self._idle_processes.pop()
+            self._processes_count += 1
+        try:
+            return _ModelProcess(self._mp_context, self.model_cache_max_size)
+        except BaseException:  # pragma: no cover failing to start a process
+            self._release(None)
+            raise
+
+    def _release(self, model_process: typing.Optional[_ModelProcess]) -> None:
+        """Return a worker process to the pool or, if it is ``None``, free its place."""
+        with self._condition:
+            if model_process is not None:
+                self._idle_processes.append(model_process)
+            else:
+                self._processes_count -= 1
+            self._condition.notify()
+
+    def _submit(self, *job_args: typing.Any, timeout: float = 0) -> typing.Any:
+        """Send a job to a worker process and wait for its result, at most the shortest of the timeouts."""
+        timeout = min([job_timeout for job_timeout in [self.timeout, timeout] if job_timeout], default=0)
+        model_process = self._acquire()
+        with self._condition:
+            self._running_processes.add(model_process)
+        try:
+            model_process.conn.send((self.memory_limit, job_args))
+            if timeout and not model_process.conn.poll(timeout):
+                raise ModelTimeoutError('model did not finish within {0} seconds'.format(timeout))
+            try:
+                (success, value, usage) = model_process.conn.recv()
+            except (EOFError, OSError):
+                model_process.process.join(1)
+                if model_process.cancelled:
+                    raise ModelCancelledError('model run cancelled')
+                raise ChildProcessError('model process exited with code {0}'.format(model_process.process.exitcode))
+        except BaseException:
+            with self._condition:
+                self._running_processes.discard(model_process)
+            model_process.kill()
+            self._release(None)
+            raise
+        with self._condition:
+            self._running_processes.discard(model_process)
+        self._release(model_process)
+        record_usage(usage)
+        if not success:
+            raise value
+        return value
+
+    @property
+    def concurrency(self) -> int:
+        """Return the number of worker processes."""
+        return self.processes
+
+    def load(self, name: str, file_name: str) -> typing.Tuple[str, str]:
+        """Load the model function in a worker process to check it."""
+        self._submit(name, file_name, None, None)
+        return (name, file_name)
+
+    # pylint: disable=too-many-arguments
+    def run(self, model: typing.Tuple[str, str], args: typing.List[str], log_dir_name: str,
+            checkpoint: Checkpoint = None, timeout: float = 0) -> typing.Any:
+        """Call the model function in a worker process."""
+        (name, file_name) = model
+        return self._submit(name, file_name, args, log_dir_name, self.log_max_size, checkpoint, timeout=timeout)
+    # pylint: enable=too-many-arguments
+
+    def cancel(self) -> None:
+        """Terminate the worker processes running models."""
+        with self._condition:
+            running_processes = list(self._running_processes)
+        for model_process in running_processes:
+            model_process.cancelled = True
+            with contextlib.suppress(OSError, ValueError):
+                model_process.process.terminate()
+
+    def close(self) -> None:
+        """Stop the idle worker processes."""
+        with self._condition:
+            idle_processes = self._idle_processes
+            self._idle_processes = []
+            self._processes_count -= len(idle_processes)
+        for model_process in idle_processes:
+            model_process.close()
+# pylint: enable=too-many-instance-attributes
+
+
+class ForkServerModelRunner(ProcessPoolModelRunner):
+    """
+    Fork server model runner class.
+
+    This class runs every model function in a new worker process, at
+    most ``processes`` at the same time, which exits after the run, so
+    no state is shared between the model runs of the events. The worker
+    processes are forked from a fork server process that imported the
+    ``preload_module_names`` once, so a worker process starts with the
+    modules shared copy-on-write instead of importing them again.
+    Modules that can not be imported are skipped. Like every process
+    started by ``multiprocessing``, a worker process imports the main
+    module of the current process again, so the modules imported by the
+    main module should be preloaded too, e.g. ``celery.__main__`` for a
+    Celery worker.
+
+    The fork server is started by ``warm`` or by the first model run.
+    There is one fork server per process, the preloaded modules of the
+    last fork server model runner created before it starts are used.
+    The model files are not loaded ahead of their runs, a model file
+    that can not be loaded fails its run instead, so every model run
+    forks one worker process.
+    """
+
+    # pylint: disable=too-many-arguments
+    def __init__(self, processes: int = 0, timeout: float = 0, memory_limit: int = 0,
+                 preload_module_names: typing.Iterable[str] = PRELOAD_MODULE_NAMES_, log_max_size: int = 0) -> None:
+        """Save the pool settings and the modules to preload in the fork server."""
+        super(ForkServerModelRunner, self).__init__(
+            processes=processes, timeout=timeout, memory_limit=memory_limit, start_method='forkserver',
+            model_cache_max_size=1, log_max_size=log_max_size)
+
+        self.preload_module_names = [__name__] + list(preload_module_names)
+        self._mp_context.set_forkserver_preload(self.preload_module_names)
+    # pylint: enable=too-many-arguments
+
+    def _release(self, model_process: typing.Optional[_ModelProcess]) -> None:
+        """Stop the worker process after its model run and free its place."""
+        if model_process is not None:
+            model_process.close()
+        super(ForkServerModelRunner, self)._release(None)
+
+    def load(self, name: str, file_name: str) -> typing.Tuple[str, str]:
+        """Return the model function to load in the worker process of every run, without forking one to check it."""
+        return (name, file_name)
+
+    def warm(self) -> None:
+        """Start the fork server, importing the preloaded modules, if it is not running."""
+        # pylint: disable=import-outside-toplevel
+        import multiprocessing.forkserver
+
+        multiprocessing.forkserver.ensure_running()
+        # pylint: enable=import-outside-toplevel
+
+
+__all__ = ('ModelRunner', 'LocalModelRunner', 'ProcessPoolModelRunner', 'ForkServerModelRunner', )
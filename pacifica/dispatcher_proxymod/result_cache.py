@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# pacifica-dispatcher-proxymod: pacifica/dispatcher_proxymod/result_cache.py
+#
+# Copyright (c) 2019, Battelle Memorial Institute
+# All rights reserved.
+#
+# See LICENSE and WARRANTY for details.
+"""
+Result cache module.
+
+This module contains a cache of the files written by model runs, keyed
+by a digest of everything the model runs depend on, so that identical
+model runs are not run again.
+"""
+import os
+import shutil
+import tempfile
+import typing
+
+from .locks import locked
+from .timers import StageTimer
+
+RESULT_CACHE_LOCK_FILE_NAME_ = '.lock'
+
+
+def walk_file_names(basedir_name: str) -> typing.List[str]:
+    """Return the paths of all files in the directory, relative to the directory."""
+    file_names = []
+    for walk_root, _walk_dirs, walk_names in os.walk(basedir_name):
+        for file_name in walk_names:
+            file_names.append(os.path.relpath(os.path.join(walk_root, file_name), basedir_name))
+    return sorted(file_names)
+
+
+def _copy_files(src_dir_name: str, dst_dir_name: str, file_names: typing.List[str]) -> None:
+    """Copy the files from one directory to another, keeping their relative paths."""
+    for file_name in file_names:
+        dst_file_name = os.path.join(dst_dir_name, file_name)
+        os.makedirs(os.path.dirname(dst_file_name), exist_ok=True)
+        shutil.copyfile(os.path.join(src_dir_name, file_name), dst_file_name)
+
+
+class ResultCache:
+    """
+    Result cache class.
+
+    Every entry of the cache is a directory of files named by the key
+    of the entry. The cache is bounded by ``max_size`` bytes (zero means
+    unbounded) and the least recently used entries are evicted first.
+    Changes to the cache directory are serialized with a lock file so
+    the cache can be shared by several worker processes.
+
+    The hits and misses are counted on the instance and observed by the
+    stage timer, if any, as lookups in the ``result`` cache.
+    """
+
+    def __init__(self, cache_dir_name: str, max_size: int = 0, stage_timer: StageTimer = None) -> None:
+        """Save the cache settings and the stage timer and create the cache directory."""
+        super(ResultCache, self).__init__()
+
+        self.cache_dir_name = cache_dir_name
+        self.max_size = max_size
+        self.stage_timer = stage_timer if stage_timer is not None else StageTimer()
+        self.hits = 0
+        self.misses = 0
+
+        os.makedirs(cache_dir_name, exist_ok=True)
+
+    def _lock_file_name(self) -> str:
+        """Return the path of the cache lock file."""
+        return os.path.join(self.cache_dir_name, RESULT_CACHE_LOCK_FILE_NAME_)
+
+    def restore(self, key: str, dst_dir_name: str) -> bool:
+        """Copy the files of the cache entry to the directory, returning false if there is no entry."""
+        entry_dir_name = os.path.join(self.cache_dir_name, key)
+        with locked(self._lock_file_name()):
+            if not os.path.isdir(entry_dir_name):
+                self.misses += 1
+                self.stage_timer.observe_cache('result', False)
+                return False
+            _copy_files(entry_dir_name, dst_dir_name, walk_file_names(entry_dir_name))
+            # NOTE Touch the cache entry so that it is the most recently used.
+            os.utime(entry_dir_name)
+            self.hits += 1
+            self.stage_timer.observe_cache('result', True)
+        return True
+
+    def store(self, key: str, src_dir_name: str, file_names: typing.List[str]) -> None:
+        """Copy the files from the directory to a new cache entry."""
+        entry_dir_name = os.path.join(self.cache_dir_name, key)
+        staging_dir_name = tempfile.mkdtemp(prefix='.entry-', dir=self.cache_dir_name)
+        try:
+            _copy_files(src_dir_name, staging_dir_name, file_names)
+            with locked(self._lock_file_name()):
+                if not os.path.isdir(entry_dir_name):
+                    os.rename(staging_dir_name, entry_dir_name)
+                self._evict()
+        finally:
+            if os.path.isdir(staging_dir_name):
+                shutil.rmtree(staging_dir_name)
+
+    def _evict(self) -> None:
+        """Remove the least recently used cache entries until the cache fits."""
+        if not self.max_size:
+            return
+        entries = []
+        total_size = 0
+        for entry_name in os.listdir(self.cache_dir_name):
+            entry_dir_name = os.path.join(self.cache_dir_name, entry_name)
+            if entry_name.startswith('.') or not os.path.isdir(entry_dir_name):
+                continue
+            size = sum(
+                os.path.getsize(os.path.join(entry_dir_name, file_name))
+                for file_name in walk_file_names(entry_dir_name)
+            )
+            entries.append((os.stat(entry_dir_name).st_mtime, size, entry_dir_name))
+            total_size += size
+        for _mtime, size, entry_dir_name in sorted(entries):
+            if total_size <= self.max_size:
+                break
+            shutil.rmtree(entry_dir_name)
+            total_size -= size
+
+
+__all__ = ('ResultCache', 'walk_file_names', )
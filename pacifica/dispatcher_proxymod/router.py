@@ -7,34 +7,301 @@
 # All rights reserved.
 #
 # See LICENSE and WARRANTY for details.
-"""Router proxymod module."""
+"""
+Router proxymod module.
+
+The route of the router, the event handler and its download and upload
+runners are created on first use, so importing this module stays cheap
+for every worker process and test that does not route an event.
+
+The events deferred by the admission control of the event handler are
+passed to the ``defer_event`` function of the router, if any, e.g. to
+handle them again later.
+
+The JSONPath of the route is prefiltered, most events are rejected by
+checking their type, source and proxymod key values before evaluating
+the JSONPath over the whole event.
+"""
 import os
+import threading
+import typing
 
-from jsonpath2.path import Path
+from pacifica.dispatcher.router import Route, Router
 
-from pacifica.cli.methods import generate_global_config, generate_requests_auth
-from pacifica.dispatcher.downloader_runners import RemoteDownloaderRunner
-from pacifica.dispatcher.router import Router
-from pacifica.dispatcher.uploader_runners import RemoteUploaderRunner
-from pacifica.downloader import Downloader
-from pacifica.uploader import Uploader
+from .exceptions import AdmissionDeferredProxEventHandlerError, DeferredEventError
+from .journals import EventJournal
+from .timers import StageTimer
 
-from .event_handlers import ProxEventHandler
+PROXYMOD_PATH_FILE_NAME_ = os.path.join(os.path.dirname(__file__), 'jsonpath2', 'proxymod.txt')
 
-# these are not exported as constants so no one sees them anyway
-# pylint: disable=invalid-name
-config = generate_global_config()
+# NOTE These are necessary conditions of the JSONPath file, keep them in sync with it.
+PROXYMOD_EVENT_TYPE_ = 'org.pacifica.metadata.ingest'
+
+PROXYMOD_SOURCE_ = '/pacifica/metadata/ingest'
+
+PROXYMOD_REQUIRED_KEY_VALUES_ = {
+    'proxymod.task': 'advance',
+    'proxymod.version': 'v0.0.1',
+}
+
+
+def may_match_proxymod(event_data: typing.Any) -> bool:
+    """Return false if the event can not match the proxymod JSONPath, checking the data of the event once."""
+    if not isinstance(event_data, dict) or ('eventID' not in event_data):
+        return False
+    if (event_data.get('eventType') != PROXYMOD_EVENT_TYPE_) or (event_data.get('source') != PROXYMOD_SOURCE_):
+        return False
+    data = event_data.get('data')
+    if isinstance(data, dict):
+        data = data.values()
+    elif not isinstance(data, list):
+        return False
+    missing_value_by_key = dict(PROXYMOD_REQUIRED_KEY_VALUES_)
+    for item in data:
+        if not isinstance(item, dict) or item.get('destinationTable') != 'TransactionKeyValue':
+            continue
+        key = item.get('key')
+        if (key in missing_value_by_key) and (missing_value_by_key[key] == item.get('value')):
+            del missing_value_by_key[key]
+            if not missing_value_by_key:
+                return True
+    return False
+
+
+class PrefilteredPath:
+    """
+    Prefiltered path class.
+
+    The JSONPath is only evaluated for the data accepted by the
+    prefilter, which must accept all of the data the JSONPath matches.
+    """
+
+    def __init__(self, path: typing.Any, prefilter: typing.Callable[[typing.Any], bool]) -> None:
+        """Save the JSONPath and the prefilter."""
+        super(PrefilteredPath, self).__init__()
+
+        self.path = path
+        self.prefilter = prefilter
+
+    def match(self, root_value: typing.Any) -> typing.Generator[typing.Any, None, None]:
+        """Yield the match data of the JSONPath, none if the prefilter rejects the data."""
+        if not self.prefilter(root_value):
+            return
+        yield from self.path.match(root_value)
+
+
+class DeferringRoute(Route):
+    """
+    Deferring route class.
+
+    The events deferred by the admission control of the event handler
+    are passed to ``defer`` with the reason, then a
+    ``DeferredEventError`` is raised, which the receive task saves as
+    the status of the event until it is handled again.
+    """
+
+    def __init__(self, path: typing.Any, event_handler: typing.Any, defer: typing.Callable[
+            [typing.Dict[str, typing.Any], AdmissionDeferredProxEventHandlerError], None] = None) -> None:
+        """Save the path, the event handler and the function deferring the events."""
+        super(DeferringRoute, self).__init__(path, event_handler)
+
+        self.defer = defer
+
+    def __call__(self, event_data: typing.Dict[str, typing.Any]) -> None:
+        """Use event data to call the handler on the event, deferring it if the event handler says so."""
+        try:
+            super(DeferringRoute, self).__call__(event_data)
+        except AdmissionDeferredProxEventHandlerError as reason:
+            if self.defer is None:
+                raise
+            self.defer(event_data, reason)
+            raise DeferredEventError(reason)
+
+
+# NOTE The imports are deferred to the first event, they are most of the cost of importing this module.
+# pylint: disable=import-outside-toplevel
+# pylint: disable=too-many-locals
+def create_event_handler(stage_timer: StageTimer = None, event_journal: EventJournal = None) -> typing.Any:
+    """Create the proxymod event handler from the global configuration and the environment."""
+    from pacifica.cli.methods import generate_global_config, generate_requests_auth
+    from pacifica.dispatcher.uploader_runners import RemoteUploaderRunner
+    from pacifica.uploader import Uploader
+
+    from .admission import AdmissionController, HeadroomAdmissionController
+    from .downloader_runners import STAGE_MODES_, CachingDownloaderRunner, ConcurrentDownloaderRunner
+    from .downloader_runners import StagingDownloaderRunner
+    from .event_handlers import ProxEventHandler
+    from .model_cache import ModelFuncCache
+    from .model_runners import PRELOAD_MODULE_NAMES_, ForkServerModelRunner
+    from .model_runners import LocalModelRunner, ProcessPoolModelRunner
+    from .result_cache import ResultCache
+    from .scratch import MemoryScratch, Scratch
+    from .uploader_runners import StreamingUploaderRunner
+
+    config = generate_global_config()
+
+    auth = generate_requests_auth(config)
+
+    downloader_runner = ConcurrentDownloaderRunner(
+        config.get('endpoints', 'download_url'), auth=auth,
+        concurrency=int(os.getenv('DOWNLOAD_CONCURRENCY', '4')),
+        retries=int(os.getenv('DOWNLOAD_RETRIES', '3')),
+        backoff_factor=float(os.getenv('DOWNLOAD_BACKOFF_FACTOR', '1.0'))
+    )
 
-auth = generate_requests_auth(config)
+    if os.getenv('CACHE_DIR'):
+        downloader_runner = CachingDownloaderRunner(
+            downloader_runner, os.getenv('CACHE_DIR'), int(os.getenv('CACHE_MAX_SIZE', '0')), stage_timer)
 
-downloader_runner = RemoteDownloaderRunner(Downloader(cart_api_url=config.get('endpoints', 'download_url'), auth=auth))
+    if os.getenv('STAGE_DIR'):
+        downloader_runner = StagingDownloaderRunner(
+            downloader_runner, os.getenv('STAGE_DIR'), os.getenv('STAGE_PATH_FORMAT', '{path}'), [
+                mode.strip() for mode in os.getenv('STAGE_MODES', ','.join(STAGE_MODES_)).split(',') if mode.strip()
+            ])
 
-uploader_runner = RemoteUploaderRunner(Uploader(upload_url=config.get(
-    'endpoints', 'upload_url'), status_url=config.get('endpoints', 'upload_status_url'), auth=auth))
+    uploader = Uploader(upload_url=config.get(
+        'endpoints', 'upload_url'), status_url=config.get('endpoints', 'upload_status_url'), auth=auth)
 
-router = Router()
+    if os.getenv('UPLOAD_STREAM', 'false').lower() not in ['0', 'false', 'no', 'off']:
+        compress_min_size = None
 
-router.add_route(Path.parse_file(os.path.join(os.path.dirname(__file__), 'jsonpath2', 'proxymod.txt')),
-                 ProxEventHandler(downloader_runner, uploader_runner))
+        if os.getenv('UPLOAD_COMPRESS', 'false').lower() not in ['0', 'false', 'no', 'off']:
+            compress_min_size = int(os.getenv('UPLOAD_COMPRESS_MIN_SIZE', '65536'))
+
+        uploader_runner = StreamingUploaderRunner(uploader, compress_min_size)
+    else:
+        uploader_runner = RemoteUploaderRunner(uploader)
+
+    if os.getenv('MODEL_RUNNER', 'local') == 'process':
+        model_runner = ProcessPoolModelRunner(
+            processes=int(os.getenv('MODEL_PROCESSES', '0')),
+            timeout=float(os.getenv('MODEL_TIMEOUT', '0')),
+            memory_limit=int(os.getenv('MODEL_MEMORY_LIMIT', '0')),
+            start_method=os.getenv('MODEL_START_METHOD', None),
+            model_cache_max_size=int(os.getenv('MODEL_CACHE_MAX_SIZE', '32')),
+            log_max_size=int(os.getenv('LOG_MAX_SIZE', '0'))
+        )
+    elif os.getenv('MODEL_RUNNER', 'local') == 'forkserver':
+        model_runner = ForkServerModelRunner(
+            processes=int(os.getenv('MODEL_PROCESSES', '0')),
+            timeout=float(os.getenv('MODEL_TIMEOUT', '0')),
+            memory_limit=int(os.getenv('MODEL_MEMORY_LIMIT', '0')),
+            preload_module_names=[
+                module_name.strip() for module_name in os.getenv(
+                    'MODEL_PRELOAD', ','.join(PRELOAD_MODULE_NAMES_)).split(',') if module_name.strip()
+            ],
+            log_max_size=int(os.getenv('LOG_MAX_SIZE', '0'))
+        )
+    else:
+        model_runner = LocalModelRunner(ModelFuncCache(int(os.getenv('MODEL_CACHE_MAX_SIZE', '32')), stage_timer),
+                                        log_max_size=int(os.getenv('LOG_MAX_SIZE', '0')))
+
+    result_cache = None
+
+    if os.getenv('RESULT_CACHE_DIR'):
+        result_cache = ResultCache(
+            os.getenv('RESULT_CACHE_DIR'), int(os.getenv('RESULT_CACHE_MAX_SIZE', '0')), stage_timer)
+
+    scratch = Scratch(os.getenv('SCRATCH_DISK_DIR') or None)
+
+    if os.getenv('SCRATCH_DIR'):
+        scratch = MemoryScratch(os.getenv('SCRATCH_DIR'), int(os.getenv('SCRATCH_MAX_SIZE', '0')),
+                                os.getenv('SCRATCH_DISK_DIR') or None)
+
+    output_multiplier = float(os.getenv('ADMISSION_OUTPUT_MULTIPLIER', '1.0'))
+
+    output_multiplier_by_model_name = {
+        model_name.strip(): float(multiplier) for model_name, _sep, multiplier in (
+            item.partition('=') for item in os.getenv('ADMISSION_OUTPUT_MULTIPLIERS', '').split(',') if item.strip())
+    }
+
+    admission_controller = AdmissionController(output_multiplier, output_multiplier_by_model_name)
+
+    if os.getenv('ADMISSION_CONTROL', 'false').lower() not in ['0', 'false', 'no', 'off']:
+        admission_controller = HeadroomAdmissionController(
+            scratch, min_free_disk=int(os.getenv('ADMISSION_MIN_FREE_DISK', '0')),
+            min_free_memory=int(os.getenv('ADMISSION_MIN_FREE_MEMORY', '0')), output_multiplier=output_multiplier,
+            output_multiplier_by_model_name=output_multiplier_by_model_name)
+
+    return ProxEventHandler(
+        downloader_runner, uploader_runner, model_runner, result_cache, stage_timer, event_journal,
+        log_max_size=int(os.getenv('LOG_MAX_SIZE', '0')),
+        log_compress=os.getenv('LOG_COMPRESS', 'false').lower() not in ['0', 'false', 'no', 'off'],
+        checkpoint_dir_name=os.getenv('CHECKPOINT_DIR') or None, scratch=scratch,
+        admission_controller=admission_controller,
+        max_event_timeout=float(os.getenv('MAX_EVENT_TIMEOUT', '0')),
+        max_model_timeout=float(os.getenv('MAX_MODEL_TIMEOUT', '0')),
+        checkpoint_max_age=float(os.getenv('CHECKPOINT_MAX_AGE', '604800'))
+    )
+# pylint: enable=too-many-locals
+
+
+class LazyRouter(Router):
+    """
+    Lazy router class.
+
+    The proxymod route is added the first time the router is used,
+    parsing the JSONPath file and creating the event handler then. The
+    route passes the deferred events to ``defer_event``, if it is set
+    before then.
+    """
+
+    def __init__(self, stage_timer: StageTimer = None, event_journal: EventJournal = None) -> None:
+        """Save the stage timer and event journal of the event handler to create later."""
+        super(LazyRouter, self).__init__()
+
+        self.stage_timer = stage_timer
+        self.event_journal = event_journal
+        self.defer_event = None  # type: typing.Callable
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._path = None
+
+    def _load_path(self) -> typing.Any:
+        """Return the JSONPath of the proxymod route, parsing it once."""
+        if self._path is None:
+            from jsonpath2.path import Path
+
+            self._path = PrefilteredPath(Path.parse_file(PROXYMOD_PATH_FILE_NAME_), may_match_proxymod)
+        return self._path
+
+    def _load(self) -> None:
+        """Add the proxymod route, once."""
+        if self._loaded:
+            return
+        with self._lock:
+            if self._loaded:
+                return
+            self._routes.insert(0, DeferringRoute(
+                self._load_path(), create_event_handler(self.stage_timer, self.event_journal), self.defer_event))
+            self._loaded = True
+
+    @property
+    def loaded(self) -> bool:
+        """Return true if the proxymod route is added, and its event handler created."""
+        return self._loaded
+
+    @property
+    def event_handler(self) -> typing.Any:
+        """Return the proxymod event handler."""
+        self._load()
+        return self._routes[0].event_handler
+
+    def match_path(self, event_data: typing.Dict[str, typing.Any]) -> bool:
+        """Return whether the event matches the proxymod route, without creating the event handler."""
+        for _match_data in self._load_path().match(event_data):
+            return True
+        return False
+
+    def match(self, event_data: typing.Dict[str, typing.Any]) -> typing.Generator[Route, None, None]:
+        """Yield all route objects that match the event, adding the proxymod route first."""
+        self._load()
+        return super(LazyRouter, self).match(event_data)
+# pylint: enable=import-outside-toplevel
+
+
+# these are not exported as constants so no one sees them anyway
+# pylint: disable=invalid-name
+router = LazyRouter()
 
-__all__ = ('router', )
+__all__ = ('router', 'create_event_handler', 'may_match_proxymod', 'PrefilteredPath', 'DeferringRoute', 'LazyRouter', )
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# pacifica-dispatcher-proxymod: pacifica/dispatcher_proxymod/schedulers.py
+#
+# Copyright (c) 2019, Battelle Memorial Institute
+# All rights reserved.
+#
+# See LICENSE and WARRANTY for details.
+"""
+Scheduler module.
+
+This module runs the nodes of a dependency graph, for example the
+model files of an event, running independent nodes concurrently and
+starting a node only once all of its dependencies have finished.
+"""
+import collections
+import concurrent.futures
+import typing
+
+
+class CycleError(ValueError):
+    """Dependency cycle exception."""
+
+    def __init__(self, nodes: typing.List[typing.Hashable]) -> None:
+        """Save the nodes on or behind the dependency cycle."""
+        super(CycleError, self).__init__('dependency cycle between {0}'.format(', '.join(map(str, nodes))))
+        self.nodes = nodes
+
+
+def topological_order(nodes: typing.List[typing.Hashable],
+                      dependencies: typing.Dict[typing.Hashable, typing.Set[typing.Hashable]]
+                      ) -> typing.List[typing.Hashable]:
+    """
+    Return the nodes ordered so that every node follows its dependencies.
+
+    Nodes keep their given order where their dependencies allow it. A
+    ``KeyError`` is raised for a dependency that is not a node and a
+    ``CycleError`` for dependencies that can never be satisfied.
+    """
+    remaining = collections.OrderedDict((node, set(dependencies.get(node, ()))) for node in nodes)
+    for node, node_dependencies in remaining.items():
+        for dependency in node_dependencies:
+            if dependency not in remaining:
+                raise KeyError(dependency)
+    order = []
+    while remaining:
+        ready = [node for node, node_dependencies in remaining.items() if not node_dependencies]
+        if not ready:
+            raise CycleError(list(remaining.keys()))
+        for node in ready:
+            del remaining[node]
+            order.append(node)
+        for node_dependencies in remaining.values():
+            node_dependencies.difference_update(ready)
+    return order
+
+
+# pylint: disable=too-many-locals
+def run_graph(nodes: typing.List[typing.Hashable],
+              dependencies: typing.Dict[typing.Hashable, typing.Set[typing.Hashable]],
+              func: typing.Callable[[typing.Hashable], typing.Any], max_workers: int = 1,
+              cancel: typing.Callable[[], None] = None) -> None:
+    """
+    Call ``func`` for every node once all of its dependencies are done.
+
+    Up to ``max_workers`` nodes run at the same time in a thread pool.
+    Once a node raises, no more nodes are started and the first
+    exception is raised again after the running nodes have finished.
+    If the current thread raises while it waits for the running nodes,
+    ``cancel``, if any, is called to stop them before it raises again.
+    With one worker the nodes run in the current thread instead.
+    """
+    order = topological_order(nodes, dependencies)
+
+    if max_workers <= 1:
+        for node in order:
+            func(node)
+        return
+
+    remaining = {node: set(dependencies.get(node, ())) for node in nodes}
+    dependents = collections.defaultdict(list)
+    for node in nodes:
+        for dependency in remaining[node]:
+            dependents[dependency].append(node)
+
+    ready = [node for node in nodes if not remaining[node]]
+    running = {}
+    error = None
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        try:
+            while (ready and (error is None)) or running:
+                while ready and (error is None):
+                    node = ready.pop(0)
+                    running[executor.submit(func, node)] = node
+                (done, _not_done) = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in sorted(done, key=lambda future: nodes.index(running[future])):
+                    node = running.pop(future)
+                    if future.exception() is not None:
+                        error = error if error is not None else future.exception()
+                        continue
+                    for dependent in dependents[node]:
+                        remaining[dependent].discard(node)
+                        if not remaining[dependent]:
+                            ready.append(dependent)
+        except BaseException:
+            # NOTE Otherwise the executor waits for the running nodes to finish on their own.
+            if cancel is not None:
+                cancel()
+            raise
+
+    if error is not None:
+        raise error
+# pylint: enable=too-many-locals
+
+
+__all__ = ('CycleError', 'topological_order', 'run_graph', )
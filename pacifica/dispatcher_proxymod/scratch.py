@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# pacifica-dispatcher-proxymod: pacifica/dispatcher_proxymod/scratch.py
+#
+# Copyright (c) 2019, Battelle Memorial Institute
+# All rights reserved.
+#
+# See LICENSE and WARRANTY for details.
+"""
+Scratch module.
+
+This module contains the scratch spaces of the event handler, where the
+results of the models, the files passed between coupled models every
+timestep and the configuration files of the model runs are written. The
+first puts the scratch directories in the temporary directory of the
+system. The second puts them on a memory-backed file system, like
+``/dev/shm``, within a byte budget, and on disk once the budget is used.
+"""
+import collections
+import contextlib
+import errno
+import os
+import shutil
+import tempfile
+import threading
+import typing
+
+SCRATCH_DIR_PREFIX_ = 'proxymod-'
+
+
+class ScratchFullError(OSError):
+    """Scratch directory over the budget exception."""
+
+    def __init__(self, dir_name: str, size: int, max_size: int) -> None:
+        """Save the scratch directory, its size and the budget in bytes."""
+        super(ScratchFullError, self).__init__(
+            errno.ENOSPC, 'scratch directory takes {0} bytes, over the budget of {1} bytes'.format(size, max_size),
+            dir_name)
+        self.size = size
+        self.max_size = max_size
+
+
+class Scratch:
+    """
+    Scratch class.
+
+    Every scratch directory is a new directory in ``disk_dir_name``, the
+    temporary directory of the system by default, removed with all of
+    its files when its context exits, even if it raises. The expected
+    size of a scratch directory and the ``charge`` method are only used
+    by the scratch spaces with a budget.
+    """
+
+    def __init__(self, disk_dir_name: str = None) -> None:
+        """Save the directory of the scratch directories on disk."""
+        super(Scratch, self).__init__()
+
+        self.disk_dir_name = disk_dir_name
+
+    def _mkdtemp(self, prefix: str, size: int = 0) -> str:
+        """Create a new scratch directory, returning its name."""
+        return tempfile.mkdtemp(prefix='{0}{1}'.format(SCRATCH_DIR_PREFIX_, prefix), dir=self.disk_dir_name)
+
+    def _release(self, dir_name: str) -> None:
+        """Release the budget of the scratch directory, there is none on disk."""
+
+    @contextlib.contextmanager
+    def directory(self, prefix: str = '', size: int = 0) -> typing.Generator[str, None, None]:
+        """Create a scratch directory of the expected size in bytes for the context, removing it when it exits."""
+        dir_name = self._mkdtemp(prefix, size)
+        try:
+            yield dir_name
+        finally:
+            shutil.rmtree(dir_name, ignore_errors=True)
+            self._release(dir_name)
+
+    def charge(self, dir_name: str) -> None:
+        """Account for the files written to the scratch directory, doing nothing without a budget."""
+
+
+def _is_alive(pid: int) -> bool:
+    """Return true if the process exists."""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:  # pragma: no cover process of another user
+        return True
+    return True
+
+
+def _dir_size(dir_name: str) -> int:
+    """Return the size of the files in the directory, in bytes."""
+    size = 0
+    for walk_root, _walk_dirs, walk_names in os.walk(dir_name):
+        for walk_name in walk_names:
+            with contextlib.suppress(FileNotFoundError):
+                size += os.lstat(os.path.join(walk_root, walk_name)).st_size
+    return size
+
+
+class MemoryScratch(Scratch):
+    """
+    Memory scratch class.
+
+    The scratch directories are created in ``memory_dir_name``, on a
+    memory-backed file system, while their expected sizes fit in the
+    ``max_size`` bytes of the budget of the process (zero means no
+    limit), otherwise they spill to ``disk_dir_name``. The bytes of the
+    directories in memory are kept as a running total: a directory
+    counts its expected size until ``charge`` finds its files take more.
+    A scratch directory stays where it was created, so ``charge`` raises
+    ``ScratchFullError`` once a directory grew past its expected size
+    and the budget.
+
+    The scratch directories in memory are named after the process that
+    created them, the directories of processes that exited without
+    removing them are removed when the memory scratch is created, so
+    they do not keep the memory of a worker that was killed. The memory
+    directory must only be shared by the processes of one host, or of
+    one container, that see the same process identifiers.
+    """
+
+    def __init__(self, memory_dir_name: str, max_size: int = 0, disk_dir_name: str = None) -> None:
+        """Save the scratch directories settings and remove the scratch directories of exited processes."""
+        super(MemoryScratch, self).__init__(disk_dir_name)
+
+        self.memory_dir_name = memory_dir_name
+        self.max_size = max_size
+        self.counts = collections.Counter()  # type: typing.Dict[str, int]
+        self._size_by_dir_name = {}  # type: typing.Dict[str, int]
+        self._used_size = 0
+        self._lock = threading.Lock()
+
+        os.makedirs(memory_dir_name, exist_ok=True)
+        self.remove_stale()
+
+    def remove_stale(self) -> None:
+        """Remove the scratch directories in memory of the processes that exited."""
+        for name in os.listdir(self.memory_dir_name):
+            (pid, _sep, _suffix) = name[len(SCRATCH_DIR_PREFIX_):].partition('-')
+            if name.startswith(SCRATCH_DIR_PREFIX_) and pid.isdigit() and not _is_alive(int(pid)):
+                shutil.rmtree(os.path.join(self.memory_dir_name, name), ignore_errors=True)
+
+    def used_size(self) -> int:
+        """Return the bytes of the scratch directories in memory of the process."""
+        return self._used_size
+
+    def fits(self, size: int) -> bool:
+        """Return true if a new scratch directory of the expected size is created in memory."""
+        return (not self.max_size) or (self._used_size + size <= self.max_size)
+
+    def _mkdtemp(self, prefix: str, size: int = 0) -> str:
+        """Create a new scratch directory in memory, or on disk if its expected size does not fit in the budget."""
+        with self._lock:
+            if self.fits(size):
+                dir_name = tempfile.mkdtemp(
+                    prefix='{0}{1}-{2}'.format(SCRATCH_DIR_PREFIX_, os.getpid(), prefix),
+                    dir=self.memory_dir_name)
+                self.counts['memory'] += 1
+                self._size_by_dir_name[dir_name] = size
+                self._used_size += size
+                return dir_name
+        self.counts['disk'] += 1
+        return super(MemoryScratch, self)._mkdtemp(prefix, size)
+
+    def _release(self, dir_name: str) -> None:
+        """Release the bytes of the scratch directory in memory."""
+        with self._lock:
+            self._used_size -= self._size_by_dir_name.pop(dir_name, 0)
+
+    def charge(self, dir_name: str) -> None:
+        """Account for the files of the scratch directory in memory, raising ``ScratchFullError`` over the budget."""
+        if dir_name not in self._size_by_dir_name:
+            return
+        size = _dir_size(dir_name)
+        with self._lock:
+            if dir_name not in self._size_by_dir_name:
+                return
+            charged_size = self._size_by_dir_name[dir_name]
+            if size > charged_size:
+                self._size_by_dir_name[dir_name] = size
+                self._used_size += size - charged_size
+            over_budget = self.max_size and (self._used_size > self.max_size)
+        if over_budget and size > charged_size:
+            raise ScratchFullError(dir_name, size, self.max_size)
+
+
+__all__ = ('ScratchFullError', 'Scratch', 'MemoryScratch', )
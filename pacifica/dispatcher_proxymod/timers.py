@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# pacifica-dispatcher-proxymod: pacifica/dispatcher_proxymod/timers.py
+#
+# Copyright (c) 2019, Battelle Memorial Institute
+# All rights reserved.
+#
+# See LICENSE and WARRANTY for details.
+"""
+Timer module.
+
+This module contains the stage timers of the proxymod event handler,
+which time each stage of handling an event, e.g. downloading the files
+or running the models.
+"""
+import collections
+import contextlib
+import time
+import typing
+
+from .usage import ModelUsage
+
+
+class StageTimer:
+    """
+    Stage timer class.
+
+    The duration of every stage is passed to the ``observe`` method,
+    the outcome of every event to the ``observe_event`` method, the
+    resource usage of every model run to the ``observe_usage`` method
+    and the admission decision of every event to the
+    ``observe_admission`` method and every cache lookup to the
+    ``observe_cache`` method, which do nothing; subclasses override them
+    to keep the durations, outcomes, usages, decisions and lookups. The
+    ``flush`` method saves the durations observed outside of an event,
+    e.g. of a download shared by many events.
+    """
+
+    @contextlib.contextmanager
+    def event(self) -> typing.Generator[None, None, None]:
+        """Time handling an event as the ``event`` stage and observe its outcome."""
+        try:
+            with self.stage('event'):
+                yield
+        except BaseException as reason:
+            self.observe_event(reason)
+            raise
+        self.observe_event(None)
+
+    @contextlib.contextmanager
+    def stage(self, stage_name: str) -> typing.Generator[None, None, None]:
+        """Time the stage, even when it raises."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage_name, time.perf_counter() - start)
+
+    def observe(self, stage_name: str, seconds: float) -> None:
+        """Do nothing with the duration of the stage."""
+
+    def observe_event(self, reason: typing.Optional[BaseException]) -> None:
+        """Do nothing with the exception of a failed event, or ``None`` for a successful one."""
+
+    def observe_usage(self, model_name: str, usage: ModelUsage) -> None:
+        """Do nothing with the resource usage of the model run."""
+
+    def observe_admission(self, resource: typing.Optional[str]) -> None:
+        """Do nothing with the resource deferring an event, or ``None`` for an admitted one."""
+
+    def observe_cache(self, cache_name: str, hit: bool) -> None:
+        """Do nothing with the hit or miss of a lookup in the cache."""
+
+    def flush(self) -> None:
+        """Do nothing, there is nothing kept to save."""
+
+
+class RecordingStageTimer(StageTimer):
+    """
+    Recording stage timer class.
+
+    The durations are kept in lists by stage name, the outcomes of
+    the events are counted by exception class name, the empty string
+    for successful events, the usages are kept in lists by model name
+    and the admission decisions are counted by the resource deferring
+    the event, the empty string for admitted events. The cache lookups
+    are counted by cache name and hit.
+    """
+
+    def __init__(self) -> None:
+        """Create the empty lists of durations and usages and counts of outcomes, admissions and lookups."""
+        super(RecordingStageTimer, self).__init__()
+
+        self.durations = collections.defaultdict(list)  # type: typing.Dict[str, typing.List[float]]
+        self.outcomes = collections.Counter()  # type: typing.Dict[str, int]
+        self.usages = collections.defaultdict(list)  # type: typing.Dict[str, typing.List[ModelUsage]]
+        self.admissions = collections.Counter()  # type: typing.Dict[str, int]
+        self.lookups = collections.Counter()  # type: typing.Dict[typing.Tuple[str, bool], int]
+
+    def observe(self, stage_name: str, seconds: float) -> None:
+        """Record the duration of the stage in seconds."""
+        self.durations[stage_name].append(seconds)
+
+    def observe_event(self, reason: typing.Optional[BaseException]) -> None:
+        """Count the outcome of the event."""
+        self.outcomes[type(reason).__name__ if reason is not None else ''] += 1
+
+    def observe_usage(self, model_name: str, usage: ModelUsage) -> None:
+        """Record the usage of the model run."""
+        self.usages[model_name].append(usage)
+
+    def observe_admission(self, resource: typing.Optional[str]) -> None:
+        """Count the admission decision of the event."""
+        self.admissions[resource if resource is not None else ''] += 1
+
+    def observe_cache(self, cache_name: str, hit: bool) -> None:
+        """Count the lookup in the cache."""
+        self.lookups[(cache_name, hit)] += 1
+
+    def clear(self) -> None:
+        """Forget all of the durations, outcomes, usages, admissions and lookups."""
+        self.durations.clear()
+        self.outcomes.clear()
+        self.usages.clear()
+        self.admissions.clear()
+        self.lookups.clear()
+
+
+__all__ = ('StageTimer', 'RecordingStageTimer', )
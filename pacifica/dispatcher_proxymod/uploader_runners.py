@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# pacifica-dispatcher-proxymod: pacifica/dispatcher_proxymod/uploader_runners.py
+#
+# Copyright (c) 2019, Battelle Memorial Institute
+# All rights reserved.
+#
+# See LICENSE and WARRANTY for details.
+"""
+Upload runner module.
+
+This module contains an upload runner complementing the upload runners
+from ``pacifica.dispatcher``. The bundle of the results is generated
+chunk by chunk while it is sent to the Pacifica Ingest service, instead
+of being written to a temporary file first, so the results are read
+from disk once and the bundle takes no scratch space. Files can be
+compressed one by one and a manifest of their hashes is added to the
+bundle.
+"""
+import gzip
+import hashlib
+import os
+import tarfile
+import tempfile
+import time
+import typing
+
+from pacifica.dispatcher.models import Transaction, TransactionKeyValue
+from pacifica.dispatcher.uploader_runners import UploaderRunner, _should_sleep, _to_meta_data
+from pacifica.uploader import Uploader
+from pacifica.uploader.bundler import Bundler
+from pacifica.uploader.metadata import MetaData, metadata_encode
+
+UPLOAD_CHUNK_SIZE_ = 1024 * 1024
+
+COMPRESS_SPOOL_SIZE_ = 16 * 1024 * 1024
+
+COMPRESSED_FILE_SUFFIXES_ = ('.gz', '.tgz', '.bz2', '.xz', '.zip', '.zst', )
+
+COMPRESSED_MIME_TYPE_ = 'application/gzip'
+
+MANIFEST_FILE_NAME_ = 'manifest.sha256'
+
+
+def walk_file_data(basedir_name: str) -> typing.Generator[typing.Dict[str, typing.Any], None, None]:
+    """Yield the path and the archive name of the files in the directory, in order."""
+    for walk_root, walk_dir_names, file_names in os.walk(basedir_name):
+        walk_dir_names.sort()
+        for file_name in sorted(file_names):
+            path = os.path.join(walk_root, file_name)
+            yield {
+                'path': path,
+                'name': 'data/{0}'.format(os.path.relpath(path, basedir_name).replace(os.path.sep, '/')),
+            }
+
+
+class StreamingBundler(Bundler):
+    """
+    Streaming bundler class.
+
+    The tar stream of the bundle is yielded in chunks by
+    ``iter_chunks``, reading every file once and only when its turn
+    comes. The size of a file is read then, so a file still growing
+    (like the log of the upload) is bundled up to that size.
+
+    Files of at least ``compress_min_size`` bytes are compressed with
+    gzip and bundled with the ``.gz`` suffix, unless they are compressed
+    already; ``None`` compresses no file. A compressed file is spooled
+    in memory up to ``COMPRESS_SPOOL_SIZE_`` bytes, then on disk. The
+    SHA-256 hash sums of the original files are bundled in the
+    ``manifest.sha256`` file, in the format of ``sha256sum``.
+    """
+
+    # pylint: disable=too-many-arguments
+    def __init__(self, md_obj: MetaData, file_data: typing.Iterable[typing.Dict[str, typing.Any]],
+                 compress_min_size: typing.Optional[int] = None, chunk_size: int = UPLOAD_CHUNK_SIZE_,
+                 **kwargs: typing.Any) -> None:
+        """Save the metadata, the files to bundle and the compression settings."""
+        super(StreamingBundler, self).__init__(md_obj, file_data, **kwargs)
+
+        self.compress_min_size = compress_min_size
+        self.chunk_size = chunk_size
+    # pylint: enable=too-many-arguments
+
+    def _should_compress(self, name: str, size: int) -> bool:
+        """Return true if the file is compressed in the bundle."""
+        if (self.compress_min_size is None) or (size < self.compress_min_size):
+            return False
+        return not name.lower().endswith(COMPRESSED_FILE_SUFFIXES_)
+
+    def _iter_member(self, tarinfo: tarfile.TarInfo, fileobj: typing.BinaryIO,
+                     hashvals: typing.List[typing.Any]) -> typing.Generator[bytes, None, None]:
+        """Yield the header and the content of a member of the tar stream, updating the hashes."""
+        yield tarinfo.tobuf(tarfile.DEFAULT_FORMAT, tarfile.ENCODING, 'surrogateescape')
+        remaining = tarinfo.size
+        while remaining:
+            buf = fileobj.read(min(self.chunk_size, remaining))
+            if not buf:
+                raise OSError('file {0} is shorter than {1} bytes'.format(tarinfo.name, tarinfo.size))
+            for hashval in hashvals:
+                hashval.update(buf)
+            self._done_size += len(buf)
+            remaining -= len(buf)
+            yield buf
+        if tarinfo.size % tarfile.BLOCKSIZE:
+            yield tarfile.NUL * (tarfile.BLOCKSIZE - (tarinfo.size % tarfile.BLOCKSIZE))
+
+    def _iter_file(self, file_data: typing.Dict[str, typing.Any],
+                   manifest_lines: typing.List[str]) -> typing.Generator[bytes, None, None]:
+        """Yield a file of the bundle, compressed if it should be, adding it to the metadata and the manifest."""
+        orig_path_st = os.stat(file_data['path'])
+        manifest_hashval = hashlib.sha256()
+        hashval = self._hashfunc()
+        file_info = dict(file_data, size=orig_path_st.st_size, mtime=orig_path_st.st_mtime)
+        with open(file_data['path'], mode='rb') as orig_file:
+            if self._should_compress(file_data['name'], orig_path_st.st_size):
+                with tempfile.SpooledTemporaryFile(max_size=COMPRESS_SPOOL_SIZE_) as spool_file:
+                    with gzip.GzipFile(fileobj=spool_file, mode='wb', mtime=int(orig_path_st.st_mtime)) as gzip_file:
+                        remaining = orig_path_st.st_size
+                        for buf in iter(lambda: orig_file.read(min(self.chunk_size, remaining)), b''):
+                            manifest_hashval.update(buf)
+                            gzip_file.write(buf)
+                            remaining -= len(buf)
+                    file_info.update(name='{0}.gz'.format(file_data['name']), size=spool_file.tell())
+                    spool_file.seek(0)
+                    yield from self._iter_member(self._to_tarinfo(file_info), spool_file, [hashval])
+                self.md_obj.append(self._build_file_info(file_info, hashval.hexdigest())._replace(
+                    mimetype=COMPRESSED_MIME_TYPE_))
+            else:
+                yield from self._iter_member(self._to_tarinfo(file_info), orig_file, [hashval, manifest_hashval])
+                self.md_obj.append(self._build_file_info(file_info, hashval.hexdigest()))
+        manifest_lines.append('{0}  {1}\n'.format(
+            manifest_hashval.hexdigest(), self._strip_subdir(file_data['name'])))
+
+    @staticmethod
+    def _to_tarinfo(file_info: typing.Dict[str, typing.Any]) -> tarfile.TarInfo:
+        """Return the tar header of a file of the bundle."""
+        tarinfo = tarfile.TarInfo(file_info['name'])
+        tarinfo.size = file_info['size']
+        tarinfo.mtime = file_info['mtime']
+        return tarinfo
+
+    def _iter_bytes(self, name: str, data: bytes) -> typing.Generator[bytes, None, str]:
+        """Yield a file of the bundle generated in memory, returning its hash sum."""
+        tarinfo = tarfile.TarInfo(name)
+        tarinfo.size = len(data)
+        tarinfo.mtime = time.time()
+        hashval = self._hashfunc()
+        yield from self._iter_member(tarinfo, _BytesReader(data), [hashval])
+        return hashval.hexdigest()
+
+    def _iter_tar(self) -> typing.Generator[bytes, None, None]:
+        """Yield the members of the tar stream, the files, the manifest and the metadata."""
+        manifest_lines = []
+        for file_data in self.file_data:
+            yield from self._iter_file(file_data, manifest_lines)
+        manifest_name = 'data/{0}'.format(MANIFEST_FILE_NAME_)
+        manifest_data = ''.join(manifest_lines).encode('utf-8')
+        hashsum = yield from self._iter_bytes(manifest_name, manifest_data)
+        self.md_obj.append(self._build_file_info(
+            {'name': manifest_name, 'size': len(manifest_data), 'mtime': time.time()}, hashsum))
+        yield from self._iter_bytes('metadata.txt', bytes(metadata_encode(self.md_obj), 'utf8'))
+        yield tarfile.NUL * (tarfile.BLOCKSIZE * 2)
+
+    def iter_chunks(self) -> typing.Generator[bytes, None, None]:
+        """Yield the tar stream of the bundle, padded to the tar record size."""
+        offset = 0
+        for buf in self._iter_tar():
+            offset += len(buf)
+            yield buf
+        if offset % tarfile.RECORDSIZE:
+            yield tarfile.NUL * (tarfile.RECORDSIZE - (offset % tarfile.RECORDSIZE))
+        self._complete = True
+
+
+class _BytesReader:
+    """Reader of bytes in memory, without copying them."""
+
+    def __init__(self, data: bytes) -> None:
+        """Save a view of the bytes."""
+        super(_BytesReader, self).__init__()
+
+        self._data = memoryview(data)
+
+    def read(self, size: int) -> bytes:
+        """Return the next bytes, at most ``size``."""
+        (buf, self._data) = (self._data[:size], self._data[size:])
+        return bytes(buf)
+
+
+class StreamingUploaderRunner(UploaderRunner):
+    """
+    Streaming upload runner class.
+
+    The bundle is sent to the Pacifica Ingest service with chunked
+    transfer encoding, generated by a ``StreamingBundler`` while it is
+    sent, so its size is not known up front.
+    """
+
+    def __init__(self, uploader: Uploader, compress_min_size: typing.Optional[int] = None,
+                 chunk_size: int = UPLOAD_CHUNK_SIZE_) -> None:
+        """Save the uploader class instance and the compression settings."""
+        super(StreamingUploaderRunner, self).__init__()
+
+        self.uploader = uploader
+        self.compress_min_size = compress_min_size
+        self.chunk_size = chunk_size
+
+    # pylint: disable=line-too-long
+    def upload(self, basedir_name: str, transaction: Transaction = None,
+               transaction_key_values: typing.List[TransactionKeyValue] = None,
+               timeout: int = 180) -> typing.Tuple[Bundler, int, typing.Dict[str, typing.Any]]:
+        """Stream the bundle of the directory to Pacifica."""
+        if transaction_key_values is None:
+            transaction_key_values = []
+        bundler = StreamingBundler(
+            _to_meta_data(transaction=transaction, transaction_key_values=transaction_key_values),
+            walk_file_data(basedir_name), compress_min_size=self.compress_min_size, chunk_size=self.chunk_size
+        )
+
+        job_id = self.uploader.upload(bundler.iter_chunks())
+
+        state = self.uploader.getstate(job_id)
+
+        while timeout and _should_sleep(**state):
+            time.sleep(1)
+            timeout -= 1
+            state = self.uploader.getstate(job_id)
+
+        return (bundler, job_id, state)
+    # pylint: enable=line-too-long
+
+
+__all__ = ('walk_file_data', 'StreamingBundler', 'StreamingUploaderRunner', )
@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# pacifica-dispatcher-proxymod: pacifica/dispatcher_proxymod/usage.py
+#
+# Copyright (c) 2019, Battelle Memorial Institute
+# All rights reserved.
+#
+# See LICENSE and WARRANTY for details.
+"""
+Resource usage module.
+
+This module measures the resources used by a model run: its wall time,
+the CPU time of the process (or thread) running the model function and
+of the subprocesses it waited for, the peak resident set size of the
+process and the bytes of the files it wrote to its output directories.
+
+The event handler collects the usage of a model run in a context, and
+the model runner running the model function adds the CPU time and peak
+memory it measured to the usage of the current context, if any.
+"""
+import contextlib
+import contextvars
+import os
+import time
+import typing
+
+try:
+    import resource
+except ImportError:  # pragma: no cover no resource on windows
+    resource = None
+
+PROC_STATUS_FILE_NAME_ = '/proc/self/status'
+
+PROC_CLEAR_REFS_FILE_NAME_ = '/proc/self/clear_refs'
+
+# NOTE Writing 5 to clear_refs resets the peak resident set size of the process (Linux 4.0 and later).
+PROC_CLEAR_REFS_PEAK_RSS_ = '5'
+
+_CURRENT_USAGE_ = contextvars.ContextVar('proxymod_usage', default=None)
+
+
+class ModelUsage(typing.NamedTuple):
+    """Resources used by a model run, ``None`` for the resources that were not measured."""
+
+    wall_seconds: float = 0.0
+    cpu_seconds: typing.Optional[float] = None
+    peak_rss_bytes: typing.Optional[int] = None
+    written_bytes: typing.Optional[int] = None
+
+
+def _reset_peak_rss() -> None:
+    """Reset the peak resident set size of the process, if the platform can."""
+    try:
+        with open(PROC_CLEAR_REFS_FILE_NAME_, 'w') as clear_refs_file:
+            clear_refs_file.write(PROC_CLEAR_REFS_PEAK_RSS_)
+    except OSError:
+        pass
+
+
+def _peak_rss() -> typing.Optional[int]:
+    """Return the peak resident set size of the process in bytes."""
+    try:
+        with open(PROC_STATUS_FILE_NAME_) as status_file:
+            for line in status_file:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    if resource is None:  # pragma: no cover no resource on windows
+        return None
+    # NOTE The peak since the process started, in kilobytes on Linux.
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _cpu_seconds(per_thread: bool) -> typing.Optional[float]:
+    """Return the CPU time of the thread, or of the process, and of its waited for subprocesses."""
+    if resource is None:  # pragma: no cover no resource on windows
+        return None
+    who = resource.RUSAGE_THREAD if per_thread and hasattr(resource, 'RUSAGE_THREAD') else resource.RUSAGE_SELF
+    return sum(
+        rusage.ru_utime + rusage.ru_stime
+        for rusage in [resource.getrusage(who), resource.getrusage(resource.RUSAGE_CHILDREN)]
+    )
+
+
+@contextlib.contextmanager
+def measure_process_usage(per_thread: bool = False) -> typing.Generator[typing.Dict[str, typing.Any], None, None]:
+    """
+    Measure the CPU time and peak memory of the code in the context.
+
+    The yielded dictionary gets the ``cpu_seconds`` and
+    ``peak_rss_bytes`` of the context when it exits, even if it raises.
+    With ``per_thread`` only the CPU time of the current thread is
+    counted, for model functions running in a thread of a process
+    running other code; the peak memory is always of the whole process.
+    """
+    values = {}
+    _reset_peak_rss()
+    start_cpu_seconds = _cpu_seconds(per_thread)
+    try:
+        yield values
+    finally:
+        end_cpu_seconds = _cpu_seconds(per_thread)
+        if (start_cpu_seconds is not None) and (end_cpu_seconds is not None):
+            values['cpu_seconds'] = end_cpu_seconds - start_cpu_seconds
+        values['peak_rss_bytes'] = _peak_rss()
+
+
+def record_usage(values: typing.Dict[str, typing.Any]) -> None:
+    """Add the measured values to the usage of the current context, if any."""
+    usage = _CURRENT_USAGE_.get()
+    if usage is not None:
+        usage.update((name, value) for name, value in values.items() if value is not None)
+
+
+def _snapshot(dir_names: typing.Iterable[str]) -> typing.Dict[str, typing.Tuple[int, int]]:
+    """Return the size and modification time of the files in the directories, by path."""
+    snapshot = {}
+    for dir_name in dir_names:
+        for walk_root, _walk_dirs, walk_names in os.walk(dir_name):
+            for walk_name in walk_names:
+                path = os.path.join(walk_root, walk_name)
+                try:
+                    path_st = os.stat(path)
+                except FileNotFoundError:  # pragma: no cover removed while walking
+                    continue
+                snapshot[path] = (path_st.st_size, path_st.st_mtime_ns)
+    return snapshot
+
+
+@contextlib.contextmanager
+def usage_context(out_dir_names: typing.Optional[typing.Iterable[str]] = ()
+                  ) -> typing.Generator[typing.Dict[str, typing.Any], None, None]:
+    """
+    Collect the usage of a model run in the context.
+
+    The yielded dictionary gets the ``wall_seconds`` of the context,
+    the values recorded by the model runner and the ``written_bytes``,
+    the size of the files created or changed in the output directories,
+    when the context exits, even if it raises. The ``written_bytes`` are
+    not measured if the output directories are ``None``, e.g. when other
+    model runs write to the same directories at the same time.
+    """
+    measure_written = out_dir_names is not None
+    out_dir_names = sorted(set(out_dir_names or ()))
+    usage = {}
+    before_snapshot = _snapshot(out_dir_names)
+    token = _CURRENT_USAGE_.set(usage)
+    start = time.perf_counter()
+    try:
+        yield usage
+    finally:
+        usage['wall_seconds'] = time.perf_counter() - start
+        _CURRENT_USAGE_.reset(token)
+        if measure_written:
+            usage['written_bytes'] = sum(
+                size for path, (size, mtime_ns) in _snapshot(out_dir_names).items()
+                if before_snapshot.get(path) != (size, mtime_ns)
+            )
+
+
+def to_model_usage(usage: typing.Dict[str, typing.Any]) -> ModelUsage:
+    """Return the model usage of the values collected in a usage context."""
+    return ModelUsage(**{name: usage[name] for name in ModelUsage._fields if name in usage})
+
+
+__all__ = ('ModelUsage', 'measure_process_usage', 'record_usage', 'usage_context', 'to_model_usage', )
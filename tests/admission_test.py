@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# pacifica-dispatcher-proxymod: tests/admission_test.py
+#
+# Copyright (c) 2019, Battelle Memorial Institute
+# All rights reserved.
+#
+# See LICENSE and WARRANTY for details.
+"""Module to test the admission control of the proxymod event handler."""
+import json
+import os
+import tempfile
+import unittest
+
+from cloudevents.model import Event
+from mock import MagicMock, patch
+
+from pacifica.dispatcher.downloader_runners import LocalDownloaderRunner
+from pacifica.dispatcher.models import File
+from pacifica.dispatcher.uploader_runners import LocalUploaderRunner
+
+from pacifica.dispatcher_proxymod.admission import AdmissionController, Footprint, HeadroomAdmissionController
+from pacifica.dispatcher_proxymod.event_handlers import ProxEventHandler
+from pacifica.dispatcher_proxymod.exceptions import AdmissionDeferredProxEventHandlerError
+from pacifica.dispatcher_proxymod.scratch import MemoryScratch, Scratch
+from pacifica.dispatcher_proxymod.timers import RecordingStageTimer
+
+
+class AdmissionTestCase(unittest.TestCase):
+    """Admission controller unittest class."""
+
+    def setUp(self):
+        """Create the download, memory and disk directories of the events."""
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tempdir.cleanup)
+        self.memory_dir_name = os.path.join(self.tempdir.name, 'memory')
+        self.disk_dir_name = os.path.join(self.tempdir.name, 'disk')
+        os.makedirs(self.disk_dir_name)
+
+    def test_estimate(self):
+        """Test the footprint is the size of the files and of the inputs times the multipliers of the models."""
+        admission_controller = AdmissionController(2.0, {'model_two': 0.5})
+        footprint = admission_controller.estimate(
+            ['model_one', 'model_two'], [File(name='model_one.py', size=10), File(name='model_two.py', size=20)],
+            [File(name='in_file_one.csv', size=100), File(name='in_file_two.csv')], 3)
+        self.assertEqual(Footprint(130, 750), footprint)
+        self.assertEqual({}, admission_controller.reserve(None, footprint))
+
+    def test_reserve(self):
+        """Test the events are deferred while the reserved footprints leave too little disk free."""
+        admission_controller = HeadroomAdmissionController(
+            Scratch(self.disk_dir_name), self.tempdir.name, min_free_disk=100)
+        with patch('pacifica.dispatcher_proxymod.admission.shutil.disk_usage', return_value=MagicMock(free=1000)):
+            reservation = admission_controller.reserve(None, Footprint(200, 300))
+            with self.assertRaises(AdmissionDeferredProxEventHandlerError) as context:
+                admission_controller.reserve(None, Footprint(300, 200))
+            self.assertEqual(('disk', 500, 400), (
+                context.exception.resource, context.exception.required_size, context.exception.free_size))
+            admission_controller.release(reservation)
+            admission_controller.reserve(None, Footprint(300, 200))
+
+    def test_reserve_memory(self):
+        """Test the results in the memory scratch are deferred if the available memory is too low, unless they spill."""
+        scratch = MemoryScratch(self.memory_dir_name, max_size=2000, disk_dir_name=self.disk_dir_name)
+        admission_controller = HeadroomAdmissionController(scratch, self.tempdir.name, min_free_memory=100)
+        with patch('pacifica.dispatcher_proxymod.admission._mem_available', return_value=500):
+            with self.assertRaises(AdmissionDeferredProxEventHandlerError) as context:
+                admission_controller.reserve(None, Footprint(0, 1000))
+            self.assertEqual(('memory', 1000, 400), (
+                context.exception.resource, context.exception.required_size, context.exception.free_size))
+            with scratch.directory(size=1500):
+                admission_controller.reserve(None, Footprint(0, 1000))
+
+    def test_event_handler(self):
+        """Test the events without the headroom are deferred before their files are downloaded."""
+        basedir_name = os.path.abspath(os.path.join('test_files', 'C234-1234-1234'))
+        with open(os.path.join(basedir_name, 'event.json'), mode='r') as event_file:
+            event_data = json.load(event_file)
+        downloader_runner = MagicMock(wraps=LocalDownloaderRunner(os.path.join(basedir_name, 'data')))
+        admission_controller = HeadroomAdmissionController(output_multiplier=1.0)
+        stage_timer = RecordingStageTimer()
+        event_handler = ProxEventHandler(
+            downloader_runner, LocalUploaderRunner(), MagicMock(concurrency=1), stage_timer=stage_timer,
+            admission_controller=admission_controller)
+        with patch.object(admission_controller, '_free_size', return_value=10000):
+            reasons = event_handler.handle_many([Event(event_data), Event(event_data)])
+            self.assertEqual([None, AdmissionDeferredProxEventHandlerError], [
+                type(reason) if reason is not None else None for reason in reasons])
+            self.assertEqual('proxymod event needs 6655 bytes of disk, 3345 bytes are free', str(reasons[1]))
+            self.assertEqual(1, downloader_runner.download.call_count)
+            event_handler.handle(Event(event_data))
+        with patch.object(admission_controller, '_free_size', return_value=1000):
+            with self.assertRaises(AdmissionDeferredProxEventHandlerError):
+                event_handler.handle(Event(event_data))
+        self.assertEqual(3, downloader_runner.download.call_count)
+        self.assertEqual({'': 2, 'disk': 2}, stage_timer.admissions)
+        self.assertEqual({'': 2, 'AdmissionDeferredProxEventHandlerError': 2}, stage_timer.outcomes)
+
+
+if __name__ == '__main__':
+    unittest.main()
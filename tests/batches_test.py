@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# pacifica-dispatcher-proxymod: tests/batches_test.py
+#
+# Copyright (c) 2019, Battelle Memorial Institute
+# All rights reserved.
+#
+# See LICENSE and WARRANTY for details.
+"""Module to test handling batches of proxymod events."""
+import copy
+import io
+import json
+import os
+import tempfile
+import unittest
+import uuid
+import wsgiref.util
+
+import cherrypy
+import peewee
+from cloudevents.model import Event
+from mock import MagicMock, patch
+
+from pacifica.dispatcher.downloader_runners import LocalDownloaderRunner
+from pacifica.dispatcher.receiver import create_peewee_model
+from pacifica.dispatcher.router import Router
+from pacifica.dispatcher.uploader_runners import LocalUploaderRunner
+
+from pacifica.dispatcher_proxymod.batches import create_defer_event, create_receive_batch_task
+from pacifica.dispatcher_proxymod.batches import create_receive_bulk_app
+from pacifica.dispatcher_proxymod.batches import parse_events_data, to_batch_task_ids, to_receive_task_row
+from pacifica.dispatcher_proxymod.event_handlers import ProxEventHandler
+from pacifica.dispatcher_proxymod.exceptions import AdmissionDeferredProxEventHandlerError
+from pacifica.dispatcher_proxymod.exceptions import ConfigNotFoundProxEventHandlerError
+from pacifica.dispatcher_proxymod.timers import RecordingStageTimer
+
+
+def _to_path(event_type):
+    """Return a path matching the events of the type."""
+    path = MagicMock()
+    path.match.side_effect = lambda event_data: [event_data] if event_data.get('eventType') == event_type else []
+    return path
+
+
+def _handle(event):
+    """Fail to handle the fourth event."""
+    if event.event_id == 'four':
+        raise ConfigNotFoundProxEventHandlerError(event, 'config_1')
+
+
+def _defer(event):
+    """Defer the third event."""
+    if event.event_id == 'three':
+        raise AdmissionDeferredProxEventHandlerError(event, 'disk', 2048, 1024)
+
+
+def _to_event_data(event_type, event_id):
+    """Return the data of an event without files."""
+    return {
+        'cloudEventsVersion': '0.1', 'eventType': event_type, 'eventID': event_id, 'source': '/test', 'data': [],
+    }
+
+
+class HandleManyTestCase(unittest.TestCase):
+    """Batch event handler unittest class."""
+
+    def setUp(self):
+        """Create the event handler downloading and uploading the test files."""
+        self.basedir_name = os.path.abspath(os.path.join('test_files', 'C234-1234-1234'))
+        with open(os.path.join(self.basedir_name, 'event.json'), mode='r') as event_file:
+            self.event_data = json.load(event_file)
+        self.downloader_runner = MagicMock(wraps=LocalDownloaderRunner(os.path.join(self.basedir_name, 'data')))
+        self.uploader_runner = MagicMock(wraps=LocalUploaderRunner())
+        self.stage_timer = RecordingStageTimer()
+        self.event_handler = ProxEventHandler(
+            self.downloader_runner, self.uploader_runner, MagicMock(concurrency=1), stage_timer=self.stage_timer)
+
+    def test_handle_many(self):
+        """Test the files of the events are downloaded once and every event is uploaded or fails on its own."""
+        bad_event_data = copy.deepcopy(self.event_data)
+        bad_event_data['data'] = [
+            item for item in bad_event_data['data'] if not item.get('key', '').startswith('proxymod.config_')
+        ]
+        reasons = self.event_handler.handle_many([
+            Event(self.event_data), Event(bad_event_data), Event(self.event_data)])
+        self.assertEqual([None, ConfigNotFoundProxEventHandlerError, None], [
+            type(reason) if reason is not None else None for reason in reasons])
+        self.assertEqual(1, self.downloader_runner.download.call_count)
+        self.assertEqual(2, self.uploader_runner.upload.call_count)
+        self.assertEqual({'': 2, 'ConfigNotFoundProxEventHandlerError': 1}, self.stage_timer.outcomes)
+        self.assertEqual(1, len(self.stage_timer.durations['download']))
+
+    def test_handle_many_same_path(self):
+        """Test distinct files with the same path are downloaded to distinct directories."""
+        other_event_data = copy.deepcopy(self.event_data)
+        for item in other_event_data['data']:
+            if item['destinationTable'] == 'Files':
+                item['_id'] = item['_id'] + 1000
+        reasons = self.event_handler.handle_many([Event(self.event_data), Event(other_event_data)])
+        self.assertEqual([None, None], reasons)
+        self.assertEqual(2, self.downloader_runner.download.call_count)
+        self.assertNotEqual(*[call[0][0] for call in self.downloader_runner.download.call_args_list])
+
+    def test_handle_many_download_error(self):
+        """Test every event gets its own error if the files can not be downloaded."""
+        self.downloader_runner.download.side_effect = OSError('no files')
+        reasons = self.event_handler.handle_many([Event(self.event_data), Event(self.event_data)])
+        self.assertEqual([OSError, OSError], [type(reason) for reason in reasons])
+        self.assertEqual(5, self.downloader_runner.download.call_count)
+        self.uploader_runner.upload.assert_not_called()
+        self.assertEqual({'OSError': 2}, self.stage_timer.outcomes)
+        self.assertEqual([], self.event_handler.handle_many([]))
+
+
+class ReceiveBatchTaskTestCase(unittest.TestCase):
+    """Batch Celery task unittest class."""
+
+    def setUp(self):
+        """Create the receiver table in a temporary database and the batch task."""
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tempdir.cleanup)
+        database = peewee.SqliteDatabase(os.path.join(self.tempdir.name, 'db.sqlite3'))
+        self.receive_task_model = create_peewee_model(database)
+        self.receive_task_model.create_table(safe=True)
+        database.close()
+        self.many_event_handler = MagicMock()
+        self.many_event_handler.handle_many.side_effect = lambda events: [
+            ValueError('bad') if event.event_id == 'two' else None for event in events]
+        self.event_handler = MagicMock(spec=['handle'])
+        self.event_handler.handle.side_effect = _handle
+        router = Router()
+        router.add_route(_to_path('many'), self.many_event_handler)
+        router.add_route(_to_path('one'), self.event_handler)
+        celery_app = self.receive_task_model.create_celery_app(
+            router, 'app', 'receive', broker='memory://', backend='cache+memory://')
+        self.receive_batch_task = create_receive_batch_task(self.receive_task_model, celery_app, router,
+                                                            'receive_batch')
+        self.events_data = [
+            _to_event_data('many', 'one'),
+            _to_event_data('many', 'two'),
+            _to_event_data('one', 'three'),
+            _to_event_data('one', 'four'),
+            _to_event_data('none', 'five'),
+        ]
+
+    def _statuses(self, task_ids):
+        """Return the status and exception class of the tasks."""
+        insts = {str(inst.task_id): inst for inst in self.receive_task_model.select()}
+        return [(insts[task_id].task_status, insts[task_id].exc_type) for task_id in task_ids]
+
+    def test_receive_batch(self):
+        """Test the events are saved and handled together by route, each with its own status."""
+        result = self.receive_batch_task.apply(args=(self.events_data, ))
+        self.assertEqual([
+            ('200 OK', None),
+            ('500 Internal Server Error', 'ValueError'),
+            ('200 OK', None),
+            ('500 Internal Server Error', 'ConfigNotFoundProxEventHandlerError'),
+            ('422 Unprocessable Entity', 'RouteNotFoundRouterError'),
+        ], self._statuses(to_batch_task_ids(result.id, len(self.events_data))))
+        self.assertEqual(1, self.many_event_handler.handle_many.call_count)
+        self.assertEqual(2, self.event_handler.handle.call_count)
+
+    def test_receive_batch_saved(self):
+        """Test the events saved before are handled with their task identifiers."""
+        task_ids = to_batch_task_ids(str(uuid.uuid4()), len(self.events_data))
+        # pylint: disable=no-value-for-parameter
+        self.receive_task_model.insert_many([
+            to_receive_task_row(event_data, task_id, 'app', 'receive_batch')
+            for event_data, task_id in zip(self.events_data, task_ids)
+        ]).execute()
+        # pylint: enable=no-value-for-parameter
+        self.receive_batch_task.apply(args=(self.events_data, task_ids))
+        self.assertEqual(['200 OK', '500 Internal Server Error', '200 OK', '500 Internal Server Error',
+                          '422 Unprocessable Entity'], [status for status, _ in self._statuses(task_ids)])
+
+    def test_receive_batch_deferred(self):
+        """Test the deferred events are accepted again and sent to the task later, until they fail."""
+        self.event_handler.handle.side_effect = _defer
+        with patch.object(self.receive_batch_task, 'apply_async') as apply_async:
+            result = self.receive_batch_task.apply(args=(self.events_data[2:4], ))
+        task_ids = to_batch_task_ids(result.id, 2)
+        self.assertEqual([('202 Accepted', 'AdmissionDeferredProxEventHandlerError'), ('200 OK', None)],
+                         self._statuses(task_ids))
+        self.assertEqual(([self.events_data[2]], task_ids[:1]), apply_async.call_args[1]['args'])
+        self.assertEqual({'deferrals': 1}, apply_async.call_args[1]['kwargs'])
+        self.assertTrue(30.0 <= apply_async.call_args[1]['countdown'] <= 60.0)
+        self.receive_batch_task.apply(args=apply_async.call_args[1]['args'], kwargs={'deferrals': 20})
+        self.assertEqual([('500 Internal Server Error', 'AdmissionDeferredProxEventHandlerError'), ('200 OK', None)],
+                         self._statuses(task_ids))
+
+    def test_defer_event(self):
+        """Test an event deferred in a task is sent to the batch task with the identifier of the task."""
+        defer_event = create_defer_event(self.receive_batch_task, 10.0)
+        reason = AdmissionDeferredProxEventHandlerError(None, 'disk', 2048, 1024)
+        with self.assertRaises(AdmissionDeferredProxEventHandlerError):
+            defer_event(self.events_data[2], reason)
+        with patch('celery.current_task', MagicMock(request=MagicMock(id='abc'))), \
+                patch.object(self.receive_batch_task, 'apply_async') as apply_async:
+            defer_event(self.events_data[2], reason)
+        self.assertEqual(([self.events_data[2]], ['abc']), apply_async.call_args[1]['args'])
+        self.assertTrue(10.0 <= apply_async.call_args[1]['countdown'] <= 20.0)
+
+
+class ReceiveBulkTestCase(unittest.TestCase):
+    """Bulk CherryPy endpoint unittest class."""
+
+    def setUp(self):
+        """Create the receiver table in a temporary database and the bulk endpoint."""
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tempdir.cleanup)
+        database = peewee.SqliteDatabase(os.path.join(self.tempdir.name, 'db.sqlite3'))
+        self.receive_task_model = create_peewee_model(database)
+        self.receive_task_model.create_table(safe=True)
+        database.close()
+        celery_app = self.receive_task_model.create_celery_app(
+            Router(), 'app', 'receive', broker='memory://', backend='cache+memory://')
+        self.receive_batch_task = create_receive_batch_task(self.receive_task_model, celery_app, Router(),
+                                                            'receive_batch')
+        self.application = cherrypy.Application(
+            create_receive_bulk_app(self.receive_task_model, self.receive_batch_task,
+                                    lambda event_data: event_data.get('eventType') == 'one'),
+            '/', config={'/': {'request.dispatch': cherrypy.dispatch.MethodDispatcher()}})
+
+    def _post(self, body, content_type):
+        """Post the body to the bulk endpoint, returning the status and the response."""
+        environ = {
+            'REQUEST_METHOD': 'POST', 'CONTENT_TYPE': content_type, 'CONTENT_LENGTH': str(len(body)),
+            'wsgi.input': io.BytesIO(body),
+        }
+        wsgiref.util.setup_testing_defaults(environ)
+        statuses = []
+        response = self.application(environ, lambda status, headers, exc_info=None: statuses.append(status))
+        return statuses[0], b''.join(response)
+
+    def test_receive_bulk(self):
+        """Test the events are saved in one request and the matching events are sent in one message."""
+        events_data = [_to_event_data('one', str(index)) for index in range(120)] + [_to_event_data('none', 'x')]
+        with patch.object(self.receive_batch_task, 'apply_async') as apply_async:
+            status, response = self._post(json.dumps(events_data).encode('utf-8'), 'application/json')
+        self.assertEqual('200 OK', status)
+        task_ids = json.loads(response.decode('utf-8'))
+        self.assertEqual(121, len(task_ids))
+        apply_async.assert_called_once()
+        self.assertEqual((events_data[:120], task_ids[:120]), apply_async.call_args[1]['args'])
+        self.assertEqual(task_ids, to_batch_task_ids(apply_async.call_args[1]['task_id'], 121))
+        statuses = {str(inst.task_id): inst.task_status for inst in self.receive_task_model.select()}
+        self.assertEqual(['202 Accepted'] * 120 + ['422 Unprocessable Entity'], [
+            statuses[task_id] for task_id in task_ids])
+
+    def test_receive_bulk_ndjson(self):
+        """Test newline delimited events are received and no message is sent without matching events."""
+        body = '\n'.join(json.dumps(_to_event_data('none', str(index))) for index in range(2)).encode('utf-8')
+        with patch.object(self.receive_batch_task, 'apply_async') as apply_async:
+            status, response = self._post(body, 'application/x-ndjson')
+        self.assertEqual('200 OK', status)
+        self.assertEqual(2, len(json.loads(response.decode('utf-8'))))
+        apply_async.assert_not_called()
+        status, _response = self._post(b'{"eventType": "one"}', 'application/json')
+        self.assertTrue(status.startswith('400'))
+
+    def test_parse_events_data(self):
+        """Test the bodies that are not lists of events are rejected."""
+        self.assertEqual([{}], parse_events_data(b'\n{}\n', 'application/x-ndjson; charset=utf-8'))
+        self.assertEqual([], parse_events_data(b'[]'))
+        for body in [b'{}', b'[1]', b'[']:
+            with self.assertRaises(ValueError):
+                parse_events_data(body)
+
+
+if __name__ == '__main__':
+    unittest.main()
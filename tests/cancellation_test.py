@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# pacifica-dispatcher-proxymod: tests/cancellation_test.py
+#
+# Copyright (c) 2019, Battelle Memorial Institute
+# All rights reserved.
+#
+# See LICENSE and WARRANTY for details.
+"""Module to test the time budgets and the cancellation of the proxymod events."""
+import json
+import os
+import time
+import unittest
+
+from cloudevents.model import Event
+from mock import MagicMock
+
+from pacifica.dispatcher.downloader_runners import LocalDownloaderRunner
+
+from pacifica.dispatcher_proxymod.cancellation import CancelToken, ModelCancelledError, ModelTimeoutError
+from pacifica.dispatcher_proxymod.cancellation import cancel_token_context, current_cancel_token
+from pacifica.dispatcher_proxymod.event_handlers import ProxEventHandler
+from pacifica.dispatcher_proxymod.exceptions import CancelledProxEventHandlerError
+from pacifica.dispatcher_proxymod.exceptions import InvalidKeyValueProxEventHandlerError, TimeoutProxEventHandlerError
+from pacifica.dispatcher_proxymod.result_cache import walk_file_names
+
+
+class CancellationTestCase(unittest.TestCase):
+    """Cancellation unittest class."""
+
+    def setUp(self):
+        """Load the event and record the uploads of the event handler."""
+        self.basedir_name = os.path.abspath(os.path.join('test_files', 'C234-1234-1234'))
+        with open(os.path.join(self.basedir_name, 'event.json'), mode='r') as event_file:
+            self.event_data = json.load(event_file)
+        self.uploads = []
+
+        def upload(dir_name, **kwargs):
+            """Record the uploaded files and the transaction key values."""
+            self.uploads.append((walk_file_names(dir_name), {
+                transaction_key_value.key: transaction_key_value.value
+                for transaction_key_value in kwargs['transaction_key_values']
+            }))
+            return (None, None, None)
+
+        self.uploader_runner = MagicMock(upload=MagicMock(side_effect=upload))
+
+    def _create_event(self, **value_by_key):
+        """Return the event with more transaction key values."""
+        event_data = json.loads(json.dumps(self.event_data))
+        event_data['data'].extend([
+            {'destinationTable': 'TransactionKeyValue', 'key': key, 'value': value}
+            for key, value in value_by_key.items()
+        ])
+        return Event(event_data)
+
+    def _create_event_handler(self, run, downloader_runner=None, **kwargs):
+        """Return an event handler running the models with the function."""
+        return ProxEventHandler(
+            downloader_runner if downloader_runner is not None else LocalDownloaderRunner(
+                os.path.join(self.basedir_name, 'data')), self.uploader_runner,
+            MagicMock(concurrency=1, run=MagicMock(side_effect=run)), **kwargs)
+
+    def test_cancel_token(self):
+        """Test the cancel token keeps the first reason and runs out of time."""
+        cancel_token = CancelToken(0.1)
+        self.assertFalse(cancel_token.cancelled)
+        self.assertLess(0, cancel_token.remaining())
+        cancel_token.cancel('first')
+        cancel_token.cancel('second')
+        self.assertTrue(cancel_token.cancelled)
+        self.assertEqual('first', cancel_token.reason)
+        time.sleep(0.1)
+        self.assertEqual(0, cancel_token.remaining())
+        self.assertIsNone(CancelToken().remaining())
+        self.assertFalse(current_cancel_token().cancelled)
+        with cancel_token_context(cancel_token):
+            self.assertIs(cancel_token, current_cancel_token())
+
+    def test_timeouts(self):
+        """Test the time budgets of the event and of the models are capped by the maximums."""
+        timeouts = []
+
+        def run(_model, _args, _log_dir_name, **kwargs):
+            """Record the time budget of the model run."""
+            timeouts.append(kwargs['timeout'])
+
+        event_handler = self._create_event_handler(run, max_event_timeout=10, max_model_timeout=5)
+        event_handler.handle(self._create_event(**{
+            'proxymod.timeout': '100', 'proxymod.timeout.loose_coupling': '50',
+            'proxymod.timeout.tight_coupling_twoway.py': '0.5', 'proxymod.timeout.other_model': 'soon',
+        }))
+        self.assertLess(1, len(timeouts))
+        self.assertEqual(0.5, timeouts[1])
+        for timeout in timeouts[:1] + timeouts[2:]:
+            self.assertLess(4, timeout)
+            self.assertGreaterEqual(5, timeout)
+        with self.assertRaises(InvalidKeyValueProxEventHandlerError) as context:
+            event_handler.handle(self._create_event(**{'proxymod.timeout.loose_coupling': 'soon'}))
+        self.assertEqual(
+            'proxymod transaction key value \'proxymod.timeout.loose_coupling\' = \'soon\' is invalid: '
+            'could not convert string to float: \'soon\'', str(context.exception))
+        with self.assertRaises(InvalidKeyValueProxEventHandlerError) as context:
+            event_handler.handle(self._create_event(**{'proxymod.timeout.loose_coupling.py': 'soon'}))
+        self.assertEqual('proxymod.timeout.loose_coupling.py', context.exception.key)
+        with self.assertRaises(InvalidKeyValueProxEventHandlerError) as context:
+            event_handler.handle(self._create_event(**{'proxymod.timeout': '-1'}))
+        self.assertEqual('proxymod.timeout', context.exception.key)
+
+    def test_timeout_download(self):
+        """Test the time budget of the event counts its download."""
+        local_downloader_runner = LocalDownloaderRunner(os.path.join(self.basedir_name, 'data'))
+
+        def download(*args):
+            """Download slowly."""
+            time.sleep(0.3)
+            return local_downloader_runner.download(*args)
+
+        event_handler = self._create_event_handler(
+            None, MagicMock(download=MagicMock(side_effect=download)), max_event_timeout=0.2)
+        with self.assertRaises(TimeoutProxEventHandlerError) as context:
+            event_handler.handle(self._create_event())
+        self.assertEqual('proxymod event did not finish within 0.2 seconds', str(context.exception))
+        event_handler.model_runner.run.assert_not_called()
+
+    def test_timeout_uploads_logs(self):
+        """Test the partial logs of a model out of time are uploaded with the reason."""
+        def run(_model, _args, log_dir_name, **_kwargs):
+            """Write to the log of the model then run out of time."""
+            with open(os.path.join(log_dir_name, 'stdout.log'), 'a') as log_file:
+                log_file.write('timestep 2010\n')
+            raise ModelTimeoutError('model did not finish within 5 seconds')
+
+        event_handler = self._create_event_handler(run, max_model_timeout=5)
+        with self.assertRaises(TimeoutProxEventHandlerError) as context:
+            event_handler.handle(self._create_event())
+        self.assertEqual(
+            'proxymod model for file \'models/loose_coupling.py\' did not finish within 5 seconds',
+            str(context.exception))
+        self.assertEqual(1, len(self.uploads))
+        (file_names, value_by_key) = self.uploads[0]
+        self.assertIn('stdout.log', file_names)
+        self.assertIn('download-stdout.log', file_names)
+        self.assertFalse([file_name for file_name in file_names if not file_name.endswith('.log')])
+        self.assertEqual(str(context.exception), value_by_key['proxymod.cancelled'])
+
+    def test_cancel(self):
+        """Test the running events are cancelled with the reason and their logs uploaded."""
+        cancelled_counts = []
+
+        def run(_model, _args, _log_dir_name, **_kwargs):
+            """Cancel the running events then stop as the model runner would."""
+            cancelled_counts.append(event_handler.cancel('revoked with signal 15'))
+            raise ModelCancelledError('model run cancelled')
+
+        event_handler = self._create_event_handler(run)
+        with self.assertRaises(CancelledProxEventHandlerError) as context:
+            event_handler.handle(self._create_event())
+        self.assertEqual('proxymod event cancelled: revoked with signal 15', str(context.exception))
+        self.assertEqual([1], cancelled_counts)
+        self.assertEqual(1, event_handler.model_runner.cancel.call_count)
+        self.assertEqual('proxymod event cancelled: revoked with signal 15',
+                         self.uploads[0][1]['proxymod.cancelled'])
+        self.assertEqual(0, event_handler.cancel('revoked with signal 15'))
+
+
+if __name__ == '__main__':
+    unittest.main()
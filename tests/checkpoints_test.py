@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# pacifica-dispatcher-proxymod: tests/checkpoints_test.py
+#
+# Copyright (c) 2019, Battelle Memorial Institute
+# All rights reserved.
+#
+# See LICENSE and WARRANTY for details.
+"""Module to test the checkpoints of the proxymod model functions."""
+import configparser
+import functools
+import json
+import os
+import tempfile
+import time
+import unittest
+
+from cloudevents.model import Event
+from mock import MagicMock
+
+from pacifica.dispatcher.downloader_runners import LocalDownloaderRunner
+from pacifica.dispatcher.uploader_runners import LocalUploaderRunner
+
+from pacifica.dispatcher_proxymod.checkpoints import DirectoryCheckpoint, EventCheckpoints, current_checkpoint
+from pacifica.dispatcher_proxymod.checkpoints import prune_checkpoints
+from pacifica.dispatcher_proxymod.event_handlers import ProxEventHandler
+from pacifica.dispatcher_proxymod.exceptions import InvalidModelProxEventHandlerError
+from pacifica.dispatcher_proxymod.model_runners import LocalModelRunner
+from pacifica.dispatcher_proxymod.result_cache import walk_file_names
+
+
+class CheckpointTestCase(unittest.TestCase):
+    """Checkpoint unittest class."""
+
+    def setUp(self):
+        """Create the directories of the results and of the checkpoints."""
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tempdir.cleanup)
+        self.basedir_name = os.path.join(self.tempdir.name, 'results')
+        self.checkpoint_dir_name = os.path.join(self.tempdir.name, 'checkpoints')
+        os.makedirs(os.path.join(self.basedir_name, 'outputs'))
+
+    def _write(self, file_name, content):
+        """Write a result file."""
+        with open(os.path.join(self.basedir_name, file_name), 'w') as result_file:
+            result_file.write(content)
+
+    def test_no_checkpoint(self):
+        """Test the current checkpoint outside of a model run saves nothing."""
+        checkpoint = current_checkpoint()
+        checkpoint.save(2010)
+        self.assertIsNone(checkpoint.step)
+
+    def test_save_restore(self):
+        """Test the results of the last step are restored, without the logs and configurations."""
+        checkpoint = DirectoryCheckpoint(self.checkpoint_dir_name, self.basedir_name)
+        self.assertIsNone(checkpoint.step)
+        self.assertIsNone(checkpoint.restore())
+        self._write('config_1.ini', '[OUTPUTS]\n')
+        self._write('stdout.log', 'running\n')
+        self._write('outputs/2010.csv', '2010\n')
+        checkpoint.save(2010)
+        inode = os.stat(os.path.join(self.checkpoint_dir_name, '0', 'files', 'outputs', '2010.csv')).st_ino
+        self._write('outputs/2015.csv', '2015\n')
+        checkpoint.save(2015)
+        self.assertEqual(['1'], os.listdir(self.checkpoint_dir_name))
+        self.assertEqual(inode, os.stat(
+            os.path.join(self.checkpoint_dir_name, '1', 'files', 'outputs', '2010.csv')).st_ino)
+        self._write('outputs/2020.csv', '2020\n')
+
+        with tempfile.TemporaryDirectory() as basedir_name:
+            self.assertEqual(2015, DirectoryCheckpoint(self.checkpoint_dir_name, basedir_name).restore())
+            self.assertEqual(['outputs/2010.csv', 'outputs/2015.csv'], walk_file_names(basedir_name))
+
+    def test_save_file_names(self):
+        """Test only the given result files are saved."""
+        checkpoint = DirectoryCheckpoint(self.checkpoint_dir_name, self.basedir_name)
+        self._write('outputs/one.csv', 'one\n')
+        self._write('outputs/two.csv', 'two\n')
+        checkpoint.save({'target_yr': 2010}, [os.path.join(self.basedir_name, 'outputs', 'one.csv')])
+        self.assertEqual({'target_yr': 2010}, checkpoint.step)
+        self.assertEqual(['files/outputs/one.csv', 'step.json'], walk_file_names(
+            os.path.join(self.checkpoint_dir_name, '0')))
+
+
+def _model(fail_at_by_name, name, *config_file_names):
+    """Write a result file per timestep, resuming after the last checkpoint."""
+    config = configparser.ConfigParser()
+    config.read(config_file_names[0])
+    out_dir_name = config['OUTPUTS']['out_dir']
+    os.makedirs(out_dir_name, exist_ok=True)
+    checkpoint = current_checkpoint()
+    start_yr = 2010 if checkpoint.step is None else checkpoint.step + 5
+    for target_yr in range(start_yr, 2030, 5):
+        if fail_at_by_name.get(name) == target_yr:
+            raise RuntimeError('failed at {0}'.format(target_yr))
+        print(name, target_yr)
+        with open(os.path.join(out_dir_name, '{0}_{1}.csv'.format(name, target_yr)), 'w') as out_file:
+            out_file.write(str(target_yr))
+        checkpoint.save(target_yr)
+
+
+class EventCheckpointsTestCase(unittest.TestCase):
+    """Event checkpoints unittest class."""
+
+    def setUp(self):
+        """Create the event handler running the models with checkpoints."""
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tempdir.cleanup)
+        self.checkpoint_dir_name = os.path.join(self.tempdir.name, 'checkpoints')
+        basedir_name = os.path.abspath(os.path.join('test_files', 'C234-1234-1234'))
+        with open(os.path.join(basedir_name, 'event.json'), mode='r') as event_file:
+            self.event_data = json.load(event_file)
+        self.fail_at_by_name = {'tight_coupling_twoway': 2020}
+        self.uploaded_file_names = []
+        self.model_runner = MagicMock(wraps=LocalModelRunner(), concurrency=1)
+        self.model_runner.load.side_effect = lambda name, file_name: functools.partial(
+            _model, self.fail_at_by_name, name)
+        self.uploader_runner = MagicMock()
+        self.uploader_runner.upload.side_effect = self._upload
+        self.event_handler = ProxEventHandler(
+            LocalDownloaderRunner(os.path.join(basedir_name, 'data')), self.uploader_runner, self.model_runner,
+            checkpoint_dir_name=self.checkpoint_dir_name)
+
+    def _upload(self, basedir_name, **kwargs):
+        """Record the uploaded files and the log then upload them locally."""
+        with open(os.path.join(basedir_name, 'stdout.log')) as log_file:
+            self.uploaded_file_names.append((walk_file_names(basedir_name), log_file.read()))
+        return LocalUploaderRunner().upload(basedir_name, **kwargs)
+
+    def test_resume(self):
+        """Test a retry restores the checkpoints and runs the remaining timesteps."""
+        with self.assertRaises(InvalidModelProxEventHandlerError):
+            self.event_handler.handle(Event(self.event_data))
+        self.assertEqual(2015, EventCheckpoints(
+            self.checkpoint_dir_name, 'event:{0}'.format(self.event_data['eventID']), None
+        ).checkpoint('tight_coupling_twoway').step)
+        self.fail_at_by_name.clear()
+        self.event_handler.handle(Event(self.event_data))
+        (file_names, log) = self.uploaded_file_names[0]
+        for name in ['loose_coupling', 'tight_coupling_twoway', 'tight_coupling']:
+            for target_yr in range(2010, 2030, 5):
+                self.assertIn('outputs/{0}_{1}.csv'.format(name, target_yr), file_names)
+        self.assertIn('tight_coupling_twoway 2020\n', log)
+        self.assertNotIn('tight_coupling_twoway 2010\n', log)
+        self.assertEqual([], os.listdir(self.checkpoint_dir_name))
+
+    def test_prune(self):
+        """Test the checkpoints of the events not saved or restored within the maximum age are removed."""
+        with self.assertRaises(InvalidModelProxEventHandlerError):
+            self.event_handler.handle(Event(self.event_data))
+        [event_dir_name] = os.listdir(self.checkpoint_dir_name)
+        stale_dir_name = os.path.join(self.checkpoint_dir_name, 'stale')
+        os.makedirs(os.path.join(stale_dir_name, 'loose_coupling'))
+        mtime = time.time() - 7200
+        for dir_name in [os.path.join(stale_dir_name, 'loose_coupling'), stale_dir_name]:
+            os.utime(dir_name, (mtime, mtime))
+        self.event_handler.checkpoint_max_age = 3600
+        with self.assertRaises(InvalidModelProxEventHandlerError):
+            self.event_handler.handle(Event(self.event_data))
+        self.assertEqual([event_dir_name], os.listdir(self.checkpoint_dir_name))
+        self.assertEqual([], prune_checkpoints(self.checkpoint_dir_name, 3600))
+        self.assertEqual([event_dir_name], prune_checkpoints(self.checkpoint_dir_name, -60))
+        self.assertEqual([], os.listdir(self.checkpoint_dir_name))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# pacifica-dispatcher-proxymod: tests/databases_test.py
+#
+# Copyright (c) 2019, Battelle Memorial Institute
+# All rights reserved.
+#
+# See LICENSE and WARRANTY for details.
+"""Module to test connecting to the database of the receiver."""
+import os
+import tempfile
+import unittest
+
+import peewee
+from playhouse.pool import PooledPostgresqlDatabase, PooledSqliteDatabase
+
+from pacifica.dispatcher_proxymod.databases import connect_database, connected_db_context
+
+
+class ConnectDatabaseTestCase(unittest.TestCase):
+    """Database connection unittest class."""
+
+    def setUp(self):
+        """Create a temporary directory for the SQLite database."""
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tempdir.cleanup)
+        self.url = 'sqlite:///{0}'.format(os.path.join(self.tempdir.name, 'db.sqlite3'))
+
+    def test_sqlite_file(self):
+        """Test a file-backed SQLite database is tuned and pooled."""
+        database = connect_database(self.url, pool=True, max_connections=2, stale_timeout=10)
+        self.assertIsInstance(database, PooledSqliteDatabase)
+        self.assertEqual(2, database._max_connections)  # pylint: disable=protected-access
+        with connected_db_context(database):
+            self.assertEqual('wal', database.execute_sql('PRAGMA journal_mode').fetchone()[0])
+            self.assertEqual(1, database.execute_sql('PRAGMA synchronous').fetchone()[0])
+        self.assertTrue(database.is_closed())
+        database.close_all()
+
+    def test_sqlite_untuned(self):
+        """Test the pragmas of a file-backed SQLite database can be left out."""
+        database = connect_database(self.url, sqlite_journal_mode='', sqlite_synchronous='')
+        self.assertNotIsInstance(database, PooledSqliteDatabase)
+        with connected_db_context(database):
+            self.assertEqual('delete', database.execute_sql('PRAGMA journal_mode').fetchone()[0])
+
+    def test_sqlite_memory(self):
+        """Test an in-memory SQLite database is never pooled."""
+        database = connect_database('sqlite:///:memory:', pool=True)
+        self.assertIsInstance(database, peewee.SqliteDatabase)
+        self.assertNotIsInstance(database, PooledSqliteDatabase)
+
+    def test_postgres(self):
+        """Test a Postgres database uses the pooled equivalent."""
+        database = connect_database('postgres://user@localhost/db', pool=True, max_connections=3, stale_timeout=60)
+        self.assertIsInstance(database, PooledPostgresqlDatabase)
+        self.assertEqual(60, database._stale_timeout)  # pylint: disable=protected-access
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# pacifica-dispatcher-proxymod: tests/downloader_runners_test.py
+#
+# Copyright (c) 2019, Battelle Memorial Institute
+# All rights reserved.
+#
+# See LICENSE and WARRANTY for details.
+"""Module to test the proxymod download runners."""
+import hashlib
+import io
+import os
+import shutil
+import tarfile
+import tempfile
+import unittest
+
+import requests
+from mock import patch
+
+from pacifica.dispatcher.models import File
+from pacifica.dispatcher.downloader_runners import LocalDownloaderRunner
+
+from pacifica.dispatcher_proxymod.downloader_runners import CachingDownloaderRunner, ConcurrentDownloaderRunner
+from pacifica.dispatcher_proxymod.downloader_runners import StagingDownloaderRunner
+from pacifica.dispatcher_proxymod.timers import RecordingStageTimer
+
+
+def _to_file(basedir_name, subdir, name, hashtype='sha1'):
+    """Build a file model with the real hash sum of the file on disk."""
+    with open(os.path.join(basedir_name, subdir, name), 'rb') as file_desc:
+        hashsum = hashlib.new(hashtype, file_desc.read()).hexdigest()
+    return File(name=name, subdir=subdir, hashsum=hashsum, hashtype=hashtype, mimetype='text/csv')
+
+
+class CachingDownloaderRunnerTestCase(unittest.TestCase):
+    """Caching download runner unittest class."""
+
+    def setUp(self):
+        """Build the local download runner and the files to download."""
+        self.basedir_name = os.path.abspath(os.path.join('test_files', 'C234-1234-1234', 'data'))
+        self.downloader_runner = LocalDownloaderRunner(self.basedir_name)
+        self.files = [
+            _to_file(self.basedir_name, 'inputs/', 'in_file_one.csv'),
+            _to_file(self.basedir_name, 'models/', 'loose_coupling.py'),
+        ]
+
+    def test_cache_hits(self):
+        """Test the second download comes from the cache and the lookups are observed."""
+        stage_timer = RecordingStageTimer()
+        with tempfile.TemporaryDirectory() as cache_dir_name:
+            downloader_runner = CachingDownloaderRunner(self.downloader_runner, cache_dir_name, stage_timer=stage_timer)
+            for expected_hits in [0, 2]:
+                with tempfile.TemporaryDirectory() as tempdir_name:
+                    openers = downloader_runner.download(tempdir_name, self.files)
+                    self.assertEqual(expected_hits, downloader_runner.hits)
+                    with openers[0]() as file_desc:
+                        self.assertEqual(
+                            os.path.join(tempdir_name, 'inputs', 'in_file_one.csv'), file_desc.name)
+                        with open(os.path.join(self.basedir_name, 'inputs', 'in_file_one.csv')) as orig_desc:
+                            self.assertEqual(orig_desc.read(), file_desc.read())
+            self.assertEqual(2, downloader_runner.misses)
+        self.assertEqual({('download', True): 2, ('download', False): 2}, stage_timer.lookups)
+
+    def test_bad_hashsum(self):
+        """Test files with a wrong hash sum are downloaded but never cached."""
+        self.files[0].hashsum = '0' * 40
+        with tempfile.TemporaryDirectory() as cache_dir_name:
+            downloader_runner = CachingDownloaderRunner(self.downloader_runner, cache_dir_name)
+            for _index in range(2):
+                with tempfile.TemporaryDirectory() as tempdir_name:
+                    openers = downloader_runner.download(tempdir_name, self.files)
+                    with openers[0]() as file_desc:
+                        self.assertTrue(file_desc.read())
+            self.assertEqual(1, downloader_runner.hits)
+            self.assertEqual(3, downloader_runner.misses)
+
+    def test_eviction(self):
+        """Test the least recently used files are evicted from a full cache."""
+        with tempfile.TemporaryDirectory() as cache_dir_name:
+            downloader_runner = CachingDownloaderRunner(self.downloader_runner, cache_dir_name, max_size=1)
+            with tempfile.TemporaryDirectory() as tempdir_name:
+                downloader_runner.download(tempdir_name, self.files)
+            with tempfile.TemporaryDirectory() as tempdir_name:
+                downloader_runner.download(tempdir_name, self.files)
+            self.assertEqual(0, downloader_runner.hits)
+
+    def test_no_files(self):
+        """Test downloading nothing raises an error."""
+        with tempfile.TemporaryDirectory() as cache_dir_name:
+            downloader_runner = CachingDownloaderRunner(self.downloader_runner, cache_dir_name)
+            with self.assertRaises(ValueError):
+                downloader_runner.download(cache_dir_name, [])
+
+
+class StagingDownloaderRunnerTestCase(unittest.TestCase):
+    """Staging download runner unittest class."""
+
+    def setUp(self):
+        """Copy the files to download to an archive directory, named by their hash sums."""
+        self.basedir_name = os.path.abspath(os.path.join('test_files', 'C234-1234-1234', 'data'))
+        self.downloader_runner = LocalDownloaderRunner(self.basedir_name)
+        self.files = [
+            _to_file(self.basedir_name, 'inputs/', 'in_file_one.csv'),
+            _to_file(self.basedir_name, 'models/', 'loose_coupling.py'),
+        ]
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tempdir.cleanup)
+        self.archive_dir_name = os.path.join(self.tempdir.name, 'archive')
+        os.makedirs(self.archive_dir_name)
+        for file in self.files:
+            shutil.copyfile(os.path.join(self.basedir_name, file.path),
+                            os.path.join(self.archive_dir_name, file.hashsum))
+
+    def _download(self, downloader_runner):
+        """Download the files, returning their paths and contents."""
+        with tempfile.TemporaryDirectory() as tempdir_name:
+            openers = downloader_runner.download(tempdir_name, self.files)
+            self.assertEqual([], [name for name in os.listdir(tempdir_name) if name.startswith('.stage-')])
+            paths = []
+            for file, opener in zip(self.files, openers):
+                with opener() as file_desc:
+                    self.assertEqual(os.path.join(tempdir_name, file.path), file_desc.name)
+                    with open(os.path.join(self.basedir_name, file.path)) as orig_desc:
+                        self.assertEqual(orig_desc.read(), file_desc.read())
+                    paths.append(os.path.realpath(file_desc.name))
+            return paths
+
+    def test_stage(self):
+        """Test writable archive files are cloned or copied, never linked."""
+        downloader_runner = StagingDownloaderRunner(self.downloader_runner, self.archive_dir_name, '{hashsum}')
+        paths = self._download(downloader_runner)
+        self.assertEqual(2, sum(downloader_runner.counts.values()))
+        self.assertEqual(set(), set(downloader_runner.counts.keys()) - {'reflink', 'copy'})
+        self.assertFalse(any(path.startswith(self.archive_dir_name) for path in paths))
+
+    def test_stage_read_only(self):
+        """Test read-only archive files are linked and their hash sums are checked once."""
+        for file in self.files:
+            os.chmod(os.path.join(self.archive_dir_name, file.hashsum), 0o444)
+        downloader_runner = StagingDownloaderRunner(
+            self.downloader_runner, self.archive_dir_name, '{hashsum}', ['hardlink', 'copy'])
+        self._download(downloader_runner)
+        self.assertEqual(2, len(downloader_runner._verified))  # pylint: disable=protected-access
+        downloader_runner = StagingDownloaderRunner(
+            self.downloader_runner, self.archive_dir_name, '{hashsum}', ['symlink'])
+        with patch('hashlib.new', wraps=hashlib.new) as hashlib_new:
+            paths = self._download(downloader_runner)
+            paths = self._download(downloader_runner)
+        self.assertEqual(2, hashlib_new.call_count)
+        self.assertEqual({'symlink': 4}, downloader_runner.counts)
+        self.assertEqual([os.path.join(self.archive_dir_name, file.hashsum) for file in self.files], paths)
+        os.chmod(os.path.join(self.archive_dir_name, self.files[0].hashsum), 0o644)
+        with self.assertRaises(OSError):
+            self._download(downloader_runner)
+
+    def test_stage_missing(self):
+        """Test files missing from the archive or not matching their size or hash sum are downloaded."""
+        os.unlink(os.path.join(self.archive_dir_name, self.files[0].hashsum))
+        self.files[1].size = 1
+        downloader_runner = StagingDownloaderRunner(self.downloader_runner, self.archive_dir_name, '{hashsum}')
+        self._download(downloader_runner)
+        self.files[1].size = None
+        with open(os.path.join(self.archive_dir_name, self.files[1].hashsum), 'a') as archive_file:
+            archive_file.write('# changed\n')
+        self._download(downloader_runner)
+        self.assertEqual({'download': 4}, downloader_runner.counts)
+        with self.assertRaises(ValueError):
+            downloader_runner.download(self.tempdir.name, [])
+        with self.assertRaises(ValueError):
+            StagingDownloaderRunner(self.downloader_runner, self.archive_dir_name, modes=['teleport'])
+
+
+class FakeResponse:
+    """Fake streamed response of a cart download."""
+
+    def __init__(self, file_name, content):
+        """Build the cart tar file in memory."""
+        self.raw = io.BytesIO()
+        with tarfile.open(fileobj=self.raw, mode='w') as cart_tar:
+            tarinfo = tarfile.TarInfo(file_name)
+            tarinfo.size = len(content)
+            cart_tar.addfile(tarinfo, io.BytesIO(content))
+        self.raw.seek(0)
+
+    def __enter__(self):
+        """Return the response as context."""
+        return self
+
+    def __exit__(self, *args):
+        """Nothing to close."""
+
+    @staticmethod
+    def raise_for_status():
+        """Do nothing, the fake response is always okay."""
+
+
+class ConcurrentDownloaderRunnerTestCase(unittest.TestCase):
+    """Concurrent download runner unittest class."""
+
+    def setUp(self):
+        """Build the download runner with the cart API mocked out."""
+        self.downloader_runner = ConcurrentDownloaderRunner('http://127.0.0.1:8081', retries=1, backoff_factor=0)
+        cart_api = self.downloader_runner.downloader.cart_api
+        patchers = [
+            patch.object(cart_api, 'setup_cart', side_effect=self._fake_setup_cart),
+            patch.object(cart_api, 'wait_for_cart', side_effect=lambda cart_url, timeout: cart_url),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.files = [
+            File(_id=index, name='in_file_{0}.csv'.format(index), subdir='inputs/') for index in range(8)
+        ]
+        self.failures = set()
+
+    @staticmethod
+    def _fake_setup_cart(yield_files):
+        """Return a cart url naming the only file in the cart."""
+        (file_data, ) = list(yield_files())
+        return 'http://127.0.0.1:8081/{0}/{1}'.format(file_data['id'], file_data['path'])
+
+    def _fake_get(self, url, **_kwargs):
+        """Return the cart content, failing once for the files in the failures."""
+        (file_id, file_path) = url.split('?')[0].split('/', 4)[3:]
+        if file_id in self.failures:
+            self.failures.remove(file_id)
+            raise requests.ConnectionError('connection refused')
+        return FakeResponse('data/{0}'.format(file_path), bytes(file_id, 'utf-8'))
+
+    def test_download(self):
+        """Test all files are downloaded over the shared session."""
+        self.failures.add('3')
+        with patch.object(self.downloader_runner.session, 'get', side_effect=self._fake_get) as session_get:
+            with tempfile.TemporaryDirectory() as tempdir_name:
+                openers = self.downloader_runner.download(tempdir_name, self.files)
+                for index, opener in enumerate(openers):
+                    with opener() as file_desc:
+                        self.assertEqual(str(index), file_desc.read())
+        self.assertEqual(len(self.files) + 1, session_get.call_count)
+
+    def test_download_retries(self):
+        """Test a file failing more often than the retries raises the error."""
+        self.downloader_runner.retries = 0
+        self.failures.add('3')
+        with patch.object(self.downloader_runner.session, 'get', side_effect=self._fake_get):
+            with tempfile.TemporaryDirectory() as tempdir_name:
+                with self.assertRaises(requests.ConnectionError):
+                    self.downloader_runner.download(tempdir_name, self.files)
+                with self.assertRaises(ValueError):
+                    self.downloader_runner.download(tempdir_name, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
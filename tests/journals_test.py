@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# pacifica-dispatcher-proxymod: tests/journals_test.py
+#
+# Copyright (c) 2019, Battelle Memorial Institute
+# All rights reserved.
+#
+# See LICENSE and WARRANTY for details.
+"""Module to test handling redelivered proxymod events."""
+import json
+import os
+import tempfile
+import unittest
+
+import peewee
+from cloudevents.model import Event
+from mock import MagicMock
+
+from pacifica.dispatcher.downloader_runners import LocalDownloaderRunner
+from pacifica.dispatcher.uploader_runners import LocalUploaderRunner
+
+from pacifica.dispatcher_proxymod.event_handlers import ProxEventHandler
+from pacifica.dispatcher_proxymod.journals import EXECUTED_STAGE, UPLOADED_STAGE, JournalEntry, ModelEventJournal
+from pacifica.dispatcher_proxymod.journals import create_event_journal_model
+from pacifica.dispatcher_proxymod.result_cache import ResultCache
+from pacifica.dispatcher_proxymod.timers import RecordingStageTimer
+
+
+def _run(_model, _args, log_dir_name):
+    """Write a log file like a model would."""
+    with open(os.path.join(log_dir_name, 'stdout.log'), 'a') as log_file:
+        log_file.write('model output')
+
+
+class EventJournalTestCase(unittest.TestCase):
+    """Event journal unittest class."""
+
+    def setUp(self):
+        """Create the event journal table in a temporary database and the event handler."""
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tempdir.cleanup)
+        self.database = peewee.SqliteDatabase(os.path.join(self.tempdir.name, 'db.sqlite3'))
+        self.event_journal_model = create_event_journal_model(self.database)
+        self.event_journal_model.create_table(safe=True)
+        self.database.close()
+        self.event_journal = ModelEventJournal(self.event_journal_model)
+
+        basedir_name = os.path.abspath(os.path.join('test_files', 'C234-1234-1234'))
+        with open(os.path.join(basedir_name, 'event.json'), mode='r') as event_file:
+            self.event_data = json.load(event_file)
+        self.downloader_runner = MagicMock(wraps=LocalDownloaderRunner(os.path.join(basedir_name, 'data')))
+        self.uploader_runner = MagicMock(wraps=LocalUploaderRunner())
+        self.model_runner = MagicMock(concurrency=1)
+        self.model_runner.run.side_effect = _run
+        self.stage_timer = RecordingStageTimer()
+        self.event_handler = ProxEventHandler(
+            self.downloader_runner, self.uploader_runner, self.model_runner,
+            ResultCache(os.path.join(self.tempdir.name, 'results')), self.stage_timer, self.event_journal)
+
+    def test_journal(self):
+        """Test the entries are saved, replaced and loaded."""
+        self.assertEqual(JournalEntry(), self.event_journal.load('event:1'))
+        self.event_journal.save('event:1', JournalEntry(EXECUTED_STAGE, 'abc'))
+        self.event_journal.save('event:1', JournalEntry(UPLOADED_STAGE, 'abc'))
+        self.assertEqual(JournalEntry(UPLOADED_STAGE, 'abc'), self.event_journal.load('event:1'))
+        self.assertTrue(self.database.is_closed())
+
+    def test_journal_database_error(self):
+        """Test the event is handled as new when the database fails."""
+        self.event_journal_model.drop_table()
+        with self.assertLogs('pacifica.dispatcher_proxymod.journals'):
+            self.event_journal.save('event:1', JournalEntry(UPLOADED_STAGE))
+        with self.assertLogs('pacifica.dispatcher_proxymod.journals'):
+            self.assertEqual(JournalEntry(), self.event_journal.load('event:1'))
+
+    def test_redelivered(self):
+        """Test an event delivered again after its upload is not handled again."""
+        for _index in range(2):
+            self.event_handler.handle(Event(self.event_data))
+        self.assertEqual(2, self.downloader_runner.download.call_count)
+        self.assertEqual(1, self.uploader_runner.upload.call_count)
+        self.assertEqual({'': 2}, self.stage_timer.outcomes)
+        self.assertEqual([None], self.event_handler.handle_many([Event(self.event_data)]))
+        self.assertEqual(2, self.downloader_runner.download.call_count)
+
+    def test_resume_executed(self):
+        """Test an event delivered again after its models ran restores their results."""
+        self.uploader_runner.upload.side_effect = OSError('no upload')
+        with self.assertRaises(OSError):
+            self.event_handler.handle(Event(self.event_data))
+        entry = self.event_journal.load('event:{0}'.format(self.event_data['eventID']))
+        self.assertEqual(EXECUTED_STAGE, entry.stage)
+        self.assertIsNotNone(entry.result_key)
+        self.uploader_runner.upload.side_effect = None
+        self.event_handler.handle(Event(self.event_data))
+        self.assertEqual(3, self.model_runner.run.call_count)
+        self.assertEqual(1, len(self.stage_timer.durations['memoize']))
+        self.assertEqual(UPLOADED_STAGE, self.event_journal.load(
+            'event:{0}'.format(self.event_data['eventID'])).stage)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# pacifica-dispatcher-proxymod: tests/logs_test.py
+#
+# Copyright (c) 2019, Battelle Memorial Institute
+# All rights reserved.
+#
+# See LICENSE and WARRANTY for details.
+"""Module to test capturing the logs of the proxymod event handler."""
+import concurrent.futures
+import gzip
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import unittest
+
+from cloudevents.model import Event
+from mock import MagicMock, patch
+
+from pacifica.dispatcher.downloader_runners import LocalDownloaderRunner
+
+from pacifica.dispatcher_proxymod.event_handlers import ProxEventHandler
+from pacifica.dispatcher_proxymod.logs import CappedLogWriter, bind_log_context, compress_logs
+from pacifica.dispatcher_proxymod.logs import redirect_stdout_stderr
+from pacifica.dispatcher_proxymod.model_runners import LocalModelRunner
+from pacifica.dispatcher_proxymod.result_cache import walk_file_names
+
+
+class LogsTestCase(unittest.TestCase):
+    """Log capture unittest class."""
+
+    def setUp(self):
+        """Create a temporary directory for the log files."""
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tempdir.cleanup)
+
+    def _read_log(self, name, dir_name=None):
+        """Return the content of a log file."""
+        with open(os.path.join(dir_name or self.tempdir.name, name)) as log_file:
+            return log_file.read()
+
+    def test_capped_log_writer(self):
+        """Test the head and the tail of the output are kept."""
+        writer = CappedLogWriter(os.path.join(self.tempdir.name, 'stdout.log'), max_size=10)
+        for index in range(10):
+            writer.write(str(index) * 3)
+        writer.close()
+        writer.write('after close')
+        self.assertEqual('00011\n[... 20 bytes truncated ...]\n88999', self._read_log('stdout.log'))
+
+    def test_threads(self):
+        """Test threads capturing at the same time keep their own output."""
+        barrier = threading.Barrier(2)
+
+        def capture(name):
+            """Print the name between the other thread's prints."""
+            os.mkdir(os.path.join(self.tempdir.name, name))
+            with redirect_stdout_stderr(os.path.join(self.tempdir.name, name)):
+                for _index in range(3):
+                    barrier.wait()
+                    print(name)
+                    print(name, file=sys.stderr)
+
+        threads = [threading.Thread(target=capture, args=(name, )) for name in ['one', 'two']]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        for name in ['one', 'two']:
+            for log_name in ['stdout.log', 'stderr.log']:
+                self.assertEqual('{0}\n'.format(name) * 3, self._read_log(
+                    log_name, os.path.join(self.tempdir.name, name)))
+
+    def test_bind_log_context(self):
+        """Test the output of a function bound to the context is captured in another thread."""
+        with redirect_stdout_stderr(self.tempdir.name, 'download-'):
+            with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+                executor.submit(bind_log_context(print), 'downloading').result()
+        self.assertEqual('downloading\n', self._read_log('download-stdout.log'))
+
+    def test_fd_level(self):
+        """Test the output of the file descriptors and subprocesses is captured and capped."""
+        with redirect_stdout_stderr(self.tempdir.name, mode='a', max_size=64, fd_level=True):
+            print('from python')
+            os.write(1, b'from fd\n')
+            subprocess.run([sys.executable, '-c', 'print("from subprocess")'], check=True)
+            subprocess.run([sys.executable, '-c', 'import sys; sys.stderr.write("x" * 100)'], check=True)
+        self.assertEqual('from python\nfrom fd\nfrom subprocess\n', self._read_log('stdout.log'))
+        self.assertEqual('x' * 32 + '\n[... 36 bytes truncated ...]\n' + 'x' * 32, self._read_log('stderr.log'))
+
+    def test_compress_logs(self):
+        """Test the log files are replaced by compressed log files."""
+        with redirect_stdout_stderr(self.tempdir.name):
+            print('compressed')
+        os.mkdir(os.path.join(self.tempdir.name, 'outputs'))
+        self.assertEqual(['stderr.log.gz', 'stdout.log.gz'], compress_logs(self.tempdir.name))
+        self.assertEqual(['outputs', 'stderr.log.gz', 'stdout.log.gz'], sorted(os.listdir(self.tempdir.name)))
+        with gzip.open(os.path.join(self.tempdir.name, 'stdout.log.gz'), 'rt') as log_file:
+            self.assertEqual('compressed\n', log_file.read())
+
+    def test_compress_logs_sweep(self):
+        """Test the logs of every variant of a parameter sweep are uploaded compressed."""
+        basedir_name = os.path.abspath(os.path.join('test_files', 'C234-1234-1234'))
+        with open(os.path.join(basedir_name, 'event.json'), mode='r') as event_file:
+            event_data = json.load(event_file)
+        event_data['data'].append({
+            'destinationTable': 'TransactionKeyValue', 'key': 'proxymod.sweep.config_1.PROJECT.runtime', 'value': '1, 2'
+        })
+        uploaded_file_names = []
+
+        def run(_model, _args, log_dir_name, **_kwargs):
+            """Write to the log of the variant."""
+            with redirect_stdout_stderr(log_dir_name, mode='a'):
+                print('running', os.path.basename(log_dir_name))
+
+        def upload(dir_name, **_kwargs):
+            """Record the uploaded files."""
+            uploaded_file_names.extend(walk_file_names(dir_name))
+            return (None, None, None)
+
+        event_handler = ProxEventHandler(
+            LocalDownloaderRunner(os.path.join(basedir_name, 'data')), MagicMock(upload=MagicMock(side_effect=upload)),
+            LocalModelRunner(), log_compress=True)
+        with patch.object(event_handler.model_runner, 'load'), \
+                patch.object(event_handler.model_runner, 'run', side_effect=run):
+            event_handler.handle(Event(event_data))
+        self.assertIn(os.path.join('variant_2', 'stdout.log.gz'), uploaded_file_names)
+        # NOTE The logs of the upload are written while the files are uploaded.
+        self.assertEqual(['upload-stderr.log', 'upload-stdout.log'], [
+            file_name for file_name in uploaded_file_names if file_name.endswith('.log')])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# pacifica-dispatcher-proxymod: tests/main_test.py
+#
+# Copyright (c) 2019, Battelle Memorial Institute
+# All rights reserved.
+#
+# See LICENSE and WARRANTY for details.
+"""Module to test the lazy initialization of the proxymod dispatcher."""
+import copy
+import json
+import os
+import signal
+import unittest
+import wsgiref.util
+
+from jsonpath2.path import Path
+from mock import MagicMock, patch
+
+from pacifica.dispatcher_proxymod import __main__ as proxymod_main
+from pacifica.dispatcher_proxymod.exceptions import AdmissionDeferredProxEventHandlerError, DeferredEventError
+from pacifica.dispatcher_proxymod.router import PROXYMOD_PATH_FILE_NAME_, DeferringRoute, LazyRouter
+from pacifica.dispatcher_proxymod.router import may_match_proxymod
+
+
+class LazyInitTestCase(unittest.TestCase):
+    """Lazy initialization unittest class."""
+
+    def test_lazy_router(self):
+        """Test the event handler is created when the router is first used, once."""
+        with open(os.path.join('test_files', 'C234-1234-1234', 'event.json'), mode='r') as event_file:
+            event_data = json.load(event_file)
+        stage_timer = object()
+        with patch('pacifica.dispatcher_proxymod.router.create_event_handler') as create_event_handler:
+            router = LazyRouter(stage_timer)
+            create_event_handler.assert_not_called()
+            self.assertEqual(1, len(list(router.match(event_data))))
+            self.assertEqual(create_event_handler.return_value, router.event_handler)
+        create_event_handler.assert_called_once_with(stage_timer, None)
+
+    def test_lazy_router_match_path(self):
+        """Test the router matches the proxymod path without creating the event handler."""
+        with open(os.path.join('test_files', 'C234-1234-1234', 'event.json'), mode='r') as event_file:
+            event_data = json.load(event_file)
+        with patch('pacifica.dispatcher_proxymod.router.create_event_handler') as create_event_handler:
+            router = LazyRouter()
+            self.assertTrue(router.match_path(event_data))
+            self.assertFalse(router.match_path({'data': []}))
+        create_event_handler.assert_not_called()
+
+    def test_deferring_route(self):
+        """Test the route passes the deferred events to the function deferring them, if any."""
+        reason = AdmissionDeferredProxEventHandlerError(None, 'memory', 2048, 1024)
+        event_handler = MagicMock()
+        event_handler.handle.side_effect = reason
+        defer = MagicMock()
+        event_data = {
+            'cloudEventsVersion': '0.1', 'eventType': 'one', 'eventID': 'one', 'source': '/test', 'data': [],
+        }
+        with self.assertRaises(DeferredEventError) as context:
+            DeferringRoute(Path.parse_str('$'), event_handler, defer)(event_data)
+        self.assertEqual('proxymod event deferred: proxymod event needs 2048 bytes of memory, 1024 bytes are free',
+                         str(context.exception))
+        defer.assert_called_once_with(event_data, reason)
+        with self.assertRaises(AdmissionDeferredProxEventHandlerError):
+            DeferringRoute(Path.parse_str('$'), event_handler)(event_data)
+
+    def test_prefilter(self):
+        """Test the prefilter rejects the events the proxymod path does not match, and only those."""
+        with open(os.path.join('test_files', 'C234-1234-1234', 'event.json'), mode='r') as event_file:
+            event_data = json.load(event_file)
+        variants = [event_data, None, {'data': []}, dict(event_data, data=None)]
+        for key, value in [('eventType', 'org.pacifica.other'), ('source', '/other'), ('eventID', None)]:
+            variant = copy.deepcopy(event_data)
+            if value is None:
+                del variant[key]
+            else:
+                variant[key] = value
+            variants.append(variant)
+        for key, value in [('proxymod.task', 'retreat'), ('proxymod.version', None)]:
+            variant = copy.deepcopy(event_data)
+            variant['data'] = [item for item in variant['data'] if value is not None or item.get('key') != key]
+            for item in variant['data']:
+                if item.get('key') == key:
+                    item['value'] = value
+            variants.append(variant)
+        path = Path.parse_file(PROXYMOD_PATH_FILE_NAME_)
+        router = LazyRouter()
+        self.assertEqual([True] + [False] * 8, [may_match_proxymod(variant) for variant in variants])
+        self.assertEqual([
+            bool(list(path.match(variant))) if variant is not None else False for variant in variants
+        ], [router.match_path(variant) for variant in variants])
+
+    def test_create_tables(self):
+        """Test the tables are created by the first request."""
+        environ = {'PATH_INFO': '/metrics'}
+        wsgiref.util.setup_testing_defaults(environ)
+        statuses = []
+        response = proxymod_main.application(environ, lambda status, headers, exc_info=None: statuses.append(status))
+        self.assertEqual(['200 OK'], statuses)
+        self.assertTrue(b''.join(response).startswith(b'# HELP '))
+        self.assertTrue(proxymod_main.database.table_exists('metricmodel'))
+        proxymod_main.create_tables()
+
+    def test_warm_model_runner(self):
+        """Test a new Celery worker process starts the fork server of the model runner, only for warm model runs."""
+        with patch.object(proxymod_main, 'router') as router:
+            with patch.dict(os.environ, {'MODEL_RUNNER': 'process'}):
+                proxymod_main.warm_model_runner(sender=None)
+            router.event_handler.model_runner.warm.assert_not_called()
+            with patch.dict(os.environ, {'MODEL_RUNNER': 'forkserver'}):
+                proxymod_main.warm_model_runner(sender=None)
+            router.event_handler.model_runner.warm.assert_called_once_with()
+
+    def test_cancel_on_terminate(self):
+        """Test a terminated Celery worker process cancels its running events, or exits if none are running."""
+        with patch.object(proxymod_main, 'router') as router, patch('os.kill') as kill, \
+                patch('signal.signal') as set_signal:
+            proxymod_main.install_cancel_on_terminate(sender=None)
+            set_signal.assert_called_once_with(signal.SIGTERM, proxymod_main.cancel_on_terminate)
+            router.event_handler.cancel.return_value = 1
+            proxymod_main.cancel_on_terminate(signal.SIGTERM, None)
+            router.event_handler.cancel.assert_called_once_with('revoked with signal {0}'.format(signal.SIGTERM))
+            kill.assert_not_called()
+            router.event_handler.cancel.return_value = 0
+            proxymod_main.cancel_on_terminate(signal.SIGTERM, None)
+            set_signal.assert_called_with(signal.SIGTERM, signal.SIG_DFL)
+            kill.assert_called_once_with(os.getpid(), signal.SIGTERM)
+
+
+if __name__ == '__main__':
+    unittest.main()
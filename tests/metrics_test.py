@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# pacifica-dispatcher-proxymod: tests/metrics_test.py
+#
+# Copyright (c) 2019, Battelle Memorial Institute
+# All rights reserved.
+#
+# See LICENSE and WARRANTY for details.
+"""Module to test the proxymod metrics."""
+import json
+import os
+import tempfile
+import unittest
+
+import peewee
+from cloudevents.model import Event
+from mock import MagicMock
+
+from pacifica.dispatcher.downloader_runners import LocalDownloaderRunner
+
+from pacifica.dispatcher_proxymod.downloader_runners import CachingDownloaderRunner
+from pacifica.dispatcher_proxymod.event_handlers import ProxEventHandler
+from pacifica.dispatcher_proxymod.exceptions import AdmissionDeferredProxEventHandlerError
+from pacifica.dispatcher_proxymod.exceptions import ConfigNotFoundProxEventHandlerError
+from pacifica.dispatcher_proxymod.metrics import MetricStageTimer, create_metric_model
+from pacifica.dispatcher_proxymod.usage import ModelUsage
+
+
+class MetricsTestCase(unittest.TestCase):
+    """Metrics unittest class."""
+
+    def setUp(self):
+        """Create the metric table in a temporary database."""
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tempdir.cleanup)
+        self.database = peewee.SqliteDatabase(os.path.join(self.tempdir.name, 'db.sqlite3'))
+        self.metric_model = create_metric_model(self.database)
+        self.metric_model.create_table(safe=True)
+        self.database.close()
+
+    def test_stage_timer(self):
+        """Test the stage timings, outcomes and admissions of events from two timers are added up."""
+        for stage_timer in [MetricStageTimer(self.metric_model), MetricStageTimer(self.metric_model)]:
+            with stage_timer.event():
+                stage_timer.observe('download', 0.2)
+                stage_timer.observe('download', 7200)
+                stage_timer.observe_usage('loose_coupling', ModelUsage(
+                    wall_seconds=1.5, cpu_seconds=1.25, peak_rss_bytes=1024, written_bytes=2048))
+            stage_timer.observe_admission(None)
+            stage_timer.observe_cache('download', True)
+            stage_timer.observe_cache('download', False)
+            stage_timer.observe_cache('result', False)
+            stage_timer.flush()
+            with self.assertRaises(AdmissionDeferredProxEventHandlerError):
+                with stage_timer.event():
+                    stage_timer.observe_admission('disk')
+                    raise AdmissionDeferredProxEventHandlerError(None, 'disk', 2048, 1024)
+            with self.assertRaises(ConfigNotFoundProxEventHandlerError):
+                with stage_timer.event():
+                    raise ConfigNotFoundProxEventHandlerError(None, 'config_1')
+        self.assertTrue(self.database.is_closed())
+        lines = self.metric_model.render().splitlines()
+        for line in [
+                '# TYPE proxymod_stage_duration_seconds histogram',
+                'proxymod_stage_duration_seconds_bucket{stage="download",le="0.1"} 0',
+                'proxymod_stage_duration_seconds_bucket{stage="download",le="0.25"} 2',
+                'proxymod_stage_duration_seconds_bucket{stage="download",le="3600.0"} 2',
+                'proxymod_stage_duration_seconds_bucket{stage="download",le="+Inf"} 4',
+                'proxymod_stage_duration_seconds_count{stage="download"} 4',
+                'proxymod_stage_duration_seconds_sum{stage="download"} 14400.4',
+                'proxymod_stage_duration_seconds_count{stage="event"} 6',
+                '# TYPE proxymod_events_total counter',
+                'proxymod_events_total{outcome="deferred",exception="AdmissionDeferredProxEventHandlerError"} 2',
+                'proxymod_events_total{outcome="failure",exception="ConfigNotFoundProxEventHandlerError"} 2',
+                'proxymod_events_total{outcome="success",exception=""} 2',
+                '# TYPE proxymod_admissions_total counter',
+                'proxymod_admissions_total{decision="admitted",resource=""} 2',
+                'proxymod_admissions_total{decision="deferred",resource="disk"} 2',
+                '# TYPE proxymod_cache_lookups_total counter',
+                'proxymod_cache_lookups_total{cache="download",result="hit"} 2',
+                'proxymod_cache_lookups_total{cache="download",result="miss"} 2',
+                'proxymod_cache_lookups_total{cache="result",result="miss"} 2',
+                '# TYPE proxymod_model_runs_total counter',
+                'proxymod_model_runs_total{model="loose_coupling"} 2',
+                'proxymod_model_wall_seconds_total{model="loose_coupling"} 3',
+                'proxymod_model_cpu_seconds_total{model="loose_coupling"} 2.5',
+                'proxymod_model_peak_rss_bytes_total{model="loose_coupling"} 2048',
+                'proxymod_model_written_bytes_total{model="loose_coupling"} 4096',
+        ]:
+            self.assertIn(line, lines)
+
+    def test_event_handler_cache_lookups(self):
+        """Test the lookups in the download cache, in the download threads of the event handler, are saved."""
+        basedir_name = os.path.abspath(os.path.join('test_files', 'C234-1234-1234'))
+        with open(os.path.join(basedir_name, 'event.json'), mode='r') as event_file:
+            event = Event(json.load(event_file))
+        stage_timer = MetricStageTimer(self.metric_model)
+        event_handler = ProxEventHandler(
+            CachingDownloaderRunner(LocalDownloaderRunner(os.path.join(basedir_name, 'data')),
+                                    os.path.join(self.tempdir.name, 'cache'), stage_timer=stage_timer),
+            MagicMock(upload=MagicMock(return_value=(None, None, None))), MagicMock(concurrency=1),
+            stage_timer=stage_timer)
+        event_handler.handle(event)
+        event_handler.handle(event)
+        misses = event_handler.downloader_runner.misses
+        self.assertLess(0, misses)
+        self.assertIn('proxymod_cache_lookups_total{{cache="download",result="miss"}} {0}'.format(misses),
+                      self.metric_model.render().splitlines())
+
+    def test_database_error(self):
+        """Test the metrics of an event are dropped when the database fails."""
+        self.metric_model.drop_table()
+        stage_timer = MetricStageTimer(self.metric_model)
+        with self.assertLogs('pacifica.dispatcher_proxymod.metrics'):
+            with stage_timer.event():
+                pass
+
+    def test_cherrypy_app(self):
+        """Test the metrics are served in the Prometheus text format."""
+        metrics = self.metric_model.create_cherrypy_app()
+        self.assertTrue(metrics.GET().startswith(b'# HELP proxymod_stage_duration_seconds '))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# pacifica-dispatcher-proxymod: tests/model_cache_test.py
+#
+# Copyright (c) 2019, Battelle Memorial Institute
+# All rights reserved.
+#
+# See LICENSE and WARRANTY for details.
+"""Module to test the proxymod model function cache."""
+import os
+import tempfile
+import unittest
+
+from pacifica.dispatcher_proxymod.model_cache import ModelFuncCache
+
+
+class ModelFuncCacheTestCase(unittest.TestCase):
+    """Model function cache unittest class."""
+
+    def setUp(self):
+        """Build a temporary directory for the model files."""
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tempdir.cleanup)
+
+    def _write_model(self, name, source):
+        """Write a model file and return its path."""
+        file_name = os.path.join(self.tempdir.name, '{0}.py'.format(name))
+        with open(file_name, mode='w') as file:
+            file.write(source)
+        return file_name
+
+    def test_cache_hits(self):
+        """Test the same model content is only loaded once."""
+        model_func_cache = ModelFuncCache()
+        file_name = self._write_model('model_one', 'def model_one(*args):\n    return len(args)\n')
+        func = model_func_cache.load('model_one', file_name)
+        self.assertEqual(2, func('a', 'b'))
+        self.assertIs(func, model_func_cache.load('model_one', file_name))
+        self.assertEqual((1, 1), (model_func_cache.hits, model_func_cache.misses))
+
+    def test_content_change(self):
+        """Test a changed model file is loaded again."""
+        model_func_cache = ModelFuncCache()
+        file_name = self._write_model('model_one', 'def model_one():\n    return 1\n')
+        self.assertEqual(1, model_func_cache.load('model_one', file_name)())
+        self._write_model('model_one', 'def model_one():\n    return 2\n')
+        self.assertEqual(2, model_func_cache.load('model_one', file_name)())
+        self.assertEqual(2, model_func_cache.misses)
+
+    def test_eviction(self):
+        """Test the least recently used model function is evicted."""
+        model_func_cache = ModelFuncCache(max_size=1)
+        for name in ['model_one', 'model_two', 'model_one']:
+            model_func_cache.load(name, self._write_model(name, 'def {0}():\n    pass\n'.format(name)))
+        self.assertEqual(1, len(model_func_cache))
+        self.assertEqual(3, model_func_cache.misses)
+        model_func_cache.clear()
+        self.assertEqual(0, len(model_func_cache))
+
+    def test_invalid_models(self):
+        """Test missing and uncallable model functions raise errors."""
+        model_func_cache = ModelFuncCache()
+        with self.assertRaises(AttributeError):
+            model_func_cache.load('model_one', self._write_model('model_one', 'model_two = 1\n'))
+        with self.assertRaises(TypeError):
+            model_func_cache.load('model_two', self._write_model('model_two', 'model_two = 1\n'))
+        self.assertEqual(0, len(model_func_cache))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# pacifica-dispatcher-proxymod: tests/model_runners_test.py
+#
+# Copyright (c) 2019, Battelle Memorial Institute
+# All rights reserved.
+#
+# See LICENSE and WARRANTY for details.
+"""Module to test the proxymod model runners."""
+import os
+import tempfile
+import threading
+import time
+import unittest
+
+from pacifica.dispatcher_proxymod.cancellation import ModelCancelledError, ModelTimeoutError
+from pacifica.dispatcher_proxymod.checkpoints import DirectoryCheckpoint
+from pacifica.dispatcher_proxymod.model_runners import ForkServerModelRunner, LocalModelRunner, ProcessPoolModelRunner
+
+MODEL_SOURCE = '''
+import os
+import subprocess
+import sys
+import time
+
+RUNS = []
+
+
+def model_one(action, *args):
+    print('running', action)
+    if action == 'fail':
+        raise ValueError('model failed')
+    if action == 'sleep':
+        time.sleep(float(args[0]))
+    if action == 'spin':
+        deadline = time.monotonic() + float(args[0])
+        while time.monotonic() < deadline:
+            pass
+    if action == 'crash':
+        sys.stdout.flush()
+        os._exit(3)
+    if action == 'exit':
+        sys.exit(3)
+    if action == 'allocate':
+        return len(bytearray(int(args[0])))
+    if action == 'subprocess':
+        subprocess.run([sys.executable, '-c', 'print("from subprocess " * 10)'], check=True)
+    if action == 'modules':
+        RUNS.append(action)
+        return (len(RUNS), [module_name in sys.modules for module_name in args])
+    if action == 'checkpoint':
+        from pacifica.dispatcher_proxymod.checkpoints import current_checkpoint
+        current_checkpoint().save(int(args[0]))
+        return current_checkpoint().step
+    return os.getpid()
+'''
+
+
+class ModelRunnerTestCase(unittest.TestCase):
+    """Model runner unittest class."""
+
+    def setUp(self):
+        """Write the model file to a temporary directory."""
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tempdir.cleanup)
+        self.file_name = os.path.join(self.tempdir.name, 'model_one.py')
+        with open(self.file_name, mode='w') as file:
+            file.write(MODEL_SOURCE)
+
+    def _read_log(self, name='stdout.log'):
+        """Return the content of a log file."""
+        with open(os.path.join(self.tempdir.name, name)) as log_file:
+            return log_file.read()
+
+    def test_local_model_runner(self):
+        """Test running a model in the current process."""
+        model_runner = LocalModelRunner()
+        model = model_runner.load('model_one', self.file_name)
+        self.assertEqual(os.getpid(), model_runner.run(model, ['ok'], self.tempdir.name))
+        with self.assertRaises(ValueError):
+            model_runner.run(model, ['fail'], self.tempdir.name)
+        self.assertEqual('running ok\nrunning fail\n', self._read_log())
+
+    def test_local_timeout(self):
+        """Test a model run in the current process is interrupted out of time or cancelled."""
+        model_runner = LocalModelRunner()
+        model = model_runner.load('model_one', self.file_name)
+        start = time.monotonic()
+        with self.assertRaises(ModelTimeoutError):
+            model_runner.run(model, ['spin', '10'], self.tempdir.name, timeout=0.2)
+        timer = threading.Timer(0.2, model_runner.cancel)
+        timer.start()
+        with self.assertRaises(ModelCancelledError):
+            model_runner.run(model, ['spin', '10'], self.tempdir.name)
+        timer.join()
+        self.assertLess(time.monotonic() - start, 5)
+        self.assertEqual(os.getpid(), model_runner.run(model, ['ok'], self.tempdir.name, timeout=10))
+
+    def test_local_cancel_reentrant(self):
+        """Test a model run is cancelled by a signal handler interrupting the thread while it holds the lock."""
+        model_runner = LocalModelRunner()
+        model = model_runner.load('model_one', self.file_name)
+        # pylint: disable=protected-access
+        with self.assertRaises(ModelCancelledError):
+            with model_runner._interruptible(0):
+                with model_runner._lock:
+                    model_runner.cancel()
+                model(*['spin', '10'])
+        # pylint: enable=protected-access
+        self.assertEqual(os.getpid(), model_runner.run(model, ['ok'], self.tempdir.name))
+
+    def test_process_pool_model_runner(self):
+        """Test running models in reused worker processes."""
+        model_runner = ProcessPoolModelRunner(processes=1)
+        self.addCleanup(model_runner.close)
+        model = model_runner.load('model_one', self.file_name)
+        pid = model_runner.run(model, ['ok'], self.tempdir.name)
+        self.assertNotEqual(os.getpid(), pid)
+        with self.assertRaises(ValueError):
+            model_runner.run(model, ['fail'], self.tempdir.name)
+        self.assertEqual(pid, model_runner.run(model, ['ok'], self.tempdir.name))
+        self.assertEqual('running ok\nrunning fail\nrunning ok\n', self._read_log())
+        with self.assertRaises(AttributeError):
+            model_runner.load('model_two', self.file_name)
+
+    def test_process_pool_logs(self):
+        """Test the output of subprocesses of a model is captured and capped."""
+        model_runner = ProcessPoolModelRunner(processes=1, log_max_size=40)
+        self.addCleanup(model_runner.close)
+        model = model_runner.load('model_one', self.file_name)
+        model_runner.run(model, ['subprocess'], self.tempdir.name)
+        self.assertEqual('running subprocess\nf\n[... 140 bytes truncated ...]\nss from subprocess \n',
+                         self._read_log())
+
+    def test_process_pool_checkpoint(self):
+        """Test the checkpoint of a model is the current checkpoint in the worker process."""
+        model_runner = ProcessPoolModelRunner(processes=1)
+        self.addCleanup(model_runner.close)
+        model = model_runner.load('model_one', self.file_name)
+        checkpoint = DirectoryCheckpoint(os.path.join(self.tempdir.name, 'checkpoint'), self.tempdir.name)
+        self.assertEqual(2010, model_runner.run(model, ['checkpoint', '2010'], self.tempdir.name, checkpoint))
+        self.assertEqual(2010, checkpoint.step)
+        self.assertIsNone(model_runner.run(model, ['checkpoint', '2015'], self.tempdir.name))
+
+    def test_fork_server(self):
+        """Test every model run gets a new process forked from a fork server with the preloaded modules."""
+        model_runner = ForkServerModelRunner(processes=2, preload_module_names=['xml.dom.minidom', 'not_a_module'])
+        self.addCleanup(model_runner.close)
+        model_runner.warm()
+        model = model_runner.load('model_one', self.file_name)
+        self.assertEqual(0, model_runner._processes_count)  # pylint: disable=protected-access
+        with self.assertRaises(AttributeError):
+            model_runner.run(model_runner.load('model_two', self.file_name), ['ok'], self.tempdir.name)
+        self.assertEqual((1, [True, False]), model_runner.run(
+            model, ['modules', 'xml.dom.minidom', 'not_a_module'], self.tempdir.name))
+        self.assertEqual((1, [True]), model_runner.run(model, ['modules', 'xml.dom.minidom'], self.tempdir.name))
+        self.assertNotEqual(model_runner.run(model, ['ok'], self.tempdir.name),
+                            model_runner.run(model, ['ok'], self.tempdir.name))
+        with self.assertRaises(ValueError):
+            model_runner.run(model, ['fail'], self.tempdir.name)
+        with self.assertRaises(ChildProcessError):
+            model_runner.run(model, ['exit'], self.tempdir.name)
+        self.assertEqual(2, model_runner.concurrency)
+
+    def test_process_pool_limits(self):
+        """Test model runs out of time or memory and crashing models."""
+        model_runner = ProcessPoolModelRunner(processes=2, timeout=1, memory_limit=2 * 1024 ** 3)
+        self.addCleanup(model_runner.close)
+        model = model_runner.load('model_one', self.file_name)
+        with self.assertRaises(TimeoutError):
+            model_runner.run(model, ['sleep', '10'], self.tempdir.name)
+        with self.assertRaises(ChildProcessError):
+            model_runner.run(model, ['crash'], self.tempdir.name)
+        with self.assertRaises(ChildProcessError) as context:
+            model_runner.run(model, ['exit'], self.tempdir.name)
+        self.assertEqual('model raised SystemExit(3)', str(context.exception))
+        with self.assertRaises(MemoryError):
+            model_runner.run(model, ['allocate', str(4 * 1024 ** 3)], self.tempdir.name)
+        self.assertEqual(1024, model_runner.run(model, ['allocate', '1024'], self.tempdir.name))
+
+    def test_process_pool_timeout(self):
+        """Test the worker process of a model run out of its own time or cancelled is terminated."""
+        model_runner = ProcessPoolModelRunner(processes=1, timeout=60)
+        self.addCleanup(model_runner.close)
+        model = model_runner.load('model_one', self.file_name)
+        start = time.monotonic()
+        with self.assertRaises(ModelTimeoutError):
+            model_runner.run(model, ['sleep', '10'], self.tempdir.name, timeout=0.5)
+        timer = threading.Timer(0.5, model_runner.cancel)
+        timer.start()
+        with self.assertRaises(ModelCancelledError):
+            model_runner.run(model, ['sleep', '10'], self.tempdir.name)
+        timer.join()
+        self.assertLess(time.monotonic() - start, 5)
+        self.assertNotEqual(os.getpid(), model_runner.run(model, ['ok'], self.tempdir.name))
+
+
+if __name__ == '__main__':
+    unittest.main()
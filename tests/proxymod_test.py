@@ -10,10 +10,11 @@
 """Module to test proxymod dispatcher."""
 import json
 import os
+import tempfile
 import unittest
 from collections import namedtuple
 
-from mock import patch
+from mock import MagicMock
 from cloudevents.model import Event
 from jsonpath2.path import Path
 
@@ -22,7 +23,11 @@ from pacifica.dispatcher.downloader_runners import LocalDownloaderRunner
 from pacifica.dispatcher.uploader_runners import LocalUploaderRunner
 
 from pacifica.dispatcher_proxymod.event_handlers import ProxEventHandler, _is_valid_proxymod_config
-from pacifica.dispatcher_proxymod.event_handlers import _assert_valid_proxevent
+from pacifica.dispatcher_proxymod.event_handlers import _assert_valid_proxevent, _assert_valid_proxdependencies
+from pacifica.dispatcher_proxymod.event_handlers import _is_proxymod_memoized, _assert_valid_proxsweep
+from pacifica.dispatcher_proxymod.event_handlers import _index_proxymod_transaction_key_values
+from pacifica.dispatcher_proxymod.event_handlers import _to_proxymod_config_by_config_id
+from pacifica.dispatcher_proxymod.result_cache import ResultCache, walk_file_names
 from pacifica.dispatcher_proxymod.router import router
 from pacifica.dispatcher_proxymod.exceptions import ConfigNotFoundProxEventHandlerError
 from pacifica.dispatcher_proxymod.exceptions import InvalidConfigProxEventHandlerError
@@ -46,6 +51,36 @@ class ProxTestCase(unittest.TestCase):
         event_handler = ProxEventHandler(downloader_runner, uploader_runner)
         self.assertEqual(None, event_handler.handle(event))
 
+    def test_event_handler_result_cache(self):
+        """Test an identical event restores the results instead of running the models."""
+        def run(_model, _args, log_dir_name):
+            """Write a log file like a model would."""
+            with open(os.path.join(log_dir_name, 'stdout.log'), 'a') as log_file:
+                log_file.write('model output')
+
+        uploaded_file_names = []
+
+        def upload(basedir_name, **kwargs):
+            """Record the uploaded files then upload them locally."""
+            uploaded_file_names.append(walk_file_names(basedir_name))
+            return LocalUploaderRunner().upload(basedir_name, **kwargs)
+
+        model_runner = MagicMock(concurrency=1)
+        model_runner.run.side_effect = run
+        uploader_runner = MagicMock()
+        uploader_runner.upload.side_effect = upload
+        with tempfile.TemporaryDirectory() as cache_dir_name:
+            event_handler = ProxEventHandler(
+                LocalDownloaderRunner(os.path.join(self.basedir_name, 'data')), uploader_runner, model_runner,
+                ResultCache(cache_dir_name)
+            )
+            for _index in range(2):
+                event_handler.handle(Event(self.event_data))
+        self.assertEqual(3, model_runner.run.call_count)
+        self.assertEqual(uploaded_file_names[0], uploaded_file_names[1])
+        self.assertIn('stdout.log', uploaded_file_names[1])
+        self.assertFalse(_is_proxymod_memoized([namedtuple('TKV', ['key', 'value'])('proxymod.memoize', 'False')]))
+
     def test_proxymod_path(self):
         """Test proxymod path."""
         proxymod_path = Path.parse_file(os.path.join(
@@ -82,25 +117,143 @@ class ProxTestCase(unittest.TestCase):
         )
         self.assertEqual('proxymod configuration \'config_1\' is invalid', str(exception))
 
-    @patch('pacifica.dispatcher_proxymod.event_handlers._to_proxymod_config_by_config_id')
-    def test_bad_configs_exception(self, config_id_method):
+    def test_bad_configs_exception(self):
         """Test bad config files throw exceptions properly."""
         TKV = namedtuple('TKV', ['key', 'value'])
-        config_id_method.return_value = {'config_1': {}}
         with self.assertRaises(ConfigNotFoundProxEventHandlerError) as cnx_mgr:
-            _assert_valid_proxevent({}, self.event_data)
-            self.assertTrue('proxymod configuration' in str(cnx_mgr.exception))
-            self.assertTrue('config_2' in str(cnx_mgr.exception))
+            _assert_valid_proxevent([], self.event_data)
+        self.assertTrue('config_1' in str(cnx_mgr.exception))
         with self.assertRaises(ConfigNotFoundProxEventHandlerError) as cnx_mgr:
-            _assert_valid_proxevent([TKV(key='proxymod.configs_count', value='27')], self.event_data)
-            self.assertTrue('proxymod configuration' in str(cnx_mgr.exception))
-            self.assertTrue('config_2' in str(cnx_mgr.exception))
-        config_id_method.return_value = {'config_1': {'foo': {}}, 'config_2': {}, 'config_3': {}}
-        with self.assertRaises(InvalidConfigProxEventHandlerError) as cnx_mgr:
-            _assert_valid_proxevent([TKV(key='proxymod.configs_count', value='2')], self.event_data)
-            self.assertTrue('proxymod configuration' in str(cnx_mgr.exception))
+            _assert_valid_proxevent([
+                TKV(key='proxymod.configs_count', value='27'),
+                TKV(key='proxymod.config_1.OUTPUTS.out_dir', value='out'),
+            ], self.event_data)
+        self.assertTrue('config_2' in str(cnx_mgr.exception))
+        for key in ['proxymod.config_1.foo.bar', 'proxymod.config_1.OUTPUTS.bar']:
+            with self.assertRaises(InvalidConfigProxEventHandlerError) as cnx_mgr:
+                _assert_valid_proxevent([
+                    TKV(key='proxymod.configs_count', value='1'),
+                    TKV(key='proxymod.config_1.OUTPUTS.out_dir', value='out'),
+                    TKV(key=key, value=''),
+                ], self.event_data)
             self.assertTrue('config_1' in str(cnx_mgr.exception))
             self.assertTrue('is invalid' in str(cnx_mgr.exception))
+        with self.assertRaises(InvalidConfigProxEventHandlerError):
+            _assert_valid_proxevent([
+                TKV(key='proxymod.configs_count', value='1'),
+                TKV(key='proxymod.config_1.PROJECT.runtime', value='1'),
+            ], self.event_data)
+
+    def test_key_value_index(self):
+        """Test indexing the proxymod transaction key values."""
+        TKV = namedtuple('TKV', ['key', 'value'])
+        transaction_key_values = [
+            TKV(key='Instruments._id', value='1'),
+            TKV(key='proxymod.configs_count', value='2'),
+            TKV(key='proxymod.config_1.OUTPUTS.out_dir', value='first'),
+            TKV(key='proxymod.config_1.OUTPUTS.out_dir', value='second'),
+            TKV(key='proxymod.config_2.PROJECT.runtime', value='1'),
+            TKV(key='proxymod.memoize', value='false'),
+        ]
+        index = _index_proxymod_transaction_key_values(transaction_key_values)
+        self.assertEqual({
+            'config_1': {'OUTPUTS': {'out_dir': 'first'}},
+            'config_2': {'PROJECT': {'runtime': '1'}},
+        }, index.config_by_config_id)
+        self.assertEqual(index.config_by_config_id, _to_proxymod_config_by_config_id(transaction_key_values))
+        self.assertEqual(2, index.configs_count)
+        self.assertEqual({'config_1': True, 'config_2': False}, index.valid_by_config_id)
+        self.assertEqual([transaction_key_values[-1]], index.transaction_key_values)
+        for config_id, config in index.config_by_config_id.items():
+            self.assertEqual(_is_valid_proxymod_config(config), index.valid_by_config_id[config_id])
+
+    def test_model_dependencies(self):
+        """Test model dependencies from the transaction key values."""
+        TKV = namedtuple('TKV', ['key', 'value'])
+        model_file_insts = [
+            File(name='{0}.py'.format(name), subdir='models/') for name in ['model_1', 'model_2', 'model_3']
+        ]
+        self.assertEqual({0: set(), 1: {0}, 2: {1}}, _assert_valid_proxdependencies([], model_file_insts, None))
+        self.assertEqual({0: set(), 1: set(), 2: {0, 1}}, _assert_valid_proxdependencies([
+            TKV(key='proxymod.depends_on.model_3', value='model_1.py, model_2')
+        ], model_file_insts, None))
+        transaction_key_values = [TKV(key='proxymod.depends_on.model_3.py', value='model_1')]
+        self.assertEqual({0: set(), 1: set(), 2: {0}}, _assert_valid_proxdependencies(
+            transaction_key_values, model_file_insts, None))
+        index = _index_proxymod_transaction_key_values(transaction_key_values)
+        self.assertEqual(({}, transaction_key_values), (index.config_by_config_id, index.transaction_key_values))
+        with self.assertRaises(InvalidModelProxEventHandlerError) as cnx_mgr:
+            _assert_valid_proxdependencies([
+                TKV(key='proxymod.depends_on.model_2', value='model_4')
+            ], model_file_insts, None)
+        self.assertEqual('model_2.py', cnx_mgr.exception.file.name)
+        with self.assertRaises(InvalidModelProxEventHandlerError) as cnx_mgr:
+            _assert_valid_proxdependencies([
+                TKV(key='proxymod.depends_on.model_2', value='model_3'),
+                TKV(key='proxymod.depends_on.model_3', value='model_2'),
+            ], model_file_insts, None)
+        self.assertEqual('model_2.py', cnx_mgr.exception.file.name)
+
+    def test_sweep_variants(self):
+        """Test the variants of a sweep are every combination of the swept values."""
+        TKV = namedtuple('TKV', ['key', 'value'])
+        config_by_config_id = {
+            'config_1': {'PROJECT': {'runtime': '2', 'failure': '0'}},
+            'config_2': {'PROJECT': {'runtime': '5', 'failure': '0'}},
+        }
+        self.assertEqual({'': config_by_config_id}, _assert_valid_proxsweep([], config_by_config_id, None))
+        variants = _assert_valid_proxsweep([
+            TKV(key='proxymod.sweep.config_1.PROJECT.runtime', value='1, 2,3'),
+            TKV(key='proxymod.sweep.config_2.PROJECT.failure', value='0,1'),
+        ], config_by_config_id, None)
+        self.assertEqual(['variant_{0}'.format(index) for index in range(1, 7)], list(variants.keys()))
+        self.assertEqual([('1', '0'), ('1', '1'), ('2', '0'), ('2', '1'), ('3', '0'), ('3', '1')], [
+            (config['config_1']['PROJECT']['runtime'], config['config_2']['PROJECT']['failure'])
+            for config in variants.values()
+        ])
+        self.assertEqual('2', config_by_config_id['config_1']['PROJECT']['runtime'])
+        with self.assertRaises(ConfigNotFoundProxEventHandlerError):
+            _assert_valid_proxsweep([TKV(key='proxymod.sweep.config_3.PROJECT.runtime', value='1')],
+                                    config_by_config_id, None)
+        for value in ['1', '']:
+            with self.assertRaises(InvalidConfigProxEventHandlerError):
+                _assert_valid_proxsweep([TKV(key='proxymod.sweep.config_1.PROJECT.{0}'.format(
+                    'unknown' if value else 'runtime'), value=value)], config_by_config_id, None)
+
+    def test_event_handler_sweep(self):
+        """Test the variants of a sweep share the downloads and models and upload their results together."""
+        self.event_data['data'].append({
+            'destinationTable': 'TransactionKeyValue', 'key': 'proxymod.sweep.config_1.PROJECT.runtime',
+            'value': '1,2'
+        })
+
+        def run(_model, args, log_dir_name):
+            """Write the configuration the model ran with to its log file."""
+            with open(args[0]) as config_file, open(os.path.join(log_dir_name, 'stdout.log'), 'a') as log_file:
+                log_file.write(config_file.read())
+
+        uploaded_file_names = []
+
+        def upload(basedir_name, **kwargs):
+            """Record the uploaded files then upload them locally."""
+            uploaded_file_names.append(walk_file_names(basedir_name))
+            with open(os.path.join(basedir_name, 'variant_2', 'stdout.log')) as log_file:
+                self.assertIn('runtime = 2', log_file.read())
+            return LocalUploaderRunner().upload(basedir_name, **kwargs)
+
+        downloader_runner = MagicMock(wraps=LocalDownloaderRunner(os.path.join(self.basedir_name, 'data')))
+        model_runner = MagicMock(concurrency=2)
+        model_runner.run.side_effect = run
+        uploader_runner = MagicMock()
+        uploader_runner.upload.side_effect = upload
+        event_handler = ProxEventHandler(downloader_runner, uploader_runner, model_runner)
+        event_handler.handle(Event(self.event_data))
+        self.assertEqual(2, downloader_runner.download.call_count)
+        self.assertEqual(3, model_runner.load.call_count)
+        self.assertEqual(6, model_runner.run.call_count)
+        for variant_name in ['variant_1', 'variant_2']:
+            for file_name in ['config_1.ini', 'config_2.ini', 'config_3.ini', 'stdout.log']:
+                self.assertIn('{0}/{1}'.format(variant_name, file_name), uploaded_file_names[0])
 
 
 if __name__ == '__main__':
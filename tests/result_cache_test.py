@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# pacifica-dispatcher-proxymod: tests/result_cache_test.py
+#
+# Copyright (c) 2019, Battelle Memorial Institute
+# All rights reserved.
+#
+# See LICENSE and WARRANTY for details.
+"""Module to test the proxymod result cache."""
+import os
+import tempfile
+import unittest
+
+from pacifica.dispatcher_proxymod.result_cache import ResultCache, walk_file_names
+
+
+class ResultCacheTestCase(unittest.TestCase):
+    """Result cache unittest class."""
+
+    def setUp(self):
+        """Build the temporary cache and output directories."""
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tempdir.cleanup)
+        self.cache_dir_name = os.path.join(self.tempdir.name, 'cache')
+        self.src_dir_name = os.path.join(self.tempdir.name, 'src')
+        for file_name in ['stdout.log', os.path.join('outputs', 'out_file_1.csv')]:
+            os.makedirs(os.path.dirname(os.path.join(self.src_dir_name, file_name)), exist_ok=True)
+            with open(os.path.join(self.src_dir_name, file_name), 'w') as file:
+                file.write(file_name)
+
+    def test_store_restore(self):
+        """Test restoring the stored files of an entry."""
+        result_cache = ResultCache(self.cache_dir_name)
+        dst_dir_name = os.path.join(self.tempdir.name, 'dst')
+        self.assertFalse(result_cache.restore('key', dst_dir_name))
+        result_cache.store('key', self.src_dir_name, [os.path.join('outputs', 'out_file_1.csv')])
+        self.assertTrue(result_cache.restore('key', dst_dir_name))
+        self.assertEqual([os.path.join('outputs', 'out_file_1.csv')], walk_file_names(dst_dir_name))
+        self.assertEqual((1, 1), (result_cache.hits, result_cache.misses))
+
+    def test_eviction(self):
+        """Test the least recently used entries are evicted from a full cache."""
+        result_cache = ResultCache(self.cache_dir_name, max_size=len('stdout.log'))
+        result_cache.store('key_1', self.src_dir_name, ['stdout.log'])
+        result_cache.store('key_2', self.src_dir_name, ['stdout.log'])
+        self.assertFalse(result_cache.restore('key_1', self.src_dir_name))
+        self.assertTrue(result_cache.restore('key_2', self.src_dir_name))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# pacifica-dispatcher-proxymod: tests/schedulers_test.py
+#
+# Copyright (c) 2019, Battelle Memorial Institute
+# All rights reserved.
+#
+# See LICENSE and WARRANTY for details.
+"""Module to test the proxymod dependency graph scheduler."""
+import threading
+import time
+import unittest
+
+from mock import patch
+
+from pacifica.dispatcher_proxymod.schedulers import CycleError, run_graph, topological_order
+
+
+class SchedulersTestCase(unittest.TestCase):
+    """Dependency graph scheduler unittest class."""
+
+    def test_topological_order(self):
+        """Test nodes follow their dependencies and keep their order otherwise."""
+        self.assertEqual(['a', 'b', 'c'], topological_order(['a', 'b', 'c'], {}))
+        self.assertEqual(['b', 'c', 'a'], topological_order(['a', 'b', 'c'], {'a': {'c'}}))
+        with self.assertRaises(KeyError):
+            topological_order(['a', 'b'], {'a': {'d'}})
+        with self.assertRaises(CycleError) as cnx_mgr:
+            topological_order(['a', 'b', 'c'], {'a': {'b'}, 'b': {'a'}})
+        self.assertEqual(['a', 'b'], cnx_mgr.exception.nodes)
+        self.assertEqual('dependency cycle between a, b', str(cnx_mgr.exception))
+
+    def test_run_graph(self):
+        """Test independent nodes run at the same time and dependent nodes wait."""
+        events = []
+        lock = threading.Lock()
+
+        def func(node):
+            """Record the start and the end of the node."""
+            with lock:
+                events.append(('start', node))
+            time.sleep(0.1)
+            with lock:
+                events.append(('end', node))
+
+        run_graph(['a', 'b', 'c'], {'c': {'a', 'b'}}, func, max_workers=2)
+        self.assertEqual([('start', 'a'), ('start', 'b')], sorted(events[:2]))
+        self.assertEqual([('start', 'c'), ('end', 'c')], events[4:])
+
+    def test_run_graph_error(self):
+        """Test the first error is raised and dependent nodes never start."""
+        started = []
+
+        def func(node):
+            """Fail for the node a."""
+            started.append(node)
+            if node == 'a':
+                raise ValueError(node)
+
+        for max_workers in [1, 2]:
+            del started[:]
+            with self.assertRaises(ValueError):
+                run_graph(['a', 'b', 'c'], {'b': {'a'}, 'c': {'b'}}, func, max_workers)
+            self.assertEqual(['a'], started)
+
+    def test_run_graph_cancel(self):
+        """Test the running nodes are cancelled if the current thread raises while it waits."""
+        cancelled = threading.Event()
+
+        def func(_node):
+            """Run until cancelled."""
+            cancelled.wait(10)
+
+        with patch('concurrent.futures.wait', side_effect=KeyboardInterrupt):
+            with self.assertRaises(KeyboardInterrupt):
+                run_graph(['a', 'b'], {}, func, 2, cancelled.set)
+        self.assertTrue(cancelled.is_set())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# pacifica-dispatcher-proxymod: tests/scratch_test.py
+#
+# Copyright (c) 2019, Battelle Memorial Institute
+# All rights reserved.
+#
+# See LICENSE and WARRANTY for details.
+"""Module to test the scratch spaces of the proxymod event handler."""
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+from cloudevents.model import Event
+from mock import MagicMock
+
+from pacifica.dispatcher.downloader_runners import LocalDownloaderRunner
+
+from pacifica.dispatcher_proxymod.event_handlers import ProxEventHandler
+from pacifica.dispatcher_proxymod.exceptions import InvalidModelProxEventHandlerError
+from pacifica.dispatcher_proxymod.scratch import MemoryScratch, Scratch, ScratchFullError
+
+
+class ScratchTestCase(unittest.TestCase):
+    """Scratch unittest class."""
+
+    def setUp(self):
+        """Create the memory and disk directories of the scratch directories."""
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tempdir.cleanup)
+        self.memory_dir_name = os.path.join(self.tempdir.name, 'memory')
+        self.disk_dir_name = os.path.join(self.tempdir.name, 'disk')
+        os.makedirs(self.disk_dir_name)
+
+    def test_scratch(self):
+        """Test a scratch directory is removed when its context raises."""
+        with self.assertRaises(ValueError):
+            with Scratch(self.disk_dir_name).directory('configs-') as dir_name:
+                self.assertTrue(os.path.basename(dir_name).startswith('proxymod-configs-'))
+                with open(os.path.join(dir_name, 'config_1.ini'), 'w') as config_file:
+                    config_file.write('[OUTPUTS]\n')
+                raise ValueError('model failed')
+        self.assertEqual([], os.listdir(self.disk_dir_name))
+
+    def test_spill(self):
+        """Test the scratch directories spill to disk unless they fit in the budget and grow past it."""
+        scratch = MemoryScratch(self.memory_dir_name, max_size=10, disk_dir_name=self.disk_dir_name)
+        with scratch.directory(size=20) as disk_dir_name:
+            self.assertEqual(self.disk_dir_name, os.path.dirname(disk_dir_name))
+        with scratch.directory(size=4) as memory_dir_name:
+            self.assertEqual(self.memory_dir_name, os.path.dirname(memory_dir_name))
+            with open(os.path.join(memory_dir_name, 'out_file_1.csv'), 'w') as out_file:
+                out_file.write('a,b\n1,2\n3,4\n')
+            self.assertEqual(4, scratch.used_size())
+            with self.assertRaises(ScratchFullError):
+                scratch.charge(memory_dir_name)
+            self.assertEqual(12, scratch.used_size())
+            with scratch.directory() as disk_dir_name:
+                self.assertEqual(self.disk_dir_name, os.path.dirname(disk_dir_name))
+        self.assertEqual(0, scratch.used_size())
+        self.assertEqual({'memory': 1, 'disk': 2}, scratch.counts)
+        self.assertEqual([], os.listdir(self.memory_dir_name))
+        self.assertEqual([], os.listdir(self.disk_dir_name))
+
+    def test_remove_stale(self):
+        """Test the scratch directories in memory of exited processes are removed."""
+        exited_pid = subprocess.Popen([sys.executable, '-c', 'pass']).pid
+        os.waitpid(exited_pid, 0)
+        for pid in [exited_pid, os.getpid()]:
+            os.makedirs(os.path.join(self.memory_dir_name, 'proxymod-{0}-abc'.format(pid)))
+        os.makedirs(os.path.join(self.memory_dir_name, 'other'))
+        MemoryScratch(self.memory_dir_name)
+        self.assertEqual(['other', 'proxymod-{0}-abc'.format(os.getpid())], sorted(os.listdir(self.memory_dir_name)))
+
+    def test_event_handler(self):
+        """Test the results and the configuration files of the event are in memory and removed when a model fails."""
+        basedir_name = os.path.abspath(os.path.join('test_files', 'C234-1234-1234'))
+        with open(os.path.join(basedir_name, 'event.json'), mode='r') as event_file:
+            event_data = json.load(event_file)
+        file_names = []
+
+        def run(_model, args, log_dir_name, **_kwargs):
+            """Record the results directory and the configuration files of the model run then fail."""
+            file_names.extend([os.path.join(log_dir_name, 'stdout.log')] + args)
+            raise RuntimeError('model failed')
+
+        event_handler = ProxEventHandler(
+            LocalDownloaderRunner(os.path.join(basedir_name, 'data')), MagicMock(),
+            MagicMock(concurrency=1, run=MagicMock(side_effect=run)),
+            scratch=MemoryScratch(self.memory_dir_name, disk_dir_name=self.disk_dir_name))
+        with self.assertRaises(InvalidModelProxEventHandlerError):
+            event_handler.handle(Event(event_data))
+        self.assertLess(1, len(file_names))
+        self.assertEqual({self.memory_dir_name}, set(
+            os.path.dirname(os.path.dirname(file_name)) for file_name in file_names))
+        self.assertEqual([], os.listdir(self.memory_dir_name))
+        self.assertEqual([], os.listdir(self.disk_dir_name))
+
+    def test_event_handler_budget(self):
+        """Test a model run growing the results of the event in memory past the budget fails the event."""
+        basedir_name = os.path.abspath(os.path.join('test_files', 'C234-1234-1234'))
+        with open(os.path.join(basedir_name, 'event.json'), mode='r') as event_file:
+            event_data = json.load(event_file)
+        dir_names = []
+
+        def run(_model, _args, log_dir_name, **_kwargs):
+            """Write more results than the budget."""
+            dir_names.append(os.path.dirname(os.path.dirname(log_dir_name)))
+            with open(os.path.join(log_dir_name, 'out_file_1.csv'), 'w') as out_file:
+                out_file.write('a' * 3000)
+
+        event_handler = ProxEventHandler(
+            LocalDownloaderRunner(os.path.join(basedir_name, 'data')), MagicMock(),
+            MagicMock(concurrency=1, run=MagicMock(side_effect=run)),
+            scratch=MemoryScratch(self.memory_dir_name, max_size=2000, disk_dir_name=self.disk_dir_name))
+        with self.assertRaises(InvalidModelProxEventHandlerError) as context:
+            event_handler.handle(Event(event_data))
+        self.assertIsInstance(context.exception.reason, ScratchFullError)
+        self.assertEqual([self.memory_dir_name], dir_names)
+        self.assertEqual(0, event_handler.scratch.used_size())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# pacifica-dispatcher-proxymod: tests/timers_test.py
+#
+# Copyright (c) 2019, Battelle Memorial Institute
+# All rights reserved.
+#
+# See LICENSE and WARRANTY for details.
+"""Module to test the proxymod stage timers."""
+import os
+import json
+import unittest
+
+from cloudevents.model import Event
+from mock import MagicMock
+
+from pacifica.dispatcher.downloader_runners import LocalDownloaderRunner
+from pacifica.dispatcher.uploader_runners import LocalUploaderRunner
+
+from pacifica.dispatcher_proxymod.event_handlers import ProxEventHandler
+from pacifica.dispatcher_proxymod.timers import RecordingStageTimer, StageTimer
+from pacifica.dispatcher_proxymod.usage import ModelUsage
+
+
+class StageTimerTestCase(unittest.TestCase):
+    """Stage timer unittest class."""
+
+    def test_stage_timer(self):
+        """Test the durations of stages are recorded, even when they raise."""
+        stage_timer = RecordingStageTimer()
+        with stage_timer.stage('one'):
+            pass
+        with self.assertRaises(ValueError):
+            with stage_timer.stage('two'):
+                raise ValueError('stage failed')
+        with self.assertRaises(ValueError):
+            with stage_timer.event():
+                raise ValueError('event failed')
+        for timer in [stage_timer, StageTimer()]:
+            with timer.event():
+                with timer.stage('three'):
+                    pass
+                timer.observe_usage('model', ModelUsage(wall_seconds=1.0))
+                timer.observe_admission(None)
+        self.assertEqual(['event', 'one', 'three', 'two'], sorted(stage_timer.durations.keys()))
+        self.assertEqual({'': 1, 'ValueError': 1}, stage_timer.outcomes)
+        self.assertTrue(all(duration >= 0 for duration in stage_timer.durations['one']))
+        self.assertEqual({'model': [ModelUsage(wall_seconds=1.0)]}, stage_timer.usages)
+        self.assertEqual({'': 1}, stage_timer.admissions)
+        stage_timer.clear()
+        self.assertEqual({}, stage_timer.durations)
+        self.assertEqual({}, stage_timer.outcomes)
+        self.assertEqual({}, stage_timer.usages)
+        self.assertEqual({}, stage_timer.admissions)
+
+    def test_event_handler_stages(self):
+        """Test the event handler times each stage of handling an event and uploads the usage of the models."""
+        basedir_name = os.path.abspath(os.path.join('test_files', 'C234-1234-1234'))
+        with open(os.path.join(basedir_name, 'event.json'), mode='r') as event_file:
+            event_data = json.load(event_file)
+        stage_timer = RecordingStageTimer()
+        uploader_runner = MagicMock(wraps=LocalUploaderRunner())
+        event_handler = ProxEventHandler(
+            LocalDownloaderRunner(os.path.join(basedir_name, 'data')), uploader_runner,
+            MagicMock(concurrency=1), stage_timer=stage_timer
+        )
+        event_handler.handle(Event(event_data))
+        self.assertEqual(
+            ['config', 'download', 'event', 'import', 'run', 'upload', 'validate'],
+            sorted(stage_timer.durations.keys()))
+        self.assertEqual([1], list(set(map(len, stage_timer.durations.values()))))
+        self.assertEqual({'': 1}, stage_timer.outcomes)
+        model_names = ['loose_coupling', 'tight_coupling', 'tight_coupling_twoway']
+        self.assertEqual(model_names, sorted(stage_timer.usages.keys()))
+        transaction_key_values = uploader_runner.upload.call_args[1]['transaction_key_values']
+        self.assertEqual('Transactions._id', transaction_key_values[0].key)
+        self.assertEqual(sorted(
+            'proxymod.usage.{0}.{1}'.format(model_name, field_name)
+            for model_name in model_names for field_name in ['wall_seconds', 'written_bytes']
+        ), sorted(transaction_key_value.key for transaction_key_value in transaction_key_values[1:]))
+        self.assertEqual(['0'], list(set(
+            transaction_key_value.value for transaction_key_value in transaction_key_values
+            if transaction_key_value.key.endswith('.written_bytes')
+        )))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# pacifica-dispatcher-proxymod: tests/uploader_runners_test.py
+#
+# Copyright (c) 2019, Battelle Memorial Institute
+# All rights reserved.
+#
+# See LICENSE and WARRANTY for details.
+"""Module to test streaming the upload bundles of the proxymod event handler."""
+import gzip
+import hashlib
+import io
+import os
+import tarfile
+import tempfile
+import unittest
+
+from mock import MagicMock
+
+from pacifica.dispatcher.models import Transaction, TransactionKeyValue
+from pacifica.uploader.metadata import metadata_decode
+
+from pacifica.dispatcher_proxymod.uploader_runners import StreamingUploaderRunner
+
+
+class StreamingUploaderRunnerTestCase(unittest.TestCase):
+    """Streaming upload runner unittest class."""
+
+    def setUp(self):
+        """Create a directory of results and an uploader keeping the streamed bundle."""
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tempdir.cleanup)
+        self.contents = {
+            'config_1.ini': b'[OUTPUTS]\n',
+            'out/results.csv': b'a,b\n' + b'1,2\n' * 1000,
+            'out/archive.gz': gzip.compress(b'x' * 1000),
+        }
+        for name, content in self.contents.items():
+            os.makedirs(os.path.dirname(os.path.join(self.tempdir.name, name)), exist_ok=True)
+            with open(os.path.join(self.tempdir.name, name), 'wb') as result_file:
+                result_file.write(content)
+        self.chunks = []
+        self.uploader = MagicMock()
+        self.uploader.upload.side_effect = lambda data: self.chunks.extend(data) or 'job'
+        self.uploader.getstate.return_value = {'state': 'OK', 'task': 'ingest metadata', 'task_percent': '100'}
+
+    def _upload(self, uploader_runner):
+        """Upload the directory, returning the streamed bundle."""
+        (_bundler, job_id, _state) = uploader_runner.upload(
+            self.tempdir.name, transaction=Transaction(submitter=10, instrument=54, project='1234a'),
+            transaction_key_values=[TransactionKeyValue(key='Transactions._id', value=123)])
+        self.assertEqual('job', job_id)
+        self.assertLessEqual(max(len(chunk) for chunk in self.chunks), tarfile.RECORDSIZE)
+        self.assertEqual(0, sum(len(chunk) for chunk in self.chunks) % tarfile.RECORDSIZE)
+        return tarfile.open(fileobj=io.BytesIO(b''.join(self.chunks)))
+
+    def _assert_metadata(self, bundle):
+        """Assert the metadata lists the other members of the bundle with their hash sums."""
+        file_objs = [
+            md_obj for md_obj in metadata_decode(bundle.extractfile('metadata.txt').read().decode('utf-8'))
+            if md_obj.destinationTable == 'Files'
+        ]
+        self.assertEqual(bundle.getnames()[:-1], [
+            '/'.join(['data', file_obj.subdir, file_obj.name]).replace('data//', 'data/') for file_obj in file_objs
+        ])
+        for file_obj in file_objs:
+            content = bundle.extractfile(bundle.getnames()[file_objs.index(file_obj)]).read()
+            self.assertEqual(len(content), file_obj.size)
+            self.assertEqual(hashlib.sha1(content).hexdigest(), file_obj.hashsum)
+        return file_objs
+
+    def test_stream(self):
+        """Test the files are streamed as they are, with the manifest and the metadata."""
+        bundle = self._upload(StreamingUploaderRunner(self.uploader, chunk_size=1024))
+        self.assertEqual([
+            'data/config_1.ini', 'data/out/archive.gz', 'data/out/results.csv', 'data/manifest.sha256', 'metadata.txt'
+        ], bundle.getnames())
+        for name, content in self.contents.items():
+            self.assertEqual(content, bundle.extractfile('data/{0}'.format(name)).read())
+        self.assertEqual(''.join(
+            '{0}  {1}\n'.format(hashlib.sha256(self.contents[name]).hexdigest(), name)
+            for name in ['config_1.ini', 'out/archive.gz', 'out/results.csv']
+        ), bundle.extractfile('data/manifest.sha256').read().decode('utf-8'))
+        self.assertEqual('text/csv', self._assert_metadata(bundle)[2].mimetype)
+
+    def test_compress(self):
+        """Test the large files are compressed, unless they are compressed already."""
+        bundle = self._upload(StreamingUploaderRunner(self.uploader, compress_min_size=100, chunk_size=1024))
+        self.assertEqual([
+            'data/config_1.ini', 'data/out/archive.gz', 'data/out/results.csv.gz', 'data/manifest.sha256',
+            'metadata.txt'
+        ], bundle.getnames())
+        self.assertEqual(self.contents['out/results.csv'], gzip.decompress(
+            bundle.extractfile('data/out/results.csv.gz').read()))
+        self.assertLess(bundle.getmember('data/out/results.csv.gz').size, len(self.contents['out/results.csv']))
+        self.assertIn('{0}  out/results.csv\n'.format(hashlib.sha256(self.contents['out/results.csv']).hexdigest()),
+                      bundle.extractfile('data/manifest.sha256').read().decode('utf-8'))
+        self.assertEqual(
+            ['application/octet-stream', 'application/octet-stream', 'application/gzip', 'application/octet-stream'],
+            [file_obj.mimetype for file_obj in self._assert_metadata(bundle)])
+
+    def test_growing_file(self):
+        """Test a file growing while the bundle is streamed is bundled up to its size when it is read."""
+        log_name = os.path.join(self.tempdir.name, 'upload-stdout.log')
+        with open(log_name, 'w') as log_file:
+            log_file.write('uploading\n')
+
+        def upload(data):
+            """Write to the log file while streaming the bundle."""
+            for chunk in data:
+                with open(log_name, 'a') as log_file:
+                    log_file.write('streamed\n')
+                self.chunks.append(chunk)
+            return 'job'
+
+        self.uploader.upload.side_effect = upload
+        bundle = self._upload(StreamingUploaderRunner(self.uploader, chunk_size=1024))
+        self.assertTrue(bundle.extractfile('data/upload-stdout.log').read().startswith(b'uploading\nstreamed\n'))
+        self._assert_metadata(bundle)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# pacifica-dispatcher-proxymod: tests/usage_test.py
+#
+# Copyright (c) 2019, Battelle Memorial Institute
+# All rights reserved.
+#
+# See LICENSE and WARRANTY for details.
+"""Module to test measuring the resources used by the proxymod model runs."""
+import os
+import tempfile
+import threading
+import unittest
+
+from pacifica.dispatcher_proxymod.model_runners import LocalModelRunner, ProcessPoolModelRunner
+from pacifica.dispatcher_proxymod.usage import ModelUsage, record_usage, to_model_usage, usage_context
+
+MODEL_SOURCE = '''
+import os
+
+
+def model_one(out_dir_name, size):
+    data = bytearray(int(size))
+    with open(os.path.join(out_dir_name, 'results.csv'), 'wb') as out_file:
+        out_file.write(data[:1024])
+    return sum(range(100000))
+'''
+
+
+class UsageTestCase(unittest.TestCase):
+    """Usage unittest class."""
+
+    def setUp(self):
+        """Write the model file and create the output directory."""
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tempdir.cleanup)
+        self.file_name = os.path.join(self.tempdir.name, 'model_one.py')
+        with open(self.file_name, mode='w') as file:
+            file.write(MODEL_SOURCE)
+        self.out_dir_name = os.path.join(self.tempdir.name, 'outputs')
+        os.makedirs(self.out_dir_name)
+        with open(os.path.join(self.out_dir_name, 'before.csv'), 'w') as before_file:
+            before_file.write('unchanged\n')
+
+    def test_usage_context(self):
+        """Test the wall time, the recorded values and the bytes written are collected, even when it raises."""
+        with self.assertRaises(ValueError):
+            with usage_context([self.out_dir_name]) as usage:
+                record_usage({'cpu_seconds': 0.5, 'peak_rss_bytes': None})
+                with open(os.path.join(self.out_dir_name, 'results.csv'), 'w') as out_file:
+                    out_file.write('a,b\n')
+                raise ValueError('model failed')
+        record_usage({'cpu_seconds': 1.0})
+        model_usage = to_model_usage(usage)
+        self.assertGreaterEqual(model_usage.wall_seconds, 0)
+        self.assertEqual((0.5, None, 4), model_usage[1:])
+        self.assertEqual(ModelUsage(), to_model_usage({}))
+
+    def _assert_model_usage(self, model_runner):
+        """Assert the model runner records the CPU time and the peak memory of a model run."""
+        model = model_runner.load('model_one', self.file_name)
+        with usage_context([self.out_dir_name]) as usage:
+            model_runner.run(model, [self.out_dir_name, 64 * 1024 * 1024], self.tempdir.name)
+        model_usage = to_model_usage(usage)
+        self.assertGreater(model_usage.cpu_seconds, 0)
+        self.assertGreaterEqual(model_usage.peak_rss_bytes, 64 * 1024 * 1024)
+        self.assertEqual(1024, model_usage.written_bytes)
+
+    def test_local_model_runner(self):
+        """Test the usage of a model run in the current process is recorded."""
+        self._assert_model_usage(LocalModelRunner())
+
+    def test_local_model_runner_shared(self):
+        """Test the peak memory of the process is not recorded for model runs at the same time in the process."""
+        model_runner = LocalModelRunner()
+        started = threading.Event()
+        finished = threading.Event()
+        model_usage_by_name = {}
+
+        def run(name, model):
+            """Run the model function and save its usage."""
+            with usage_context(None) as usage:
+                model_runner.run(model, [], self.tempdir.name)
+            model_usage_by_name[name] = to_model_usage(usage)
+
+        thread = threading.Thread(target=run, args=('waiting', lambda: started.set() or finished.wait(5)))
+        thread.start()
+        started.wait(5)
+        run('finishing', finished.set)
+        thread.join()
+        self.assertEqual(['finishing', 'waiting'], sorted(model_usage_by_name.keys()))
+        for model_usage in model_usage_by_name.values():
+            self.assertIsNotNone(model_usage.cpu_seconds)
+            self.assertEqual((None, None), model_usage[2:])
+        self._assert_model_usage(model_runner)
+
+    def test_process_pool_model_runner(self):
+        """Test the usage of a model run in a worker process is recorded."""
+        model_runner = ProcessPoolModelRunner(processes=1)
+        self.addCleanup(model_runner.close)
+        self._assert_model_usage(model_runner)
+
+
+if __name__ == '__main__':
+    unittest.main()